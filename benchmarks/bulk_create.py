@@ -0,0 +1,47 @@
+"""
+Bulk invoice creation benchmark
+
+Creates --number invoices per provider against a local stand-in server, first one at a time with
+create_invoice() and then with create_invoices(), and reports throughput of both.
+
+Usage:
+    python -m benchmarks.bulk_create [--number 1000] [--concurrency 64] [--latency 0.02]
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from time import perf_counter
+
+from pyeasypay import EasyPay
+
+from .fakes import FakeServer
+from .throughput import CURRENCIES
+
+
+async def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=1000, help='Invoices per provider')
+    parser.add_argument('--concurrency', type=int, default=64, help='Creations in flight for create_invoices')
+    parser.add_argument('--latency', type=float, default=0.02, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    async with FakeServer(latency=args.latency) as server:
+        async with EasyPay(providers=server.providers(), connection_limit=args.concurrency) as pay:
+            print(f"{'provider':<11} {'one by one':>16} {'create_invoices':>16} {'errors':>6}")
+            for provider, currency in CURRENCIES.items():
+                number = args.number if provider == 'aaio' else max(args.number // 20, 1)
+                start = perf_counter()
+                for i in range(number):
+                    await pay.create_invoice(1, currency, provider, order=i)
+                sequential = number / (perf_counter() - start)
+
+                start = perf_counter()
+                errors = 0
+                async for result in pay.create_invoices((1, currency, provider, {'order': i})
+                                                        for i in range(args.number)):
+                    errors += isinstance(result, Exception)
+                bulk = args.number / (perf_counter() - start)
+                print(f'{provider:<11} {sequential:10.0f} ops/s {bulk:10.0f} ops/s {errors:6d}')
+
+
+if __name__ == '__main__':
+    run(main())
@@ -0,0 +1,60 @@
+"""
+Status check coalescing check
+
+Checks --invoices CrystalPay invoices from --callers independent Invoice objects each (UI poll, bot handler,
+background job...) all at once against a local stand-in server, then again within the status cache TTL, then
+once more after the TTL with every invoice paid in between. Concurrent checks of one invoice should share one
+request, repeated ones should be served from the cache, and paid statuses should never be requested again.
+
+Usage:
+    python -m benchmarks.check_coalescing [--invoices 100] [--callers 10] [--ttl 0.5] [--latency 0.05]
+"""
+from argparse import ArgumentParser
+from asyncio import gather, run, sleep
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay
+
+from .fakes import FakeServer
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=100, help='Distinct invoices')
+    parser.add_argument('--callers', type=int, default=10, help='Concurrent checks per invoice')
+    parser.add_argument('--ttl', type=float, default=0.5, help='Status cache TTL in seconds')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    expected = {'concurrent': args.invoices, 'within ttl': 0, 'after ttl': args.invoices, 'paid': 0}
+    failed = False
+    async with FakeServer(latency=args.latency) as server:
+        async with EasyPay(providers=server.providers(), status_cache={'ttl': args.ttl}) as pay:
+            for name in expected:
+                if name == 'after ttl':
+                    await sleep(args.ttl)
+                    server.paid.update(f'id-{i}' for i in range(args.invoices))
+                if name == 'paid':
+                    await sleep(args.ttl)
+                invoices = [await pay.invoice(provider='crystalpay', identifier=f'id-{i}', currency='RUB')
+                            for i in range(args.invoices) for _ in range(args.callers)]
+                requests = server.requests.get('/v2/invoice/info/', 0)
+                start = perf_counter()
+                await gather(*(invoice.check() for invoice in invoices))
+                elapsed = perf_counter() - start
+                requests = server.requests.get('/v2/invoice/info/', 0) - requests
+                statuses = {invoice.status for invoice in invoices}
+                print(f'{name:>10}: {len(invoices)} checks in {elapsed * 1000:6.1f} ms, {requests} requests, '
+                      f'statuses {sorted(statuses)}')
+                failed |= requests != expected[name]
+            print(pay.provider.statuses)
+
+    if failed:
+        print('FAIL: checks were not coalesced or cached as expected')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,43 @@
+"""
+CrystalPay concurrency check
+
+Runs N concurrent CrystalPay `Invoice.check()` calls against a local stand-in server with a fixed latency.
+With a non-blocking provider they overlap, so the whole batch takes about one round trip instead of N of them.
+
+Usage:
+    python -m benchmarks.crystalpay_concurrency [--checks 50] [--latency 0.2]
+"""
+from argparse import ArgumentParser
+from asyncio import gather, run
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay
+
+from .fakes import FakeServer
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checks', type=int, default=50, help='Number of concurrent checks')
+    parser.add_argument('--latency', type=float, default=0.2, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    async with FakeServer(latency=args.latency) as server:
+        async with EasyPay(providers=server.providers()) as pay:
+            invoices = [await pay.invoice(provider='crystalpay', identifier=f'id-{i}', currency='RUB')
+                        for i in range(args.checks)]
+            start = perf_counter()
+            await gather(*(invoice.check() for invoice in invoices))
+            elapsed = perf_counter() - start
+
+    round_trips = elapsed / args.latency
+    print(f'{args.checks} concurrent checks: {elapsed * 1000:.0f} ms ({round_trips:.2f} round trips)')
+    if round_trips > 2:
+        print('FAIL: checks were serialized, provider is blocking the event loop')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,231 @@
+"""
+Local stand-in servers for provider APIs
+
+One aiohttp application mimics the endpoints pyeasypay uses:
+
+    CrystalPay  POST /v2/invoice/create/, POST /v2/invoice/info/, POST /v2/balance/info/
+    Crypto Bot  GET  /api/createInvoice, GET /api/getInvoices (by ids or listing with status, offset, count),
+                GET /api/getMe, GET /api/getBalance, GET /api/getExchangeRates
+    AAIO        POST /api/info-pay, POST /api/balance
+
+Every response is delayed by latency (plus optional jitter) and error_rate of requests fail with HTTP 500.
+With rate_limit set, requests above that rate are answered with HTTP 429 and a Retry-After header.
+Credentials equal to INVALID are rejected by Crypto Bot getMe and CrystalPay balance and invoice info.
+Point providers at it with the base_url provider kwarg, see FakeServer.providers().
+"""
+from asyncio import get_running_loop, sleep
+from datetime import datetime, timezone
+from itertools import count
+from random import Random
+from typing import Dict, List, Set
+
+from aiohttp import web
+
+from pyeasypay import Provider
+
+
+INVALID = 'invalid'  # credential value the server rejects (Crypto Bot getMe, CrystalPay balance)
+
+
+class FakeServer:
+    """
+    Stand-in for CrystalPay, Crypto Bot and AAIO APIs, with configurable latency and error injection
+    """
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 paid_after: int = 0, rate_limit: float = None, seed: int = 0) -> None:
+        """
+        Args:
+            latency: Seconds every response is delayed by
+            jitter: Extra random delay up to this many seconds
+            error_rate: Share of requests answered with HTTP 500 (0..1)
+            paid_after: Invoice is reported paid starting from this status request (0 - never), invoices whose
+                identifiers are added to paid are reported paid right away
+            rate_limit: Requests per second (per path prefix, /v2 or /api) answered normally, the rest get HTTP 429
+            seed: Random seed for jitter and error injection
+        """
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.paid_after = paid_after
+        self.rate_limit = rate_limit
+        self.random = Random(seed)
+        self.throttled = 0
+        self._buckets: Dict[str, tuple] = {}
+        self.requests: Dict[str, int] = {}
+        self.checks: Dict[str, int] = {}
+        self.paid: Set[str] = set()
+        self._created: Dict[int, str] = {}
+        self._peers: Set[tuple] = set()
+        self._ids = count(1)
+        self._runner = None
+        self.url = None
+
+    def app(self) -> web.Application:
+        app = web.Application(middlewares=[self._middleware])
+        app.router.add_post('/v2/invoice/create/', self.crystalpay_create)
+        app.router.add_post('/v2/invoice/info/', self.crystalpay_info)
+        app.router.add_post('/v2/balance/info/', self.crystalpay_balance)
+        app.router.add_get('/api/createInvoice', self.cryptobot_create)
+        app.router.add_get('/api/getInvoices', self.cryptobot_get)
+        app.router.add_get('/api/getMe', self.cryptobot_me)
+        app.router.add_get('/api/getBalance', self.cryptobot_balance)
+        app.router.add_get('/api/getExchangeRates', self.cryptobot_rates)
+        app.router.add_post('/api/info-pay', self.aaio_info)
+        app.router.add_post('/api/balance', self.aaio_balance)
+        return app
+
+    async def start(self, host: str = '127.0.0.1', port: int = 0) -> str:
+        """
+        Starts server in the running event loop
+
+        Returns:
+            str: Base URL of the server
+        """
+        self._runner = web.AppRunner(self.app())
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        self.url = f'http://{host}:{site._server.sockets[0].getsockname()[1]}'
+        return self.url
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def __aenter__(self) -> 'FakeServer':
+        await self.start()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.stop()
+
+    @property
+    def connections(self) -> int:
+        """
+        Number of client connections (distinct client addresses) seen so far
+        """
+        return len(self._peers)
+
+    def providers(self) -> List[Provider]:
+        """
+        Returns providers configured to use this server
+        """
+        return [
+            Provider('crystalpay', login='login', secret='secret', salt='salt', base_url=f'{self.url}/v2'),
+            Provider('cryptobot', api_key='1:token', base_url=self.url),
+            Provider('aaio', merchant_id='merchant', api_key='key', secret='secret', secret2='secret2', base_url=self.url),
+        ]
+
+    @web.middleware
+    async def _middleware(self, request: web.Request, handler) -> web.StreamResponse:
+        self.requests[request.path] = self.requests.get(request.path, 0) + 1
+        if request.transport is not None:
+            self._peers.add(request.transport.get_extra_info('peername'))
+        if self.rate_limit and not self._allow(request.path.split('/')[1]):
+            self.throttled += 1
+            return web.Response(status=429, text='Too Many Requests',
+                                headers={'Retry-After': f'{1 / self.rate_limit:.3f}'})
+        delay = self.latency + (self.random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await sleep(delay)
+        if self.error_rate and self.random.random() < self.error_rate:
+            return web.Response(status=500, text='Injected error')
+        return await handler(request)
+
+    def _allow(self, api: str) -> bool:
+        now = get_running_loop().time()
+        tokens, updated = self._buckets.get(api, (self.rate_limit, now))
+        tokens = min(self.rate_limit, tokens + (now - updated) * self.rate_limit)
+        allowed = tokens >= 1
+        self._buckets[api] = (tokens - 1 if allowed else tokens, now)
+        return allowed
+
+    def _paid(self, identifier: str, count: bool = True) -> bool:
+        """
+        Whether invoice is paid: it is in paid or was requested paid_after times, count - this is a status request
+        """
+        checks = self.checks.get(identifier, 0) + count
+        if count:
+            self.checks[identifier] = checks
+        return identifier in self.paid or bool(self.paid_after) and checks >= self.paid_after
+
+    async def crystalpay_create(self, request: web.Request) -> web.Response:
+        await request.json()
+        identifier = f'cp-{next(self._ids)}'
+        return web.json_response({'error': False, 'errors': [], 'id': identifier,
+                                  'url': f'https://pay.crystalpay.io/?i={identifier}', 'amount': 0, 'type': 'purchase'})
+
+    async def crystalpay_info(self, request: web.Request) -> web.Response:
+        data = await request.json()
+        if data.get('auth_secret') == INVALID:
+            return web.json_response({'error': True, 'errors': ['Invalid auth credentials']})
+        identifier = data['id']
+        return web.json_response({'error': False, 'errors': [], 'id': identifier,
+                                  'state': 'payed' if self._paid(identifier) else 'notpayed'})
+
+    async def crystalpay_balance(self, request: web.Request) -> web.Response:
+        if (await request.json()).get('auth_secret') == INVALID:
+            return web.json_response({'error': True, 'errors': ['Invalid auth credentials']})
+        return web.json_response({'error': False, 'errors': [], 'balances': {'LZTMARKET': {'amount': 0}}})
+
+    def _cryptobot_invoice(self, invoice_id: int, amount: float = 1, asset: str = 'TON', count: bool = True) -> dict:
+        status = 'paid' if self._paid(str(invoice_id), count) else 'active'
+        return {
+            'invoice_id': invoice_id, 'status': status, 'hash': f'IV{invoice_id}', 'asset': asset, 'amount': amount,
+            'bot_invoice_url': f'https://t.me/CryptoTestnetBot?start=IV{invoice_id}',
+            'web_app_invoice_url': f'https://testnet-app.send.tg/invoices/IV{invoice_id}',
+            'mini_app_invoice_url': f'https://t.me/CryptoTestnetBot/app?startapp=invoice-IV{invoice_id}',
+            'created_at': self._created.get(invoice_id) or datetime.now(timezone.utc).isoformat(),
+            'allow_comments': True, 'allow_anonymous': True, 'currency_type': 'crypto',
+        }
+
+    async def cryptobot_create(self, request: web.Request) -> web.Response:
+        invoice_id = next(self._ids)
+        self._created[invoice_id] = datetime.now(timezone.utc).isoformat()
+        invoice = self._cryptobot_invoice(invoice_id, float(request.query['amount']), request.query.get('asset'),
+                                          count=False)
+        return web.json_response({'ok': True, 'result': invoice})
+
+    async def cryptobot_get(self, request: web.Request) -> web.Response:
+        ids = request.query.get('invoice_ids', '')
+        if ids:
+            if not all(invoice_id.isdigit() for invoice_id in ids.split(',') if invoice_id):
+                return web.json_response({'ok': False, 'error': {'code': 400, 'name': 'INVOICE_IDS_INVALID'}},
+                                         status=400)
+            items = [self._cryptobot_invoice(int(invoice_id)) for invoice_id in ids.split(',') if invoice_id]
+        else:
+            # listing: all created invoices newest first, listing is not a status request
+            items = [self._cryptobot_invoice(invoice_id, count=False) for invoice_id in reversed(self._created)]
+        if request.query.get('status'):
+            items = [item for item in items if item['status'] == request.query['status']]
+        if not ids:
+            offset = int(request.query.get('offset', 0))
+            items = items[offset:offset + int(request.query.get('count', 100))]
+        return web.json_response({'ok': True, 'result': {'items': items}})
+
+    async def cryptobot_me(self, request: web.Request) -> web.Response:
+        if request.headers.get('Crypto-Pay-API-Token') == INVALID:
+            return web.json_response({'ok': False, 'error': {'code': 401, 'name': 'UNAUTHORIZED'}}, status=401)
+        return web.json_response({'ok': True, 'result': {'app_id': 1, 'name': 'fake',
+                                                         'payment_processing_bot_username': 'CryptoTestnetBot'}})
+
+    async def cryptobot_balance(self, request: web.Request) -> web.Response:
+        return web.json_response({'ok': True, 'result': [{'currency_code': 'TON', 'available': 0, 'onhold': 0}]})
+
+    async def cryptobot_rates(self, request: web.Request) -> web.Response:
+        rates = [{'is_valid': True, 'is_crypto': True, 'is_fiat': False, 'source': source, 'target': target,
+                  'rate': rate} for source, target, rate in (('TON', 'USD', 5.0), ('USDT', 'USD', 1.0),
+                                                             ('TON', 'RUB', 500.0), ('USDT', 'RUB', 100.0))]
+        return web.json_response({'ok': True, 'result': rates})
+
+    async def aaio_info(self, request: web.Request) -> web.Response:
+        data = await request.post()
+        order_id = data['order_id']
+        if data.get('merchant_id') != 'merchant':
+            return web.json_response({'type': 'error', 'code': 401, 'message': 'Merchant not found'}, status=401)
+        return web.json_response({'type': 'success', 'order_id': order_id,
+                                  'status': 'success' if self._paid(order_id) else 'in_process'})
+
+    async def aaio_balance(self, request: web.Request) -> web.Response:
+        return web.json_response({'type': 'success', 'balance': 0, 'referral': 0, 'hold': 0})
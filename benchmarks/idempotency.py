@@ -0,0 +1,72 @@
+"""
+Idempotent invoice creation check
+
+Creates invoices for --orders orders, --duplicates concurrent create_invoice calls per order with the order id as
+idempotency key, against a local stand-in Crypto Bot server. Then repeats all calls, and finally repeats them from
+a new EasyPay instance sharing an SQLite store as key backend (a restarted process). Only the first round should
+reach the server, exactly once per order.
+
+Usage:
+    python -m benchmarks.idempotency [--orders 200] [--duplicates 5] [--latency 0.05]
+"""
+from argparse import ArgumentParser
+from asyncio import gather, run
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay
+from pyeasypay.core.store import InvoiceStore
+
+from .fakes import FakeServer
+
+
+async def create(pay: EasyPay, server: FakeServer, name: str, orders: int, duplicates: int,
+                 identifiers: dict, expected: int) -> bool:
+    """
+    Creates invoices for all orders, returns False if a second invoice was created for some order
+    or the number of create requests is not the expected one
+    """
+    created = server.requests.get('/api/createInvoice', 0)
+    start = perf_counter()
+    invoices = await gather(*(pay.create_invoice(1, 'TON', 'cryptobot', idempotency_key=f'order-{order}')
+                              for order in range(orders) for _ in range(duplicates)))
+    elapsed = perf_counter() - start
+    requests = server.requests.get('/api/createInvoice', 0) - created
+    print(f'{name:>9}: {len(invoices)} calls in {elapsed * 1000:.1f} ms, {requests} create requests, '
+          f'{pay.idempotency!r}')
+    unique = all(identifiers.setdefault(index // duplicates, str(invoice.identifier)) == str(invoice.identifier)
+                 for index, invoice in enumerate(invoices))
+    return unique and requests == expected
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--orders', type=int, default=200, help='Orders')
+    parser.add_argument('--duplicates', type=int, default=5, help='Concurrent create_invoice calls per order')
+    parser.add_argument('--latency', type=float, default=0.05, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    identifiers = {}
+    with TemporaryDirectory() as directory:
+        database = f'sqlite+aiosqlite:///{Path(directory) / "invoices.db"}'
+        async with FakeServer(latency=args.latency) as server:
+            async with EasyPay(providers=server.providers()) as pay:
+                async with InvoiceStore(pay, database) as store:
+                    pay.idempotency.backend = store
+                    ok = await create(pay, server, 'first', args.orders, args.duplicates, identifiers, args.orders)
+                    ok &= await create(pay, server, 'repeated', args.orders, 1, identifiers, 0)
+            async with EasyPay(providers=server.providers()) as pay:
+                async with InvoiceStore(pay, database) as store:
+                    pay.idempotency.backend = store
+                    ok &= await create(pay, server, 'restarted', args.orders, 1, identifiers, 0)
+
+    if not ok:
+        print('FAIL: duplicate invoices were created for the same idempotency key')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,60 @@
+"""
+Import-time budget for pyeasypay
+
+Runs `import pyeasypay` in a fresh interpreter and fails if it takes longer than the budget
+or pulls in any of the heavy provider dependencies (those must only be imported on first use).
+
+Usage:
+    python -m benchmarks.import_time [--budget 0.25] [--runs 5]
+"""
+from argparse import ArgumentParser
+from os.path import dirname, abspath
+import subprocess
+import sys
+
+
+HEAVY_MODULES = ('aiohttp', 'aiocryptopay', 'requests', 'sqlalchemy')
+
+PROBE = f'''
+import sys, time
+start = time.perf_counter()
+import pyeasypay
+elapsed = time.perf_counter() - start
+loaded = [m for m in {HEAVY_MODULES!r} if m in sys.modules]
+print(elapsed, ','.join(loaded))
+'''
+
+
+def measure() -> tuple[float, list[str]]:
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE], capture_output=True, text=True, check=True,
+        cwd=dirname(dirname(abspath(__file__)))
+    ).stdout.split()
+    return float(output[0]), output[1].split(',') if len(output) > 1 else []
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--budget', type=float, default=0.25, help='Maximum import time in seconds')
+    parser.add_argument('--runs', type=int, default=5, help='Number of fresh interpreters to measure')
+    args = parser.parse_args()
+
+    timings = []
+    for _ in range(args.runs):
+        elapsed, loaded = measure()
+        if loaded:
+            print(f'FAIL: import pyeasypay loaded heavy modules: {", ".join(loaded)}')
+            return 1
+        timings.append(elapsed)
+
+    best = min(timings)
+    print(f'import pyeasypay: best {best * 1000:.1f} ms, worst {max(timings) * 1000:.1f} ms '
+          f'(budget {args.budget * 1000:.0f} ms)')
+    if best > args.budget:
+        print('FAIL: import time budget exceeded')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
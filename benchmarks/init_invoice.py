@@ -0,0 +1,35 @@
+"""
+Invoice.init_invoice microbenchmark
+
+Measures the cost of binding an invoice to its provider, which happens on every invoice creation
+and on the first check of an invoice restored from storage. No network requests are made.
+
+Usage:
+    python -m benchmarks.init_invoice [--number 20000]
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from time import perf_counter
+
+from pyeasypay import EasyPay, Invoice, Provider
+
+
+async def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help='Number of invoices to bind')
+    args = parser.parse_args()
+
+    async with EasyPay(providers=[Provider('cryptobot', api_key='token')]) as pay:
+        invoices = [Invoice(pay.provider, amount=1, currency='TON') for _ in range(args.number)]
+        await invoices[0].init_invoice('cryptobot')  # first use imports the provider module
+
+        start = perf_counter()
+        for invoice in invoices:
+            await invoice.init_invoice('cryptobot')
+        elapsed = perf_counter() - start
+
+    print(f'init_invoice: {elapsed / args.number * 1e6:.2f} us per invoice ({args.number} invoices)')
+
+
+if __name__ == '__main__':
+    run(main())
@@ -0,0 +1,47 @@
+"""
+Memory per invoice benchmark
+
+Allocates pending invoices the way an application restoring them from storage does (bound to their provider,
+as after the first check) and reports traced memory per invoice and the number of objects left for the cyclic GC.
+
+Usage:
+    python -m benchmarks.invoice_memory [--number 100000]
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from datetime import datetime
+import gc
+import tracemalloc
+
+from pyeasypay import EasyPay, Invoice, Provider
+
+
+async def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=100000, help='Number of invoices to allocate')
+    args = parser.parse_args()
+
+    async with EasyPay(providers=[Provider('cryptobot', api_key='token')]) as pay:
+        await Invoice(pay.provider, currency='TON').init_invoice('cryptobot')  # import provider module first
+        gc.collect()
+        gc.disable()
+        tracemalloc.start()
+        invoices = []
+        for number in range(args.number):
+            invoice = Invoice(pay.provider, provider='cryptobot', identifier=number, status='active', amount=1.5,
+                              currency='TON', pay_info=f'https://t.me/CryptoBot?start=IV{number}',
+                              created_at=datetime.now())
+            await invoice.init_invoice('cryptobot')
+            invoices.append(invoice)
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del invoices
+        collected = gc.collect()
+        gc.enable()
+
+    print(f'{current / args.number:.0f} bytes per invoice ({args.number} invoices), '
+          f'{collected / args.number:.1f} objects per invoice collected by cyclic GC')
+
+
+if __name__ == '__main__':
+    run(main())
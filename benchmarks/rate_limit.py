@@ -0,0 +1,75 @@
+"""
+Rate limit check
+
+Runs a burst of CrystalPay checks against a local stand-in server that answers HTTP 429 above --server-rate
+requests per second, first without limits and then with the rate_limit provider kwarg, and creates a few
+invoices in the middle of the burst. With limits the provider should see (almost) no 429 responses, every
+check should succeed, and creates should overtake the queued checks.
+
+Usage:
+    python -m benchmarks.rate_limit [--checks 300] [--creates 10] [--server-rate 100] [--latency 0.01]
+"""
+from argparse import ArgumentParser
+from asyncio import gather, run, sleep
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay, Provider
+
+from .fakes import FakeServer
+
+
+async def burst(server: FakeServer, checks: int, creates: int, **limits) -> dict:
+    provider = Provider('crystalpay', login='login', secret='secret', base_url=f'{server.url}/v2', **limits)
+    server.throttled = 0
+    async with EasyPay(providers=[provider]) as pay:
+        invoices = [await pay.invoice(provider='crystalpay', identifier=f'id-{i}', currency='RUB')
+                    for i in range(checks)]
+        start = perf_counter()
+
+        async def check(invoice) -> float:
+            await invoice.check()
+            return perf_counter() - start
+
+        async def create() -> float:
+            await sleep(0.05)
+            begin = perf_counter()
+            await pay.create_invoice(1, 'RUB', 'crystalpay')
+            return perf_counter() - begin
+
+        results = await gather(*(check(invoice) for invoice in invoices), *(create() for _ in range(creates)),
+                               return_exceptions=True)
+        elapsed = perf_counter() - start
+    check_results, create_results = results[:checks], results[checks:]
+    errors = [result for result in results if isinstance(result, BaseException)]
+    done = sorted(result for result in check_results if not isinstance(result, BaseException))
+    create_latency = max((result for result in create_results if not isinstance(result, BaseException)),
+                         default=float('nan'))
+    return {'elapsed': elapsed, 'throttled': server.throttled, 'errors': len(errors),
+            'create': create_latency, 'check_p50': done[len(done) // 2] if done else float('nan')}
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checks', type=int, default=300, help='Number of concurrent checks')
+    parser.add_argument('--creates', type=int, default=10, help='Number of creates issued during the burst')
+    parser.add_argument('--server-rate', type=float, default=100, help='Requests per second the server accepts')
+    parser.add_argument('--latency', type=float, default=0.01, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    async with FakeServer(latency=args.latency, rate_limit=args.server_rate) as server:
+        print(f"{'mode':<9} {'elapsed':>9} {'429s':>6} {'errors':>6} {'create':>10} {'check p50':>10}")
+        for mode, limits in (('unlimited', {}), ('limited', {'rate_limit': args.server_rate * 0.9})):
+            result = await burst(server, args.checks, args.creates, **limits)
+            print(f"{mode:<9} {result['elapsed'] * 1000:7.0f} ms {result['throttled']:6d} {result['errors']:6d} "
+                  f"{result['create'] * 1000:7.0f} ms {result['check_p50'] * 1000:7.0f} ms")
+            await sleep(1)  # let the server bucket refill
+
+    if result['errors'] or result['throttled'] > args.server_rate * 0.1 or result['create'] > result['check_p50']:
+        print('FAIL: limited run was throttled, failed, or creates waited behind checks')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,43 @@
+"""
+Exchange rate cache check
+
+Converts --number amounts concurrently with a cold cache against a local stand-in Crypto Bot server, then again
+with a warm one, and reports how many rate fetches reached the server and the conversion latency. All concurrent
+callers should share a single fetch, and warm conversions should not touch the network at all.
+
+Usage:
+    python -m benchmarks.rates [--number 1000] [--latency 0.1]
+"""
+from argparse import ArgumentParser
+from asyncio import gather, run
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay
+
+from .fakes import FakeServer
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=1000, help='Concurrent conversions')
+    parser.add_argument('--latency', type=float, default=0.1, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    async with FakeServer(latency=args.latency) as server:
+        async with EasyPay(providers=server.providers(), rates='cryptobot') as pay:
+            for cache in ('cold', 'warm'):
+                start = perf_counter()
+                await gather(*(pay.rates.convert(10, 'USD', 'RUB') for _ in range(args.number)))
+                elapsed = perf_counter() - start
+                fetches = server.requests.get('/api/getExchangeRates', 0)
+                print(f'{cache}: {args.number} conversions in {elapsed * 1000:.1f} ms, {fetches} rate fetches')
+
+    if fetches != 1:
+        print('FAIL: concurrent conversions triggered duplicate rate fetches')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,69 @@
+"""
+Reconciliation check
+
+Creates --number Crypto Bot invoices against a local stand-in server and saves them into an SQLite store, then
+marks --paid-share of them paid on the server while nothing polls them (an outage). Catches up once with
+check_many over all pending invoices from the store and once with reconcile() over paid invoice listings down to
+the oldest pending invoice, and reports provider requests, time and invoices found paid. Both must find exactly
+the invoices paid during the outage, reconcile() with a fraction of the requests.
+
+Usage:
+    python -m benchmarks.reconcile [--number 20000] [--paid-share 0.05] [--latency 0.02]
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from pathlib import Path
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay
+from pyeasypay.core.store import InvoiceStore
+
+from .fakes import FakeServer
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help='Pending invoices')
+    parser.add_argument('--paid-share', type=float, default=0.05, help='Share of invoices paid during the outage')
+    parser.add_argument('--latency', type=float, default=0.02, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    results = {}
+    with TemporaryDirectory() as directory:
+        database = f'sqlite+aiosqlite:///{Path(directory) / "invoices.db"}'
+        async with FakeServer() as server:
+            async with EasyPay(providers=server.providers()) as pay:
+                async with InvoiceStore(pay, database) as store:
+                    await store.add_many([invoice async for invoice in pay.create_invoices(
+                        (1, 'TON', 'cryptobot') for _ in range(args.number))])
+                    identifiers = [invoice.identifier async for invoice in store.pending()]
+                    paid = set(Random(0).sample(identifiers, int(len(identifiers) * args.paid_share)))
+                    server.paid.update(paid)
+                    server.latency = args.latency
+
+                    for name in ('check_many', 'reconcile'):
+                        requests = server.requests.get('/api/getInvoices', 0)
+                        start = perf_counter()
+                        if name == 'check_many':
+                            found = {invoice.identifier async for invoice in pay.check_many(store.pending())
+                                     if invoice.status == 'paid'}
+                        else:
+                            since = await store.oldest_pending('cryptobot')
+                            found = {invoice.identifier async for invoice in pay.reconcile(
+                                'cryptobot', since=since, lookup=store.get_many)}
+                        elapsed = perf_counter() - start
+                        results[name] = found
+                        print(f'{name:>10}: {server.requests.get("/api/getInvoices", 0) - requests:5} requests, '
+                              f'{elapsed * 1000:8.1f} ms, {len(found)} of {len(paid)} paid invoices found')
+
+    if any(found != {str(identifier) for identifier in paid} for found in results.values()):
+        print('FAIL: catch-up missed paid invoices or reported unpaid ones')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,85 @@
+"""
+Timeouts, retries and circuit breaker check
+
+Runs CrystalPay and Crypto Bot checks against a local stand-in server in three phases:
+
+    flaky   --error-rate of requests fail with HTTP 500, retries should hide (almost) all of them
+    hanging server takes --hang seconds to answer, every call should fail after about --timeout seconds
+    down    every request fails, the circuit breaker should open and later calls fail fast
+
+Usage:
+    python -m benchmarks.resilience [--checks 200] [--error-rate 0.1] [--timeout 0.2] [--hang 5]
+"""
+from argparse import ArgumentParser
+from asyncio import gather, run
+from time import perf_counter
+from typing import List
+import sys
+
+from pyeasypay import CircuitOpenError, EasyPay, Provider
+
+from .fakes import FakeServer
+
+
+def percentile(values: List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else float('nan')
+
+
+async def phase(pay: EasyPay, provider: str, currency: str, checks: int) -> dict:
+    invoices = [await pay.invoice(provider=provider, identifier=str(i + 1), currency=currency) for i in range(checks)]
+    latencies, errors, fast_failures = [], 0, 0
+
+    async def check(invoice) -> None:
+        nonlocal errors, fast_failures
+        start = perf_counter()
+        try:
+            await invoice.check()
+        except CircuitOpenError:
+            fast_failures += 1
+        except Exception:
+            errors += 1
+        latencies.append(perf_counter() - start)
+
+    await gather(*(check(invoice) for invoice in invoices))
+    return {'errors': errors, 'fast': fast_failures, 'p50': percentile(latencies, 0.5),
+            'p99': percentile(latencies, 0.99)}
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--checks', type=int, default=200, help='Concurrent checks per phase and provider')
+    parser.add_argument('--error-rate', type=float, default=0.1, help='Share of failing requests in flaky phase')
+    parser.add_argument('--timeout', type=float, default=0.2, help='Provider request timeout in seconds')
+    parser.add_argument('--hang', type=float, default=5, help='Server latency in hanging phase in seconds')
+    args = parser.parse_args()
+
+    failed = False
+    async with FakeServer(latency=0.01) as server:
+        providers = [
+            Provider('crystalpay', login='login', secret='secret', base_url=f'{server.url}/v2', timeout=args.timeout),
+            Provider('cryptobot', api_key='1:token', base_url=server.url, timeout=args.timeout),
+        ]
+        print(f"{'provider':<11} {'phase':<8} {'errors':>6} {'fast fails':>10} {'p50':>10} {'p99':>10}")
+        for provider, currency in (('crystalpay', 'RUB'), ('cryptobot', 'TON')):
+            async with EasyPay(providers=providers, status_cache={'ttl': 0}) as pay:  # phases reuse ids
+                for name, latency, error_rate in (('flaky', 0.01, args.error_rate), ('hanging', args.hang, 0.0),
+                                                  ('down', 0.01, 1.0)):
+                    server.latency, server.error_rate = latency, error_rate
+                    result = await phase(pay, provider, currency, args.checks)
+                    print(f"{provider:<11} {name:<8} {result['errors']:6d} {result['fast']:10d} "
+                          f"{result['p50'] * 1000:7.0f} ms {result['p99'] * 1000:7.0f} ms")
+                    if name == 'flaky' and result['errors'] > args.checks * args.error_rate ** 3 * 10 + 1:
+                        failed = True
+                    if name == 'hanging' and result['p99'] > args.timeout * 4:
+                        failed = True
+                    if name == 'down' and not result['fast']:
+                        failed = True
+    if failed:
+        print('FAIL: retries, timeouts or circuit breaker did not bound failures and latency')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,73 @@
+"""
+Provider routing check
+
+Creates RUB invoices without naming a provider while CrystalPay and Crypto Bot are served by two local stand-in
+servers with different latency. With the fastest policy most invoices should go to the faster provider (load is
+still spread by requests in flight). Then the faster provider goes down and every invoice should still be created
+through failover. Finally the ordered policy must rank providers in the order they were added, whatever the
+order of the provider registry.
+
+Usage:
+    python -m benchmarks.routing [--invoices 200] [--fast 0.01] [--slow 0.1]
+"""
+from argparse import ArgumentParser
+from collections import Counter
+from asyncio import gather, run
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay, Provider
+
+from .fakes import FakeServer
+
+
+async def create(pay: EasyPay, invoices: int) -> tuple:
+    start = perf_counter()
+    results = await gather(*(pay.create_invoice(1, 'RUB') for _ in range(invoices)), return_exceptions=True)
+    elapsed = perf_counter() - start
+    errors = sum(isinstance(result, BaseException) for result in results)
+    used = Counter(result.provider for result in results if not isinstance(result, BaseException))
+    return elapsed, errors, used
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--invoices', type=int, default=200, help='Invoices per phase')
+    parser.add_argument('--fast', type=float, default=0.01, help='Latency of the fast server in seconds')
+    parser.add_argument('--slow', type=float, default=0.1, help='Latency of the slow server in seconds')
+    args = parser.parse_args()
+
+    failed = False
+    async with FakeServer(latency=args.slow) as slow, FakeServer(latency=args.fast) as fast:
+        providers = [
+            Provider('crystalpay', login='login', secret='secret', base_url=f'{slow.url}/v2'),
+            Provider('cryptobot', api_key='1:token', base_url=fast.url, currencies=('RUB', 'TON')),
+        ]
+        async with EasyPay(providers=providers) as pay:
+            for phase in ('warm-up', 'steady', 'fast down'):
+                if phase == 'fast down':
+                    fast.error_rate = 1.0
+                elapsed, errors, used = await create(pay, args.invoices if phase != 'warm-up' else 2)
+                print(f'{phase:<10} {elapsed * 1000:7.0f} ms  errors {errors:3d}  {dict(used)}')
+                if phase == 'steady' and used['cryptobot'] < args.invoices * 0.75:
+                    failed = True
+                if phase == 'fast down' and (errors or used['crystalpay'] != args.invoices):
+                    failed = True
+            print(pay.router)
+        for order in (('crystalpay', 'aaio'), ('aaio', 'crystalpay')):
+            added = [{'crystalpay': providers[0], 'aaio': Provider('aaio', merchant_id='merchant', api_key='key',
+                                                                  secret='secret', base_url=fast.url)}[name]
+                     for name in order]
+            async with EasyPay(providers=added, routing='ordered') as pay:
+                ranked = tuple(creds.name for creds in pay.router.rank('RUB'))
+            print(f'ordered    added {order}, ranked {ranked}')
+            failed |= ranked != order
+
+    if failed:
+        print('FAIL: invoices were not routed to the faster provider, failover did not work or the order was lost')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
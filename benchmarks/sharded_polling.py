@@ -0,0 +1,114 @@
+"""
+Sharded polling check
+
+Saves --number pending invoices into an SQLite database and polls them with --workers ShardWorker processes
+against a local stand-in server that reports an invoice paid on its third status request. One worker is killed
+midway without releasing its leases; its shards must be taken over once the leases expire. Reports time until
+every invoice is paid in the database and status requests above the 3 per invoice a single poller would make.
+Only checks the killed worker had in flight may be repeated, live workers must never poll the same invoice.
+
+Usage:
+    python -m benchmarks.sharded_polling [--number 2000] [--workers 4] [--lease-time 2]
+"""
+from argparse import ArgumentParser
+from asyncio import get_running_loop, run, sleep
+from datetime import datetime
+from multiprocessing import get_context
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+import sys
+
+from sqlalchemy import func, select
+
+from pyeasypay import EasyPay, Invoice, Provider
+from pyeasypay.core.store import InvoiceStore, ShardWorker, invoices
+
+from .fakes import FakeServer
+
+
+PAID_AFTER = 3
+
+
+def providers(url: str) -> list:
+    return [Provider('cryptobot', api_key='1:token', base_url=url),
+            Provider('crystalpay', login='login', secret='secret', salt='salt', base_url=f'{url}/v2')]
+
+
+async def work(url: str, database: str, lease_time: float, interval: float) -> None:
+    async with EasyPay(providers=providers(url)) as pay:
+        async with InvoiceStore(pay, database, connect_args={'timeout': 30}) as store:
+            await ShardWorker(store, lease_time=lease_time, interval=interval).run()
+
+
+def worker_main(url: str, database: str, lease_time: float, interval: float) -> None:
+    try:
+        run(work(url, database, lease_time, interval))
+    except KeyboardInterrupt:
+        pass
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000, help='Pending invoices')
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes')
+    parser.add_argument('--lease-time', type=float, default=2, help='Shard lease time in seconds')
+    parser.add_argument('--latency', type=float, default=0.01, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+    interval = args.lease_time / 4
+
+    with TemporaryDirectory() as directory:
+        database = f'sqlite+aiosqlite:///{Path(directory) / "invoices.db"}'
+        async with FakeServer(latency=args.latency, paid_after=PAID_AFTER) as server:
+            async with EasyPay(providers=providers(server.url)) as pay:
+                async with InvoiceStore(pay, database) as store:
+                    now = datetime.now()
+                    await store.add_many(
+                        Invoice(pay.provider, provider='cryptobot', identifier=str(i), status='active', amount=1,
+                                currency='TON', created_at=now) if i % 2 else
+                        Invoice(pay.provider, provider='crystalpay', identifier=f'cp-{i}', status='notpayed',
+                                amount=100, currency='RUB', created_at=now)
+                        for i in range(1, args.number + 1)
+                    )
+
+                    context = get_context('spawn')
+                    processes = [context.Process(target=worker_main, daemon=True,
+                                                 args=(server.url, database, args.lease_time, interval))
+                                 for _ in range(args.workers)]
+                    start = perf_counter()
+                    for process in processes:
+                        process.start()
+                    killed = False
+                    pending = args.number
+                    while pending and perf_counter() - start < 60:
+                        await sleep(0.2)
+                        if not killed and sum(server.checks.values()) >= args.number:
+                            processes[0].kill()  # no chance to release leases
+                            killed = True
+                            print(f'killed one worker after {perf_counter() - start:.2f}s')
+                        async with store.engine.connect() as conn:
+                            pending = (await conn.execute(
+                                select(func.count()).select_from(invoices)
+                                .where(invoices.c.status.not_in(('paid', 'payed')))
+                            )).scalar()
+                    elapsed = perf_counter() - start
+                    for process in processes:
+                        process.terminate()
+                    await get_running_loop().run_in_executor(None, lambda: [p.join() for p in processes])
+
+    checks = sum(server.checks.values())
+    extra = checks - PAID_AFTER * args.number
+    repeated = sum(count > PAID_AFTER for count in server.checks.values())
+    print(f'{args.number} invoices, {args.workers} workers: all paid in {elapsed:.2f}s, {pending} left pending')
+    print(f'{checks} status requests, {extra} above {PAID_AFTER} per invoice, {repeated} invoices polled extra')
+    if pending:
+        print('FAIL: invoices left pending, shards of the killed worker were not taken over')
+        return 1
+    if extra > store.batch_size:
+        print('FAIL: live workers polled the same invoices')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -0,0 +1,77 @@
+"""
+Synchronous client check
+
+Creates and checks --number Crypto Bot invoices from --threads threads against a local stand-in server, once
+the way sync code usually does it (asyncio.run() and a new EasyPay per call) and once through one shared
+SyncEasyPay, and reports throughput and TCP connections opened. The shared client should reuse pooled
+connections and serve all threads concurrently.
+
+Usage:
+    python -m benchmarks.sync_client [--number 500] [--threads 32] [--latency 0.02]
+"""
+from argparse import ArgumentParser
+from asyncio import new_event_loop, run
+from concurrent.futures import ThreadPoolExecutor
+from threading import Thread
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay, SyncEasyPay
+
+from .fakes import FakeServer
+
+
+def per_call(server: FakeServer) -> None:
+    async def create_and_check():
+        async with EasyPay(providers=server.providers()) as pay:
+            invoice = await pay.create_invoice(1, 'TON', 'cryptobot')
+            await invoice.check()
+
+    run(create_and_check())
+
+
+def shared(pay: SyncEasyPay) -> None:
+    pay.check(pay.create_invoice(1, 'TON', 'cryptobot'))
+
+
+def measure(name: str, call, number: int, threads: int, server: FakeServer) -> float:
+    connections = server.connections
+    start = perf_counter()
+    with ThreadPoolExecutor(threads) as executor:
+        for future in [executor.submit(call) for _ in range(number)]:
+            future.result()
+    elapsed = perf_counter() - start
+    print(f'{name:>14}: {number / elapsed:8.0f} ops/s, {server.connections - connections} connections')
+    return number / elapsed
+
+
+def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=500, help='Invoices created and checked')
+    parser.add_argument('--threads', type=int, default=32, help='Caller threads')
+    parser.add_argument('--latency', type=float, default=0.02, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    loop = new_event_loop()
+    server = FakeServer(latency=args.latency)
+    loop.run_until_complete(server.start())
+    thread = Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        before = measure('asyncio.run()', lambda: per_call(server), args.number, args.threads, server)
+        with SyncEasyPay(providers=server.providers()) as pay:
+            after = measure('SyncEasyPay', lambda: shared(pay), args.number, args.threads, server)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(server.stop())
+        loop.close()
+
+    if after < before:
+        print('FAIL: shared client is slower than a new event loop per call')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
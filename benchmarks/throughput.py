@@ -0,0 +1,90 @@
+"""
+Create and check throughput benchmark against local stand-in servers
+
+For every provider creates --number invoices and then checks them, --concurrency operations at a time,
+and reports throughput, p50/p99 latency, errors and (with --memory) peak traced memory.
+
+Usage:
+    python -m benchmarks.throughput [--number 2000] [--concurrency 100] [--latency 0.02] [--error-rate 0]
+                                    [--providers crystalpay,cryptobot,aaio] [--memory]
+"""
+from argparse import ArgumentParser
+from asyncio import Semaphore, gather, run
+from collections.abc import Awaitable, Callable
+from time import perf_counter
+from typing import List
+import tracemalloc
+
+from pyeasypay import EasyPay, Invoice
+
+from .fakes import FakeServer
+
+
+CURRENCIES = {'crystalpay': 'RUB', 'cryptobot': 'TON', 'aaio': 'RUB'}
+
+
+def percentile(values: List[float], share: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))] if values else float('nan')
+
+
+async def measure(operations: List[Callable[[], Awaitable]], concurrency: int) -> dict:
+    semaphore = Semaphore(concurrency)
+    latencies, errors = [], 0
+
+    async def run_one(operation: Callable[[], Awaitable]) -> None:
+        nonlocal errors
+        async with semaphore:
+            start = perf_counter()
+            try:
+                await operation()
+            except Exception:
+                errors += 1
+            latencies.append(perf_counter() - start)
+
+    start = perf_counter()
+    await gather(*(run_one(operation) for operation in operations))
+    elapsed = perf_counter() - start
+    return {'ops': len(operations) / elapsed, 'p50': percentile(latencies, 0.5) * 1000,
+            'p99': percentile(latencies, 0.99) * 1000, 'errors': errors}
+
+
+def report(provider: str, operation: str, result: dict, peak: int | None) -> None:
+    memory = f' {peak / 1024 / 1024:8.1f} MiB' if peak is not None else ''
+    print(f"{provider:<11} {operation:<7} {result['ops']:9.0f} ops/s {result['p50']:8.2f} ms "
+          f"{result['p99']:8.2f} ms {result['errors']:6d}{memory}")
+
+
+async def main() -> None:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=2000, help='Invoices per provider')
+    parser.add_argument('--concurrency', type=int, default=100, help='Operations in flight')
+    parser.add_argument('--latency', type=float, default=0.02, help='Stand-in server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Extra random latency in seconds')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests failing with HTTP 500')
+    parser.add_argument('--providers', default='crystalpay,cryptobot,aaio', help='Comma separated providers')
+    parser.add_argument('--memory', action='store_true', help='Trace peak memory (slows everything down)')
+    args = parser.parse_args()
+
+    async with FakeServer(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate) as server:
+        async with EasyPay(providers=server.providers(), connection_limit=args.concurrency) as pay:
+            print(f"{'provider':<11} {'op':<7} {'throughput':>15} {'p50':>11} {'p99':>11} {'errors':>6}"
+                  f"{' peak memory' if args.memory else ''}")
+            for provider in args.providers.split(','):
+                invoices = [Invoice(pay.provider, amount=1, currency=CURRENCIES[provider])
+                            for _ in range(args.number)]
+                for operation, operations in (
+                    ('create', [lambda invoice=invoice: invoice.create(provider) for invoice in invoices]),
+                    ('check', [lambda invoice=invoice: invoice.check() for invoice in invoices]),
+                ):
+                    if args.memory:
+                        tracemalloc.start()
+                    result = await measure(operations, args.concurrency)
+                    peak = tracemalloc.get_traced_memory()[1] if args.memory else None
+                    if args.memory:
+                        tracemalloc.stop()
+                    report(provider, operation, result, peak)
+
+
+if __name__ == '__main__':
+    run(main())
@@ -0,0 +1,65 @@
+"""
+Warm-up check
+
+Measures latency of the first invoice created with every provider right after start, without and with
+EasyPay.warmup(), against a local stand-in server, then warms up accounts with invalid credentials, which
+should be reported as not ready instead of failing the first checkout.
+
+Usage:
+    python -m benchmarks.warmup [--latency 0.02]
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from time import perf_counter
+import sys
+
+from pyeasypay import EasyPay, Provider
+
+from .fakes import INVALID, FakeServer
+
+
+CURRENCIES = {'crystalpay': 'RUB', 'cryptobot': 'TON', 'aaio': 'RUB'}
+
+
+async def first_invoices(server: FakeServer, warmup: bool) -> dict:
+    async with EasyPay(providers=server.providers()) as pay:
+        if warmup:
+            start = perf_counter()
+            readiness = await pay.warmup()
+            print(f'warmup took {(perf_counter() - start) * 1000:.1f} ms: {readiness}')
+        latencies = {}
+        for name, currency in CURRENCIES.items():
+            start = perf_counter()
+            invoice = await pay.create_invoice(10, currency, name)
+            await invoice.check()
+            latencies[name] = perf_counter() - start
+        return latencies
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.02, help='Stand-in server latency in seconds')
+    args = parser.parse_args()
+
+    async with FakeServer(latency=args.latency) as server:
+        cold = await first_invoices(server, False)
+        warm = await first_invoices(server, True)
+        print(f"{'provider':<12}{'cold':>12}{'warm':>12}")
+        for name in CURRENCIES:
+            print(f'{name:<12}{cold[name] * 1000:>9.1f} ms{warm[name] * 1000:>9.1f} ms')
+
+        async with EasyPay(providers=[
+            Provider('cryptobot', api_key=INVALID, base_url=server.url),
+            Provider('crystalpay', login='login', secret=INVALID, base_url=f'{server.url}/v2'),
+        ]) as pay:
+            invalid = await pay.warmup()
+        print(f'invalid credentials: {invalid}')
+
+    if any(readiness.ready for readiness in invalid):
+        print('FAIL: invalid credentials were reported as ready')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
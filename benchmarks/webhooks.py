@@ -0,0 +1,112 @@
+"""
+Webhook verification check
+
+Signs payment notifications for every provider with webhooks (Crypto Bot, CrystalPay, AAIO) the way the
+provider does and posts them to the embedded webhook receiver: valid ones must mark the invoice paid, tampered
+ones (changed after signing or signed with another key) and malformed ones (not a JSON object, not JSON at all)
+must be rejected with HTTP 400, never with a server error.
+
+Usage:
+    python -m benchmarks.webhooks
+"""
+from argparse import ArgumentParser
+from asyncio import run
+from hashlib import sha1, sha256
+from hmac import HMAC
+from json import dumps
+from urllib.parse import urlencode
+import sys
+
+import aiohttp
+
+from pyeasypay import EasyPay
+
+from .fakes import FakeServer
+
+
+def cryptobot(invoice_id: str, api_key: str = '1:token', body: bytes = None) -> tuple:
+    body = body if body is not None else dumps(
+        {'update_type': 'invoice_paid', 'payload': {'invoice_id': invoice_id, 'status': 'paid'}}).encode('utf-8')
+    signature = HMAC(sha256(api_key.encode('utf-8')).digest(), body, sha256).hexdigest()
+    return {'Crypto-Pay-Api-Signature': signature, 'Content-Type': 'application/json'}, body
+
+
+def crystalpay(invoice_id: str, salt: str = 'salt') -> tuple:
+    signature = sha1(f'{invoice_id}:{salt}'.encode('utf-8')).hexdigest()
+    body = dumps({'id': invoice_id, 'state': 'payed', 'signature': signature}).encode('utf-8')
+    return {'Content-Type': 'application/json'}, body
+
+
+def aaio(order_id: str, secret2: str = 'secret2') -> tuple:
+    data = {'merchant_id': 'merchant', 'amount': '100.00', 'currency': 'RUB', 'order_id': order_id}
+    sign = ':'.join([data['merchant_id'], data['amount'], data['currency'], secret2, order_id])
+    data['sign'] = sha256(sign.encode('utf-8')).hexdigest()
+    return {'Content-Type': 'application/x-www-form-urlencoded'}, urlencode(data).encode('utf-8')
+
+
+def cases() -> list:
+    """
+    Returns (name, provider, identifier, headers, body, expected HTTP status) for every notification
+    """
+    tampered = {}
+    headers, body = cryptobot('101')
+    tampered['cryptobot'] = headers, body.replace(b'101', b'102')
+    headers, body = crystalpay('id-1')
+    tampered['crystalpay'] = headers, body.replace(b'id-1', b'id-2')
+    headers, body = aaio('order-1')
+    tampered['aaio'] = headers, body.replace(b'100.00', b'1.00')
+    return [
+        ('valid', 'cryptobot', '101', *cryptobot('101'), 200),
+        ('valid', 'crystalpay', 'id-1', *crystalpay('id-1'), 200),
+        ('valid', 'aaio', 'order-1', *aaio('order-1'), 200),
+        ('tampered', 'cryptobot', '102', *tampered['cryptobot'], 400),
+        ('tampered', 'crystalpay', 'id-2', *tampered['crystalpay'], 400),
+        ('tampered', 'aaio', 'order-1', *tampered['aaio'], 400),
+        ('wrong key', 'cryptobot', '103', *cryptobot('103', api_key='2:other'), 400),
+        ('wrong key', 'crystalpay', 'id-3', *crystalpay('id-3', salt='other'), 400),
+        ('wrong key', 'aaio', 'order-3', *aaio('order-3', secret2='other'), 400),
+        ('array', 'cryptobot', None, *cryptobot(None, body=b'[1, 2]'), 400),
+        ('array', 'crystalpay', None, {'Content-Type': 'application/json'}, b'[1, 2]', 400),
+        ('string', 'cryptobot', None, *cryptobot(None, body=b'"paid"'), 400),
+        ('string', 'crystalpay', None, {'Content-Type': 'application/json'}, b'"paid"', 400),
+        ('no payload', 'cryptobot', None, *cryptobot(None, body=b'{"update_type": "invoice_paid"}'), 400),
+        ('not json', 'cryptobot', None, *cryptobot(None, body=b'{'), 400),
+        ('not json', 'crystalpay', None, {'Content-Type': 'application/json'}, b'{', 400),
+        ('empty', 'aaio', None, {'Content-Type': 'application/x-www-form-urlencoded'}, b'', 400),
+    ]
+
+
+async def main() -> int:
+    parser = ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.parse_args()
+
+    failed = False
+    async with FakeServer() as server:
+        async with EasyPay(providers=server.providers()) as pay:
+            handler = pay.webhook()
+            port = await handler.start('127.0.0.1', 0)
+            try:
+                async with aiohttp.ClientSession() as session:
+                    for name, provider, identifier, headers, body, expected in cases():
+                        invoice = None
+                        if identifier is not None:
+                            invoice = handler.track(await pay.invoice(provider=provider, identifier=identifier))
+                        async with session.post(f'http://127.0.0.1:{port}/webhook/{provider}', data=body,
+                                                headers=headers) as response:
+                            status, text = response.status, await response.text()
+                        paid = invoice is not None and invoice.status == 'paid'
+                        ok = status == expected and paid == (expected == 200)
+                        failed |= not ok
+                        print(f'{"ok" if ok else "FAIL":>4} {provider:>10} {name:>10}: HTTP {status} '
+                              f'(expected {expected}), paid={paid} {text[:60]}')
+            finally:
+                await handler.stop()
+
+    if failed:
+        print('FAIL: a notification was not verified as expected')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(run(main()))
@@ -1,4 +1,4 @@
-from asyncio import run, sleep
+from asyncio import run
 from pyeasypay import EasyPay, Provider
 
 
@@ -8,25 +8,28 @@ async def main():
     crystalpay = Provider('crystalpay', login='', secret='')
     cryptobot = Provider('cryptobot', api_key='16439:AAWcbxKxgsvblzwgMM5EGYIIOXAsltpInQ5', network='test')
     
-    pay = EasyPay(providers=[crystalpay, cryptobot])
-    
-    # Create invoice
-     = await pay.create_invoice(0.25, 'TON', 'cryptobot')
-    
-    # Save your invoice to memory
-    # Code here...
-    
-    # Init invoice from memory     
-    invoice_from_memory = await pay.invoice(
-        provider='cryptobot', identifier=invoice.identifier, pay_info=invoice.pay_info)
-    
-    while await invoice_from_memory.check() is False:
-        await sleep(5)
-        print(invoice_from_memory)
+    async with EasyPay(providers=[crystalpay, cryptobot]) as pay:
+
+        # Called by the background scheduler on every status change
+        @pay.scheduler.on_status
+        async def on_status(invoice, old_status):
+            print(f"Invoice {invoice.identifier}: {old_status} -> {invoice.status}")
+
+        # Create invoice and let EasyPay poll its status in the background
+        invoice = await pay.create_invoice(0.25, 'TON', 'cryptobot', run_check=True)
+
+        # Save your invoice to memory
+        # Code here...
+
+        # After a restart, init invoice from memory and track it again:
+        # invoice = pay.watch(await pay.invoice(provider='cryptobot', identifier=identifier, pay_info=pay_info))
 
+        async for updated in pay.scheduler.updates():
+            if updated is invoice and updated.status in ('paid', 'expired'):
+                break
 
-    if invoice_from_memory.status == 'paid':
-        print(f"Inovoice {invoice_from_memory.identifier} paid!")
+        if invoice.status == 'paid':
+            print(f"Inovoice {invoice.identifier} paid!")
 
 if __name__ == '__main__':
     run(main())
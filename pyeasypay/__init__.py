@@ -1,2 +1,3 @@
-from .core import EasyPay, Invoice, Provider, Providers
-
+from .core import EasyPay, Invoice, Provider, Providers, MetricsCollector, LoopLagMonitor, RateLimitError, \
+    CircuitOpenError, TransientError, ExchangeRates, IdempotencyCache, StatusCache, \
+    SyncEasyPay, check_update
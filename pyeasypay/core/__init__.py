@@ -1 +1,2 @@
-from .pay import *
\ No newline at end of file
+from .pay import *
+from .sync import SyncEasyPay
@@ -0,0 +1,142 @@
+from asyncio import FIRST_COMPLETED, Future, Task, create_task, ensure_future, get_running_loop, shield, wait
+from collections import deque
+from collections.abc import AsyncIterable, AsyncIterator, Awaitable, Callable, Hashable, Iterable
+from typing import Any, Dict
+
+
+async def aiter_any(items: Iterable | AsyncIterable) -> AsyncIterator:
+    """
+    Iterates over sync or async iterable in the same way
+    """
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def as_completed_bounded(jobs: Iterable[Awaitable] | AsyncIterable[Awaitable],
+                               limit: int) -> AsyncIterator[Any]:
+    """
+    Runs awaitables with at most limit of them in flight, yields results as soon as they complete
+
+    Jobs are pulled from the iterable lazily, so only limit of them are held in memory at once.
+    Pending jobs are cancelled if the consumer stops iterating or a job raises.
+
+    Args:
+        jobs: Iterable of awaitables (consumed lazily)
+        limit: Maximum number of awaitables running at once
+
+    Yields:
+        Any: Results in completion order
+    """
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    pending, done = set(), set()
+    try:
+        async for job in aiter_any(jobs):
+            pending.add(ensure_future(job))
+            if len(pending) >= limit:
+                done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+                while done:
+                    yield done.pop().result()
+        while pending:
+            done, pending = await wait(pending, return_when=FIRST_COMPLETED)
+            while done:
+                yield done.pop().result()
+    finally:
+        for task in pending:
+            task.cancel()
+        for task in done:
+            if not task.cancelled():
+                task.exception()  # retrieved, so asyncio doesn't log it as never retrieved
+
+
+def ready(result: Any = None, error: BaseException = None) -> Future:
+    """
+    Returns already finished future, cheaper than a task for results that are known without awaiting anything
+    """
+    future = get_running_loop().create_future()
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(result)
+    return future
+
+
+async def ordered_bounded(jobs: Iterable[Awaitable] | AsyncIterable[Awaitable],
+                          limit: int) -> AsyncIterator[Any]:
+    """
+    Runs awaitables with at most limit of them in flight, yields results in input order
+
+    Exceptions raised by jobs are yielded in place of their results instead of being raised. Jobs are pulled
+    from the iterable lazily, a finished job waits for the jobs before it, so at most limit results are held.
+    Pending jobs are cancelled if the consumer stops iterating.
+
+    Args:
+        jobs: Iterable of awaitables (consumed lazily)
+        limit: Maximum number of awaitables running or waiting to be yielded
+
+    Yields:
+        Any: Results or exceptions in input order
+    """
+    if limit < 1:
+        raise ValueError('limit must be at least 1')
+    window = deque()
+
+    async def result(future: Future) -> Any:
+        try:
+            return await future
+        except Exception as e:
+            return e
+
+    try:
+        async for job in aiter_any(jobs):
+            window.append(ensure_future(job))
+            if len(window) >= limit:
+                yield await result(window.popleft())
+        while window:
+            yield await result(window.popleft())
+    finally:
+        for future in window:
+            future.cancel()
+            if future.done() and not future.cancelled():
+                future.exception()
+
+
+class SharedCalls:
+    """
+    Runs at most one call per key at a time, callers arriving while it is in flight share its result or error
+
+    The call runs in its own task and callers await it shielded, so one cancelled caller doesn't cancel
+    the call for the others waiting on it.
+    """
+    def __init__(self) -> None:
+        self._inflight: Dict[Hashable, Task] = {}
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def run(self, key: Hashable, call: Callable[[], Awaitable]) -> Any:
+        """
+        Returns the result of call(), joining the call of the same key already in flight
+
+        Args:
+            key: Key calls are shared by
+            call: Callable returning awaitable, called only if no call of this key is in flight
+        """
+        task = self._inflight.get(key)
+        if task is None:
+            task = self._inflight[key] = create_task(call())
+            task.add_done_callback(lambda done: self._done(key, done))
+        return await shield(task)
+
+    def _done(self, key: Hashable, task: Task) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        if not task.cancelled():
+            task.exception()  # retrieved here in case every caller was cancelled
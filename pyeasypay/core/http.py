@@ -0,0 +1,136 @@
+from typing import Any, Callable, Dict, Hashable, List
+
+
+def timeouts(creds: Any, total: float = None) -> Dict[str, float]:
+    """
+    Returns session timeouts configured for provider credentials
+
+    Provider kwargs: timeout (total seconds per request), connect_timeout (seconds to connect),
+    read_timeout (seconds between received chunks)
+
+    Args:
+        creds: Provider instance
+        total: Total timeout used if provider has no timeout kwarg (pool default if None)
+    """
+    return {
+        'total': getattr(creds, 'timeout', total),
+        'connect': getattr(creds, 'connect_timeout', None),
+        'read': getattr(creds, 'read_timeout', None),
+    }
+
+
+class ClientPool:
+    """
+    Keep-alive HTTP connection pool shared by all providers of one EasyPay instance
+    """
+    def __init__(self, limit: int = 100, limit_per_host: int = 0, keepalive_timeout: float = 30,
+                 timeout: float = 30, dns_ttl: float = 300) -> None:
+        """
+        ClientPool initialization, nothing is opened until the first request
+
+        Args:
+            limit: Maximum number of simultaneously open connections
+            limit_per_host: Maximum number of open connections per host (0 - unlimited)
+            keepalive_timeout: Seconds an idle connection is kept open for reuse
+            timeout: Default total timeout for a request in seconds
+            dns_ttl: Seconds resolved provider hosts are cached for (e.g. by EasyPay.warmup())
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.keepalive_timeout = keepalive_timeout
+        self.timeout = timeout
+        self.dns_ttl = dns_ttl
+        self.trace_configs: List[Any] = []
+        self._connector = None
+        self._sessions: Dict[tuple, Any] = {}
+        self._clients: Dict[Hashable, Any] = {}
+        self._retired: List[Any] = []
+
+    @property
+    def closed(self) -> bool:
+        return self._connector is None or self._connector.closed
+
+    def session(self, total: float = None, connect: float = None, read: float = None):
+        """
+        Returns pooled aiohttp.ClientSession, creates it on first use. Sessions with different timeouts
+        share one connector, so they share keep-alive connections too
+
+        Args:
+            total: Total timeout for a request in seconds (pool default if None)
+            connect: Timeout for acquiring a connection in seconds
+            read: Timeout for reading a portion of data in seconds
+
+        Returns:
+            aiohttp.ClientSession: Session backed by the shared connector
+        """
+        key = (self.timeout if total is None else total, connect, read)
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            from aiohttp import ClientSession, ClientTimeout, TCPConnector
+
+            if self.closed:
+                self._connector = TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                               keepalive_timeout=self.keepalive_timeout, ttl_dns_cache=self.dns_ttl)
+            session = self._sessions[key] = ClientSession(
+                connector=self._connector, connector_owner=False,
+                timeout=ClientTimeout(total=key[0], sock_connect=connect, sock_read=read),
+                trace_configs=self.trace_configs or None
+            )
+        return session
+
+    def add_trace_config(self, trace_config: Any) -> None:
+        """
+        Adds aiohttp.TraceConfig to the pool. Sessions that are already open and the clients using them
+        are retired (closed on close()) so new requests go through traced sessions
+        """
+        if trace_config in self.trace_configs:
+            return
+        self.trace_configs.append(trace_config)
+        self._retire()
+
+    def remove_trace_config(self, trace_config: Any) -> None:
+        """
+        Removes aiohttp.TraceConfig added with add_trace_config, open sessions are retired like there
+        """
+        if trace_config not in self.trace_configs:
+            return
+        self.trace_configs.remove(trace_config)
+        self._retire()
+
+    def _retire(self) -> None:
+        self._retired.extend(self._sessions.values())
+        self._retired.extend(self._clients.values())
+        self._sessions, self._clients = {}, {}
+
+    def client(self, key: Hashable, factory: Callable[[], Any]) -> Any:
+        """
+        Returns pooled API client for a credential set, creates it with factory on first use
+
+        Args:
+            key: Unique key of the credential set, e.g. ('cryptobot', api_key, network)
+            factory: Callable returning a new client
+
+        Returns:
+            Any: Client object, the same one for every call with the same key
+        """
+        if key not in self._clients:
+            self._clients[key] = factory()
+        return self._clients[key]
+
+    async def close(self) -> None:
+        """
+        Closes pooled clients and all open connections
+        """
+        clients, self._clients = self._clients, {}
+        sessions, self._sessions = self._sessions, {}
+        retired, self._retired = self._retired, []
+        for client in [*clients.values(), *sessions.values(), *retired]:
+            close = getattr(client, 'close', None)
+            if close is not None:
+                await close()
+        if not self.closed:
+            await self._connector.close()
+        self._connector = None
+
+    def __repr__(self) -> str:
+        return f'ClientPool(limit={self.limit}, clients={len(self._clients)}, closed={self.closed})'
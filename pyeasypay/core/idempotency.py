@@ -0,0 +1,121 @@
+from asyncio import get_running_loop
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from datetime import datetime, timedelta
+from typing import Any
+
+from .concurrency import SharedCalls
+
+
+class IdempotencyCache:
+    """
+    Bounded LRU cache of invoices by idempotency key, with TTL
+
+    Repeated create_invoice calls with the same idempotency_key get the invoice created by the first call
+    without a provider request, and calls arriving while it is still being created wait for that one creation.
+    Failed creations are not cached, the next call tries again.
+
+    With a backend (e.g. InvoiceStore) keys survive restarts and are seen by other processes: keys missing
+    from memory are looked up there before creating an invoice. Creation itself is only coordinated within
+    one process: processes creating an invoice for the same new key at the same time each create one with the
+    provider, but only the first saved key counts and the others return that invoice once saving their key
+    fails (the invoices they created are left unused). A backend is any object with async
+    load_key(key) -> Invoice | None and save_key(key, invoice) methods, save_key has to fail for a key
+    that is already saved (InvoiceStore keeps keys unique).
+    """
+    def __init__(self, max_size: int = 10000, ttl: float = 86400, backend: Any = None) -> None:
+        """
+        Args:
+            max_size: Maximum number of keys kept in memory, least recently used ones are dropped first
+            ttl: Seconds after invoice creation a key is remembered for
+            backend: Persistent storage for keys, see class docstring
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self._invoices: OrderedDict[str, tuple] = OrderedDict()
+        self._calls = SharedCalls()
+
+    def __len__(self) -> int:
+        return len(self._invoices)
+
+    def get(self, key: str) -> Any | None:
+        """
+        Returns cached invoice by key, None if it is not cached or expired
+        """
+        entry = self._invoices.get(key)
+        if entry is None:
+            return None
+        expires_at, invoice = entry
+        if get_running_loop().time() >= expires_at:
+            del self._invoices[key]
+            return None
+        self._invoices.move_to_end(key)
+        return invoice
+
+    def put(self, key: str, invoice: Any) -> None:
+        """
+        Caches invoice by key until ttl seconds after its creation
+        """
+        age = (datetime.now() - invoice.created_at).total_seconds() if invoice.created_at else 0
+        self._invoices[key] = (get_running_loop().time() + self.ttl - max(age, 0), invoice)
+        self._invoices.move_to_end(key)
+        while len(self._invoices) > self.max_size:
+            self._invoices.popitem(last=False)
+
+    async def get_or_create(self, key: str, create: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns invoice cached by key, creating it with create() if there is none
+
+        Args:
+            key: Idempotency key
+            create: Callable returning awaitable with the new invoice, called at most once at a time per key
+
+        Returns:
+            Invoice: Cached or created invoice
+        """
+        invoice = self.get(key)
+        if invoice is not None:
+            self.hits += 1
+            return invoice
+        if key in self._calls:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return await self._calls.run(key, lambda: self._create(key, create))
+
+    async def _create(self, key: str, create: Callable[[], Awaitable[Any]]) -> Any:
+        if self.backend is not None:
+            invoice = await self.backend.load_key(key)
+            if invoice is not None and (invoice.created_at is None or
+                                        datetime.now() - invoice.created_at < timedelta(seconds=self.ttl)):
+                self.put(key, invoice)
+                return invoice
+        invoice = await create()
+        if self.backend is not None:
+            try:
+                await self.backend.save_key(key, invoice)
+            except Exception as e:
+                invoice = await self._saved(key, invoice, e)
+        self.put(key, invoice)
+        return invoice
+
+    async def _saved(self, key: str, invoice: Any, error: Exception) -> Any:
+        """
+        Returns invoice saved with key by another process if that is why saving it failed, invoice otherwise
+        """
+        try:
+            saved = await self.backend.load_key(key)
+        except Exception as e:
+            saved = None
+            error = e
+        if saved is not None and str(saved.identifier) != str(invoice.identifier):
+            return saved
+        print(f"Wasn't able to persist idempotency key {key}: {error!r}")
+        return invoice
+
+    def __repr__(self) -> str:
+        return (f'IdempotencyCache(keys={len(self)}, max_size={self.max_size}, ttl={self.ttl}, '
+                f'hits={self.hits}, misses={self.misses})')
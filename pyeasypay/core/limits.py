@@ -0,0 +1,198 @@
+from asyncio import CancelledError, get_running_loop
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from heapq import heappop, heappush
+from itertools import count
+from time import time
+from typing import Any, List
+
+
+PRIORITIES = {'create': 0, 'balance': 0, 'warmup': 0, 'check': 1, 'check_many': 1, 'reconcile': 1}
+
+_throttled: ContextVar[List[float] | None] = ContextVar('pyeasypay_throttled', default=None)
+
+
+class RateLimitError(ValueError):
+    """
+    Raised when provider keeps answering HTTP 429 after all retries
+    """
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: str | None, default: float = 1.0) -> float:
+    """
+    Returns seconds to wait from Retry-After header value (seconds or HTTP date), default if missing or invalid
+    """
+    if not value:
+        return default
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time(), 0.0)
+    except (TypeError, ValueError):
+        return default
+
+
+def throttle_trace_config() -> Any:
+    """
+    Returns aiohttp.TraceConfig reporting HTTP 429 responses (and their Retry-After) to the rate limiter
+    of the provider call in progress
+    """
+    from aiohttp import TraceConfig
+
+    async def on_request_end(session, context, params) -> None:
+        throttled = _throttled.get()
+        if throttled is not None and params.response.status == 429:
+            throttled.append(parse_retry_after(params.response.headers.get('Retry-After')))
+
+    trace_config = TraceConfig()
+    trace_config.on_request_end.append(on_request_end)
+    return trace_config
+
+
+class RateLimiter:
+    """
+    Token bucket rate limit and in-flight limit shared by all calls to one provider account
+
+    Waiting calls are served by priority (lower first, create before check), then in arrival order.
+    When the provider answers HTTP 429 the limiter stops issuing requests for Retry-After seconds
+    and the call is repeated.
+    """
+    def __init__(self, rate: float = None, burst: int = None, max_in_flight: int = None,
+                 max_retries: int = 3) -> None:
+        """
+        Args:
+            rate: Requests per second, unlimited if not provided
+            burst: Number of requests that can be sent at once after idling, rate (at least 1) if not provided
+            max_in_flight: Maximum number of simultaneous requests, unlimited if not provided
+            max_retries: How many times a call answered with HTTP 429 is repeated before RateLimitError is raised
+        """
+        self.rate = rate
+        self.burst = max(burst if burst is not None else rate or 1, 1)
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.in_flight = 0
+        self.throttled = 0
+        self._tokens = float(self.burst)
+        self._updated = None
+        self._paused_until = 0.0
+        self._waiters: List[tuple] = []
+        self._counter = count()
+        self._timer = None
+
+    def __len__(self) -> int:
+        """
+        Number of calls waiting for their turn
+        """
+        return sum(not future.done() for _, _, future in self._waiters)
+
+    def _refill(self, now: float) -> None:
+        if self.rate is None:
+            return
+        if self._updated is not None:
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _take(self, now: float) -> bool:
+        if now < self._paused_until:
+            return False
+        if self.max_in_flight is not None and self.in_flight >= self.max_in_flight:
+            return False
+        self._refill(now)
+        if self.rate is not None:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+        self.in_flight += 1
+        return True
+
+    def _dispatch(self) -> None:
+        loop = get_running_loop()
+        now = loop.time()
+        while self._waiters:
+            future = self._waiters[0][2]
+            if future.done():
+                heappop(self._waiters)
+                continue
+            if not self._take(now):
+                break
+            heappop(self._waiters)
+            future.set_result(None)
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._waiters and (self.max_in_flight is None or self.in_flight < self.max_in_flight):
+            wait = max(self._paused_until - now, (1 - self._tokens) / self.rate if self.rate else 0.0, 0.0)
+            self._timer = loop.call_later(wait, self._dispatch)
+
+    async def acquire(self, priority: int = 1) -> None:
+        """
+        Waits until a request may be sent, call release() when it finished
+        """
+        loop = get_running_loop()
+        if not self._waiters and self._take(loop.time()):
+            return
+        future = loop.create_future()
+        heappush(self._waiters, (priority, next(self._counter), future))
+        self._dispatch()
+        try:
+            await future
+        except CancelledError:
+            if future.done() and not future.cancelled():
+                self.release()
+            raise
+
+    def release(self) -> None:
+        self.in_flight -= 1
+        if self._waiters:
+            self._dispatch()
+
+    def pause(self, seconds: float) -> None:
+        """
+        Stops issuing requests for the given number of seconds, e.g. after HTTP 429
+        """
+        self._paused_until = max(self._paused_until, get_running_loop().time() + seconds)
+        self._tokens, self._updated = 0.0, self._paused_until
+
+    async def run(self, call: Callable[[], Awaitable], priority: int = 1) -> Any:
+        """
+        Runs provider call within the limits, repeating it if the provider answered HTTP 429
+
+        Args:
+            call: Callable returning a new awaitable for every attempt
+            priority: Lower is served first, see PRIORITIES
+
+        Returns:
+            Any: Result of the call
+
+        Raises:
+            RateLimitError: If provider answered HTTP 429 on every attempt
+        """
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(priority)
+            throttled = []
+            token = _throttled.set(throttled)
+            try:
+                result = await call()
+            except Exception:
+                if not throttled:
+                    raise
+            else:
+                if not throttled:
+                    return result
+            finally:
+                _throttled.reset(token)
+                self.release()
+            self.throttled += 1
+            retry_after = max(throttled)
+            self.pause(retry_after)
+        raise RateLimitError(f'Provider is rate limiting requests, retry after {retry_after:.1f}s', retry_after)
+
+    def __repr__(self) -> str:
+        return (f'RateLimiter(rate={self.rate}, burst={self.burst}, max_in_flight={self.max_in_flight}, '
+                f'in_flight={self.in_flight}, waiting={len(self)})')
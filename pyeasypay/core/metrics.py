@@ -0,0 +1,271 @@
+from asyncio import CancelledError, create_task, get_running_loop, sleep
+from bisect import bisect_left
+from collections.abc import Awaitable, Callable
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Any, Dict, List
+
+
+_received: ContextVar[List[int] | None] = ContextVar('pyeasypay_received', default=None)
+
+
+class CallEvent:
+    """
+    One finished provider call
+    """
+    __slots__ = ('provider', 'operation', 'duration', 'outcome', 'error', 'payload_size', 'count')
+
+    def __init__(self, provider: str, operation: str, duration: float, outcome: str, error: BaseException = None,
+                 payload_size: int = None, count: int = 1) -> None:
+        """
+        Args:
+            provider: Provider name
+            operation: create, check, check_many or balance
+            duration: Call duration in seconds
+            outcome: ok or error
+            error: Raised exception if outcome is error
+            payload_size: Bytes received from provider, None if the call made no traced HTTP requests
+            count: Number of invoices the call handled (batch size for check_many)
+        """
+        self.provider = provider
+        self.operation = operation
+        self.duration = duration
+        self.outcome = outcome
+        self.error = error
+        self.payload_size = payload_size
+        self.count = count
+
+    def __repr__(self) -> str:
+        return (f'CallEvent({self.provider}.{self.operation}, {self.duration * 1000:.2f} ms, {self.outcome}, '
+                f'payload_size={self.payload_size}, count={self.count})')
+
+
+class Hooks:
+    """
+    Callbacks fired around every provider call of one EasyPay instance
+
+    When no callbacks are registered calls are not wrapped at all, instrumentation costs nothing
+    """
+    def __init__(self) -> None:
+        self.callbacks: List[Callable[[CallEvent], Any]] = []
+        self.in_flight: Dict[tuple, int] = {}
+        self._trace_config = None
+
+    def __bool__(self) -> bool:
+        return bool(self.callbacks)
+
+    def trace_config(self) -> Any:
+        """
+        Returns aiohttp.TraceConfig counting response bytes of the instrumented call in progress
+        """
+        if self._trace_config is None:
+            from aiohttp import TraceConfig
+
+            async def on_chunk(session, context, params) -> None:
+                received = _received.get()
+                if received is not None:
+                    received[0] += len(params.chunk)
+
+            self._trace_config = TraceConfig()
+            self._trace_config.on_response_chunk_received.append(on_chunk)
+        return self._trace_config
+
+    async def call(self, provider: str, operation: str, awaitable: Awaitable, count: int = 1) -> Any:
+        """
+        Awaits provider call and fires callbacks with its CallEvent
+
+        Args:
+            provider: Provider name
+            operation: create, check, check_many or balance
+            awaitable: Provider call
+            count: Number of invoices the call handles
+
+        Returns:
+            Any: Result of the call, exceptions are re-raised after callbacks are fired
+        """
+        key = (provider, operation)
+        self.in_flight[key] = self.in_flight.get(key, 0) + 1
+        received = [0]
+        token = _received.set(received)
+        error, start = None, perf_counter()
+        try:
+            return await awaitable
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            duration = perf_counter() - start
+            _received.reset(token)
+            self.in_flight[key] -= 1
+            self.emit(CallEvent(provider, operation, duration, 'ok' if error is None else 'error', error,
+                                received[0] or None, count))
+
+    def emit(self, event: CallEvent) -> None:
+        """
+        Fires callbacks with event, used directly for calls handled without a request (e.g. locally signed invoices)
+        """
+        for callback in self.callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                print(f"Hook {callback!r} failed for {event!r}: {e!r}")
+
+
+async def instrument(hooks: Hooks, provider: str, operation: str, awaitable: Awaitable, count: int = 1) -> Any:
+    """
+    Awaits provider call, through hooks only if any callbacks are registered
+    """
+    if not hooks:
+        return await awaitable
+    return await hooks.call(provider, operation, awaitable, count)
+
+
+class Histogram:
+    """
+    Fixed-bucket latency histogram (seconds), buckets grow exponentially from 0.5 ms to ~2 minutes
+    """
+    BOUNDS = [0.0005 * 1.25 ** i for i in range(57)]
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self) -> None:
+        self.buckets = [0] * (len(self.BOUNDS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value: float) -> None:
+        self.buckets[bisect_left(self.BOUNDS, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, share: float) -> float:
+        """
+        Returns upper bound of the bucket holding the given share (0..1) of values, 0 if empty
+        """
+        if not self.count:
+            return 0.0
+        rank, seen = share * self.count, 0
+        for index, bucket in enumerate(self.buckets):
+            seen += bucket
+            if seen >= rank and bucket:
+                return min(self.BOUNDS[index], self.max) if index < len(self.BOUNDS) else self.max
+        return self.max
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class MetricsCollector:
+    """
+    In-memory per-provider, per-operation latency histograms, error and payload counters
+
+    Example:
+        metrics = pay.add_hook(MetricsCollector())
+        ...
+        print(metrics.snapshot())
+    """
+    def __init__(self) -> None:
+        self.latency: Dict[tuple, Histogram] = {}
+        self.errors: Dict[tuple, int] = {}
+        self.payload: Dict[tuple, int] = {}
+        self.hooks: Hooks | None = None
+
+    def __call__(self, event: CallEvent) -> None:
+        key = (event.provider, event.operation)
+        histogram = self.latency.get(key)
+        if histogram is None:
+            histogram = self.latency[key] = Histogram()
+        histogram.add(event.duration)
+        if event.outcome != 'ok':
+            self.errors[key] = self.errors.get(key, 0) + 1
+        if event.payload_size:
+            self.payload[key] = self.payload.get(key, 0) + event.payload_size
+
+    def snapshot(self) -> Dict[str, Dict[str, dict]]:
+        """
+        Returns {provider: {operation: stats}} with count, errors, error_rate, mean/p50/p90/p99/max latency
+        in milliseconds, received bytes and calls currently in flight
+        """
+        result = {}
+        for (provider, operation), histogram in self.latency.items():
+            errors = self.errors.get((provider, operation), 0)
+            result.setdefault(provider, {})[operation] = {
+                'count': histogram.count,
+                'errors': errors,
+                'error_rate': errors / histogram.count,
+                'mean_ms': histogram.mean * 1000,
+                'p50_ms': histogram.percentile(0.5) * 1000,
+                'p90_ms': histogram.percentile(0.9) * 1000,
+                'p99_ms': histogram.percentile(0.99) * 1000,
+                'max_ms': histogram.max * 1000,
+                'received_bytes': self.payload.get((provider, operation), 0),
+                'in_flight': self.hooks.in_flight.get((provider, operation), 0) if self.hooks else None,
+            }
+        return result
+
+    def reset(self) -> None:
+        self.latency.clear()
+        self.errors.clear()
+        self.payload.clear()
+
+    def __repr__(self) -> str:
+        return f'MetricsCollector({self.snapshot()})'
+
+
+class LoopLagMonitor:
+    """
+    Detects event loop stalls (e.g. blocking calls inside coroutines) by measuring how late a periodic sleep wakes up
+    """
+    def __init__(self, interval: float = 0.1, threshold: float = 0.05,
+                 callback: Callable[[float], Any] = None) -> None:
+        """
+        Args:
+            interval: Seconds between measurements
+            threshold: Lag in seconds reported to callback
+            callback: Called as callback(lag) when lag exceeds threshold, prints a warning if not provided
+        """
+        self.interval = interval
+        self.threshold = threshold
+        self.callback = callback
+        self.histogram = Histogram()
+        self.stalls = 0
+        self._task = None
+
+    def start(self) -> 'LoopLagMonitor':
+        """
+        Starts measuring in the running event loop
+        """
+        if self._task is None or self._task.done():
+            self._task = create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        loop = get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await sleep(self.interval)
+            lag = max(loop.time() - expected, 0.0)
+            self.histogram.add(lag)
+            if lag >= self.threshold:
+                self.stalls += 1
+                if self.callback is not None:
+                    self.callback(lag)
+                else:
+                    print(f"Event loop was blocked for {lag * 1000:.0f} ms")
+
+    def __repr__(self) -> str:
+        return (f'LoopLagMonitor(stalls={self.stalls}, p99={self.histogram.percentile(0.99) * 1000:.1f} ms, '
+                f'max={self.histogram.max * 1000:.1f} ms)')
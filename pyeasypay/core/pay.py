@@ -1,20 +1,56 @@
-from collections.abc import Iterable
-from typing import Any, List, Self
-from requests import get
-from importlib.metadata import version
-from os.path import dirname, basename, isfile, join
-from datetime import datetime
-import glob
-
-
-try:
-    current_version = version("pyeasypay")
-    last_version = get('https://pypi.org/pypi/pyeasypay/json').json()['info']['version']
-    print(f"pyesaypay {current_version} is still in beta, there can be some bugs, if you find one - report it at https://github.com/nichind/pyeasypay/issues")
+from asyncio import gather, sleep, wait_for
+from time import perf_counter
+from collections.abc import AsyncIterable, AsyncIterator, Callable, Iterable
+from typing import Any, Dict, List, Self
+from inspect import isawaitable
+from importlib.metadata import version, PackageNotFoundError
+from datetime import datetime, timedelta
+from math import isnan
+from struct import Struct
+import json
+
+from .http import ClientPool
+from .concurrency import aiter_any, as_completed_bounded, ordered_bounded, ready
+from .scheduler import Scheduler
+from .registry import registry
+from .metrics import CallEvent, Hooks, MetricsCollector, LoopLagMonitor, instrument
+from .limits import PRIORITIES, RateLimiter, RateLimitError, throttle_trace_config
+from .routing import Router
+from .rates import ExchangeRates
+from .idempotency import IdempotencyCache
+from .statuses import StatusCache
+from .retry import IDEMPOTENT, CircuitBreaker, CircuitOpenError, RetryPolicy, TransientError, is_transient
+
+
+async def check_update(timeout: float = 5) -> str | None:
+    """
+    Checks PyPI for a newer pyeasypay release
+
+    Nothing is requested at import time, call this explicitly (e.g. on startup) if you want to be notified
+
+    Args:
+        timeout: Total request timeout in seconds
+
+    Returns:
+        str | None: Latest version if it differs from the installed one, None otherwise
+    """
+    from aiohttp import ClientSession, ClientTimeout, ClientError
+    from asyncio import TimeoutError
+
+    try:
+        current_version = version("pyeasypay")
+    except PackageNotFoundError:
+        return None
+    try:
+        async with ClientSession(timeout=ClientTimeout(total=timeout)) as session:
+            async with session.get('https://pypi.org/pypi/pyeasypay/json') as response:
+                last_version = (await response.json())['info']['version']
+    except (ClientError, TimeoutError, KeyError, ValueError):
+        return None
     if last_version != current_version:
         print(f"pyeasypay {last_version} is avaliable (current: {current_version}) - python3 -m pip install pyeasypay -U")
-except:
-    pass
+        return last_version
+    return None
 
 
 class Provider:
@@ -35,6 +71,19 @@ class Provider:
             redirect_url: Redirect URL for the provider
             callback_url: Callback URL for the provider
             network: Network for the provider
+            rate_limit: Maximum requests per second to the provider (shared by all invoices of this provider)
+            burst: Requests that can be sent at once after idling (defaults to rate_limit)
+            max_in_flight: Maximum number of simultaneous requests to the provider
+            timeout: Total timeout of one request in seconds (30 by default, 10 for aaio)
+            connect_timeout: Timeout for opening a connection in seconds
+            read_timeout: Timeout between received chunks of a response in seconds
+            retries: How many times a failed check is retried (2 by default), creates are never retried
+            retry_backoff: Base retry delay in seconds, doubled on every retry with full jitter (0.1 by default)
+            breaker: False to disable the circuit breaker
+            breaker_threshold: Share of failed calls opening the circuit breaker (0.5 by default)
+            breaker_cooldown: Seconds calls fail fast once the circuit breaker opened (15 by default)
+            currencies: Currencies accepted by this account, used to pick a provider when none was given
+            account: Account name, needed to add several accounts of the same provider (see EasyPay balancing)
         """
         for k, v in kwargs.items():
             setattr(self, k, v)
@@ -45,23 +94,216 @@ class Provider:
 
 
 class Providers:
-    def __init__(self) -> None:
+    def __init__(self, pool: ClientPool = None) -> None:
         """
         Providers initialization
 
-        Finds all provider modules in the providers directory and
-        adds them as attributes to the instance
+        Adds all providers known to the provider registry (built-in and
+        installed through entry points) as attributes to the instance
+
+        Args:
+            pool: Connection pool shared by all providers, new one is created if not provided
         """
-        modules = glob.glob(join(dirname(__file__) + '/providers', "*.py"))
-        __all__ = [basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
-        for _ in __all__:
+        self.pool = pool if pool is not None else ClientPool()
+        self.scheduler = None
+        self.hooks = Hooks()
+        self.accounts = {}
+        self._added: List[Provider] = []
+        self.balancing = 'round-robin'
+        self._turns = {}
+        self.limiters = {}
+        self.retry_policies = {}
+        self.breakers = {}
+        self.router = Router(self)
+        self.statuses = StatusCache()
+        self._throttle_config = None
+        for _ in registry.names():
             setattr(self, _, Provider(_))
 
     def list(self) -> List[Provider]:
         """
-        List all providers available in the EasyPay instance
+        List all providers available in the EasyPay instance, every added account of a provider separately:
+        added accounts in the order they were added first, then providers that were not added
+        """
+        providers = list(self._added)
+        for provider in self.__dict__.values():
+            if isinstance(provider, Provider) and provider.name not in self.accounts:
+                providers.append(provider)
+        return providers
+
+    def add(self, creds: Provider) -> None:
+        """
+        Adds provider account, replaces the added one with the same name and account kwarg (if any)
+        """
+        accounts = self.accounts.setdefault(creds.name, [])
+        label = getattr(creds, 'account', None)
+        for index, added in enumerate(accounts):
+            if getattr(added, 'account', None) == label:
+                accounts[index] = creds
+                self._added[self._added.index(added)] = creds
+                break
+        else:
+            accounts.append(creds)
+            self._added.append(creds)
+        setattr(self, creds.name, accounts[0])
+
+    def account(self, name: str, label: str = None) -> Provider:
+        """
+        Returns added account of provider by its account kwarg, the first added one if label is None
+
+        Raises:
+            ValueError: If provider or account was not added
+        """
+        accounts = self.accounts.get(name)
+        if not accounts:
+            try:
+                return self.__dict__[name]
+            except KeyError:
+                raise ValueError(f'Provider {name} was not added, please add it first')
+        for creds in accounts:
+            if getattr(creds, 'account', None) == label:
+                return creds
+        if label is None:
+            return accounts[0]
+        raise ValueError(f'Account {label} of provider {name} was not added, please add it first')
+
+    def select(self, name: str) -> Provider:
+        """
+        Picks account of provider for a new invoice: round-robin or least-loaded (fewest calls in flight and
+        waiting for the rate limiter), see balancing kwarg of EasyPay
+        """
+        accounts = self.accounts.get(name)
+        if not accounts or len(accounts) == 1:
+            return self.account(name)
+        if self.balancing == 'least-loaded':
+            return min(accounts, key=self.load)
+        turn = self._turns.get(name, 0)
+        self._turns[name] = turn + 1
+        return accounts[turn % len(accounts)]
+
+    def load(self, creds: Provider) -> int:
+        """
+        Number of calls with these credentials in flight or waiting for the rate limiter
+        """
+        limiter = self.limiters.get(creds)
+        return self.router.get(creds).in_flight + (len(limiter) if limiter is not None else 0)
+
+    def limiter(self, creds: Provider) -> RateLimiter | None:
+        """
+        Returns rate limiter shared by all calls with these credentials, None if no limits were configured
+        (rate_limit, burst and max_in_flight provider kwargs)
+        """
+        try:
+            return self.limiters[creds]
+        except KeyError:
+            pass
+        rate, max_in_flight = getattr(creds, 'rate_limit', None), getattr(creds, 'max_in_flight', None)
+        limiter = None
+        if rate is not None or max_in_flight is not None:
+            limiter = RateLimiter(rate, getattr(creds, 'burst', None), max_in_flight)
+            self.pool.add_trace_config(self.throttle_config())
+        self.limiters[creds] = limiter
+        return limiter
+
+    def retry_policy(self, creds: Provider) -> RetryPolicy:
+        """
+        Returns retry policy (and retry budget) shared by all calls with these credentials
         """
-        return list(self.__dict__.values())
+        try:
+            return self.retry_policies[creds]
+        except KeyError:
+            policy = self.retry_policies[creds] = RetryPolicy(getattr(creds, 'retries', 2),
+                                                              getattr(creds, 'retry_backoff', 0.1))
+            return policy
+
+    def breaker(self, creds: Provider) -> CircuitBreaker | None:
+        """
+        Returns circuit breaker shared by all calls with these credentials, None if disabled with breaker=False
+        """
+        try:
+            return self.breakers[creds]
+        except KeyError:
+            pass
+        breaker = None
+        if getattr(creds, 'breaker', True):
+            breaker = CircuitBreaker(getattr(creds, 'breaker_threshold', 0.5),
+                                     cooldown=getattr(creds, 'breaker_cooldown', 15))
+        self.breakers[creds] = breaker
+        return breaker
+
+    def throttle_config(self) -> Any:
+        if self._throttle_config is None:
+            self._throttle_config = throttle_trace_config()
+        return self._throttle_config
+
+    async def call(self, creds: Provider, operation: str, call: Callable[[], Any], count: int = 1) -> Any:
+        """
+        Runs provider call through the circuit breaker, rate limiter and instrumentation hooks of its credentials,
+        idempotent calls (check, check_many, balance) are retried on transient errors
+
+        Args:
+            creds: Provider credentials the call is made with
+            operation: create, check, check_many, balance or warmup, all but checks are served before checks
+            call: Callable returning the provider coroutine, called again if the call has to be repeated
+            count: Number of invoices the call handles
+
+        Returns:
+            Any: Result of the call
+
+        Raises:
+            CircuitOpenError: If provider is failing and the circuit breaker is open
+            RateLimitError: If provider kept answering HTTP 429
+        """
+        limiter, breaker = self.limiter(creds), self.breaker(creds)
+        retry = self.retry_policy(creds) if operation in IDEMPOTENT else None
+        attempt = 0
+        while True:
+            if breaker is not None:
+                breaker.before(creds.name)
+            stats, start = self.router.start(creds), perf_counter()
+            try:
+                if limiter is None:
+                    result = await instrument(self.hooks, creds.name, operation, call(), count)
+                else:
+                    result = await limiter.run(lambda: instrument(self.hooks, creds.name, operation, call(), count),
+                                               PRIORITIES.get(operation, 1))
+            except Exception as e:
+                transient = is_transient(e)
+                self.router.finish(stats, perf_counter() - start, transient)
+                if breaker is not None:
+                    breaker.record(transient)
+                delay = retry.delay(attempt) if transient and retry is not None else None
+                if delay is None:
+                    raise
+                attempt += 1
+                await sleep(delay)
+                continue
+            except BaseException:
+                self.router.finish(stats, perf_counter() - start, None)
+                if breaker is not None:
+                    breaker.abort()
+                raise
+            self.router.finish(stats, perf_counter() - start, False)
+            if breaker is not None:
+                breaker.record(False)
+            if retry is not None:
+                retry.success()
+            return result
+
+    def record(self, creds: Provider, operation: str, duration: float, count: int = 1) -> None:
+        """
+        Records a call handled locally without a request (AAIO invoices are signed locally) like call() does:
+        in per-account stats and as a CallEvent for hooks
+
+        Args:
+            creds: Provider credentials the call was made with
+            operation: Operation, e.g. create
+            duration: Call duration in seconds
+            count: Number of invoices the call handled
+        """
+        self.router.finish(self.router.start(creds), duration, False)
+        if self.hooks:
+            self.hooks.emit(CallEvent(creds.name, operation, duration, 'ok', count=count))
 
     def __repr__(self) -> str:
         return f'Providers({self.__dict__})'
@@ -69,24 +311,65 @@ class Providers:
 
 
 class Invoice:
-    def __init__(self, providers: Providers, **kwargs) -> None:
+    """
+    Invoice record, compact (slotted) so that hundreds of thousands of pending invoices can be kept in memory
+
+    Provider binding (invoice.invoice) is resolved lazily from the provider name when needed and is not stored
+    on the invoice, so invoices don't form reference cycles and are freed without the cyclic GC
+    """
+    __slots__ = ('providers', 'provider', 'account', 'identifier', 'status', 'amount', 'currency', 'pay_info',
+                 'created_at', 'metadata', '__weakref__')
+
+    FIELDS = ('provider', 'account', 'identifier', 'status', 'amount', 'currency', 'pay_info', 'created_at',
+              'metadata')
+    _HEADER = Struct('<Bdd')
+    _FLAGS = Struct('<B')
+    _LENGTH = Struct('<I')
+
+    def __init__(self, providers: Providers, provider: str | Provider = None, identifier: Any = None,
+                 status: str = 'creating', amount: int | float = None, currency: str = None, pay_info: str = None,
+                 created_at: datetime = None, metadata: dict = None, account: str = None, **kwargs) -> None:
         """
         Invoice initialization
 
         Args:
             providers: Providers instancec from EasyPay()
-            **kwargs: Additional keyword arguments to set attributes for the instance
+            provider: Provider name or Provider instance
+            identifier: Invoice identifier on provider side
+            status: Invoice status
+            amount: Invoice amount
+            currency: Invoice currency
+            pay_info: Payment URL
+            created_at: Creation time, now if not provided
+            metadata: Your own data to keep with the invoice (e.g. order id), None if empty
+            account: Account of the provider owning the invoice (account kwarg of Provider), None for the first one
+            **kwargs: Additional keyword arguments, stored in metadata and available as attributes
         """
         self.providers = providers
-        self.status = 'creating'
-        self.identifier = None
-        self.pay_info = None
-        self.invoice = None
-        self.currency = None
-        self.created_at = datetime.now()
+        self.provider = provider.name if isinstance(provider, Provider) else provider
+        self.account = account
+        self.identifier = identifier
+        self.status = status
+        self.amount = amount
+        self.currency = currency
+        self.pay_info = pay_info
+        self.created_at = created_at if created_at is not None else datetime.now()
+        self.metadata = {**metadata, **kwargs} if metadata else kwargs or None
 
-        for k, v in kwargs.items():
-            setattr(self, k, v)
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_') or name == 'metadata':  # unset metadata slot would recurse
+            raise AttributeError(name)
+        try:
+            return self.metadata[name]
+        except (KeyError, TypeError):
+            raise AttributeError(f"'Invoice' object has no attribute '{name}'") from None
+
+    @property
+    def invoice(self) -> Any:
+        """
+        Provider invoice object bound to this invoice, None if provider is not set
+        """
+        return self.bind_provider(self.provider) if self.provider is not None else None
 
     async def init_invoice(self, provider: str | Provider) -> Self:
         """
@@ -101,39 +384,44 @@ class Invoice:
         Raises:
             ValueError: If provider is not supported or was not added
         """
-        modules = glob.glob(join(dirname(__file__) + '/providers', "*.py"))
-        __all__ = [basename(f)[:-3] for f in modules if isfile(f) and not f.endswith('__init__.py')]
+        return self.bind_provider(provider)
+
+    def bind_provider(self, provider: str | Provider) -> Any:
+        """
+        Binds invoice to provider, synchronous part of init_invoice. Binding is cheap (dict lookup and
+        object creation) and is returned, not stored, keep it while you need it
+
+        Args:
+            provider: Provider name or Provider instance
+
+        Returns:
+            Provider invoice object
+
+        Raises:
+            ValueError: If provider is not supported or was not added
+        """
         provider_name = provider.name if isinstance(provider, Provider) else provider
         if self.currency is None or self.currency == '':
             self.currency = 'USD'
             print("Currency was not provided for create_invoice, defaulting to USD")
         if provider_name == 'None' or provider_name is None or provider_name == '':
-            for provider, args in self.providers.__dict__.items():
+            for args in self.providers.list():
                 if len(args.__dict__) > 1:
-                    provider_name = provider
+                    provider_name = args.name
                     print(f"Provider was not provided for create_invoice, defaulting to {provider_name}"
                           " since it was added to the EasyPay instance") 
                     break
             if provider_name == '' or provider_name is None or provider_name == 'None':
                 raise ValueError('Provider is not provided for create_invoice')
-        if provider_name not in __all__:
-            raise ValueError(
-                f'Provider {provider_name} is not supported'
-            )
-
-        module = __import__(f'pyeasypay.core.providers.{provider_name}',
-                            globals(), locals(), ['Invoice'], 0)
-        try:
-            self.invoice = module.Invoice(
-                self.providers.__dict__[provider_name],
-                self, self.amount if 'amount' in self.__dict__ else None
-            )
-        except KeyError:
-            raise ValueError(
-                f'Provider {provider_name} '
-                f'was not added, please add it first'
-            )
-        return self.invoice
+        provider_class = registry.get(provider_name)
+        if isinstance(provider, Provider) and provider in self.providers.accounts.get(provider_name, ()):
+            creds = provider
+        else:
+            label = self.account if self.account is not None else getattr(provider, 'account', None)
+            creds = self.providers.account(provider_name, label)
+        self.provider = provider_name
+        self.account = getattr(creds, 'account', None)
+        return provider_class(creds, self, self.amount)
 
     async def create(self, provider: str | Provider, run_check: bool = False) -> Self:
         """
@@ -141,7 +429,7 @@ class Invoice:
 
         Args:
             provider: Provider name or Provider instance
-            run_check: Whether to run invoice status check after creation
+            run_check: Whether to track invoice status in the background scheduler of EasyPay after creation
 
         Returns:
             Self: self (Invoice object)
@@ -149,33 +437,164 @@ class Invoice:
         Raises:
             ValueError: If provider is not supported or was not added
         """
-        await self.init_invoice(provider)
-        await self.invoice.create()
+        if self.account is None and not isinstance(provider, Provider) and provider not in (None, '', 'None'):
+            provider = self.providers.select(provider)
+        binding = await self.init_invoice(provider)
+        await self.providers.call(binding.creds, 'create', binding.create)
 
         if run_check:
-            print(NotImplementedError('run_check is not implemented yet, check invoice status manually'))
+            if self.providers.scheduler is None:
+                raise ValueError('run_check requires an invoice created through EasyPay')
+            self.providers.scheduler.add(self)
 
         return self
 
     async def check(self, return_bool: bool = False) -> str | bool:
         """
+        Concurrent checks of the same invoice share one provider request and the status is reused
+        for a short time (final statuses for good), see EasyPay status_cache
+
         Returns:
             str: Invoice status (paid or else)
 
         Raises:
             ValueError: If provider or identifier were not provided.
         """
-        if 'identifier' not in self.__dict__ or self.identifier is None:
+        binding = await self.bind()
+        self.status = await self.providers.statuses.check(
+            StatusCache.key(self), lambda: self.providers.call(binding.creds, 'check', binding.check))
+        return self.status.lower() in ['paid', 'payed']
+
+    async def bind(self) -> Any:
+        """
+        Makes sure invoice is bound to its provider, used before checking status
+
+        Returns:
+            Any: Provider invoice object
+
+        Raises:
+            ValueError: If provider or identifier were not provided.
+        """
+        if self.identifier is None:
             raise ValueError('Identifier is not provided, create invoice first or set identifier manually')
-        if self.invoice is None:
-            if 'provider' not in self.__dict__.keys():
-                raise ValueError('Provider is not provided, create invoice first or set provider manually')
-            await self.init_invoice(self.provider)
-        return (await self.invoice.check()).lower() in ['paid', 'payed']
+        if self.provider is None:
+            raise ValueError('Provider is not provided, create invoice first or set provider manually')
+        return self.bind_provider(self.provider)
+
+    def to_dict(self) -> dict:
+        """
+        Returns JSON-serializable dict of invoice fields, see from_dict
+        """
+        return {
+            'provider': self.provider,
+            'account': self.account,
+            'identifier': self.identifier,
+            'status': self.status,
+            'amount': self.amount,
+            'currency': self.currency,
+            'pay_info': self.pay_info,
+            'created_at': self.created_at.isoformat(),
+            'metadata': self.metadata,
+        }
+
+    @classmethod
+    def from_dict(cls, providers: Providers, data: dict) -> Self:
+        """
+        Creates invoice from to_dict output
+
+        Args:
+            providers: Providers instance from EasyPay()
+            data: Dict produced by to_dict
+        """
+        data = {k: v for k, v in data.items() if k in cls.FIELDS}
+        if isinstance(data.get('created_at'), str):
+            data['created_at'] = datetime.fromisoformat(data['created_at'])
+        return cls(providers, **data)
+
+    def to_bytes(self) -> bytes:
+        """
+        Returns compact binary form of invoice, see from_bytes
+
+        Layout: version, created_at timestamp, amount (NaN if not set), flags (1 if amount is an int), then
+        length-prefixed UTF-8 provider, identifier, status, currency, pay_info, JSON metadata and account
+        """
+        parts = [self._HEADER.pack(3, self.created_at.timestamp(),
+                                   float('nan') if self.amount is None else self.amount),
+                 self._FLAGS.pack(isinstance(self.amount, int))]
+        identifier = self.identifier if self.identifier is None else json.dumps(self.identifier)
+        metadata = json.dumps(self.metadata, separators=(',', ':')) if self.metadata else None
+        for value in (self.provider, identifier, self.status, self.currency, self.pay_info, metadata, self.account):
+            encoded = b'' if value is None else value.encode('utf-8')
+            parts.append(self._LENGTH.pack(len(encoded) if value is not None else 0xFFFFFFFF))
+            parts.append(encoded)
+        return b''.join(parts)
+
+    @classmethod
+    def from_bytes(cls, providers: Providers, data: bytes) -> Self:
+        """
+        Creates invoice from to_bytes output
+
+        Args:
+            providers: Providers instance from EasyPay()
+            data: Bytes produced by to_bytes
+
+        Raises:
+            ValueError: If data was not produced by to_bytes
+        """
+        version, created_at, amount = cls._HEADER.unpack_from(data)
+        if version not in (1, 2, 3):
+            raise ValueError(f'Unsupported invoice binary format version {version}')
+        offset, values = cls._HEADER.size, []
+        if version >= 3:
+            flags, = cls._FLAGS.unpack_from(data, offset)
+            offset += cls._FLAGS.size
+            if flags & 1 and not isnan(amount):
+                amount = int(amount)
+        for _ in range(6 if version == 1 else 7):
+            length, = cls._LENGTH.unpack_from(data, offset)
+            offset += cls._LENGTH.size
+            if length == 0xFFFFFFFF:
+                values.append(None)
+                continue
+            values.append(data[offset:offset + length].decode('utf-8'))
+            offset += length
+        provider, identifier, status, currency, pay_info, metadata, account = (*values, None)[:7]
+        return cls(providers, provider=provider, identifier=identifier if identifier is None else json.loads(identifier),
+                   status=status, amount=None if isnan(amount) else amount, currency=currency, pay_info=pay_info,
+                   created_at=datetime.fromtimestamp(created_at), metadata=json.loads(metadata) if metadata else None,
+                   account=account)
 
     def __repr__(self) -> str:
-        return f'Invoice({self.__dict__})'
+        return f'Invoice({self.to_dict()})'
+
+
+
+class ProviderReadiness:
+    """
+    Outcome of warming up one provider account, see EasyPay.warmup()
+    """
+    __slots__ = ('provider', 'account', 'ready', 'latency', 'error')
 
+    def __init__(self, provider: str, account: str | None, ready: bool, latency: float,
+                 error: BaseException = None) -> None:
+        """
+        Args:
+            provider: Provider name
+            account: Account label (account kwarg of Provider), None if not set
+            ready: Whether credentials were accepted
+            latency: Seconds the validation request took, including connecting and client construction
+            error: Raised exception if not ready
+        """
+        self.provider = provider
+        self.account = account
+        self.ready = ready
+        self.latency = latency
+        self.error = error
+
+    def __repr__(self) -> str:
+        name = self.provider if self.account is None else f'{self.provider}[{self.account}]'
+        state = 'ready' if self.ready else f'not ready: {self.error!r}'
+        return f'ProviderReadiness({name}, {state}, {self.latency * 1000:.1f} ms)'
 
 
 class EasyPay:
@@ -187,9 +606,39 @@ class EasyPay:
         EasyPay initialization
 
         Args:
+            connection_limit: Maximum number of simultaneously open connections in the shared pool
+            scheduler: Dict of keyword arguments for the background status Scheduler (intervals, lifetime, ...)
+            routing: How create_invoice picks a provider when none was given: fastest (default), ordered,
+                or a callable policy(candidates, currency) returning providers in preferred order, see Router
+            balancing: How invoices are spread over several accounts of the same provider: round-robin (default)
+                or least-loaded
+            rates: Exchange rates for converting invoice amounts (see create_invoice): name of provider to take
+                rates from (e.g. 'cryptobot'), async callable returning {(source, target): rate}, or ExchangeRates
+            idempotency: IdempotencyCache for idempotency_key of create_invoice or dict of its keyword arguments
+                (max_size, ttl, backend), in-memory cache with defaults if not provided
+            status_cache: StatusCache coalescing concurrent status checks of the same invoice or dict of its keyword
+                arguments (ttl, max_size), statuses are reused for 1 second by default
             **kwargs: Additional keyword arguments to set attributes for the instance
+
+        Can be used as an async context manager, pooled connections are closed on exit:
+
+            async with EasyPay(providers=[...]) as pay:
+                ...
         """
-        self.provider = Providers()
+        self.provider = Providers(ClientPool(limit=kwargs.pop('connection_limit', 100)))
+        self.provider.scheduler = Scheduler(self.check_many, **kwargs.pop('scheduler', {}))
+        self.provider.router = Router(self.provider, kwargs.pop('routing', 'fastest'))
+        status_cache = kwargs.pop('status_cache', None)
+        if status_cache is not None:
+            self.provider.statuses = status_cache if isinstance(status_cache, StatusCache) else \
+                StatusCache(**status_cache)
+        self.rates = self._rates(kwargs.pop('rates', None))
+        idempotency = kwargs.pop('idempotency', None)
+        self.idempotency = idempotency if isinstance(idempotency, IdempotencyCache) else \
+            IdempotencyCache(**(idempotency or {}))
+        self.provider.balancing = kwargs.pop('balancing', 'round-robin')
+        if self.provider.balancing not in ('round-robin', 'least-loaded'):
+            raise ValueError(f'Unknown balancing {self.provider.balancing}, use round-robin or least-loaded')
         for k, v in kwargs.items():
             setattr(self, k, v)
         if 'provider' not in self.__dict__ and 'providers' not in self.__dict__:
@@ -200,38 +649,522 @@ class EasyPay:
             for provider in self.__dict__['providers']:
                 self.configure_provider(provider)
 
+    def _rates(self, rates: Any) -> ExchangeRates | None:
+        if rates is None or isinstance(rates, ExchangeRates):
+            return rates
+        if callable(rates):
+            return ExchangeRates(rates)
+        if rates not in registry:
+            raise ValueError(f'Provider {rates} is not supported')
+
+        async def source():
+            module = registry.module(rates)
+            if not hasattr(module, 'get_exchange_rates'):
+                raise ValueError(f'Provider {rates} does not provide exchange rates')
+            creds = self.provider.account(rates)
+            return await self.provider.call(creds, 'rates',
+                                            lambda: module.get_exchange_rates(creds, self.provider.pool))
+
+        return ExchangeRates(source)
+
     def configure_provider(self, provider: str | Provider, **kwargs) -> None:
         """
         Configure provider for EasyPay instance
 
+        Several accounts of the same provider can be added if they have different account kwargs,
+        adding a provider with the same name and account again replaces it
+
         Args:
             provider: Provider instance or name of provider as string
             **kwargs: Additional keyword arguments to pass to Provider constructor
         """
-        setattr(
-            self.provider,
-            provider.name if isinstance(provider, Provider) else provider,
-            Provider(provider, **kwargs) if isinstance(provider, str) else provider
-        )
+        self.provider.add(Provider(provider, **kwargs) if isinstance(provider, str) else provider)
+
+    @property
+    def pool(self) -> ClientPool:
+        """
+        Connection pool shared by all providers of this instance
+        """
+        return self.provider.pool
+
+    @property
+    def router(self) -> Router:
+        """
+        Provider routing policy and observed provider latency and error rates
+        """
+        return self.provider.router
+
+    @property
+    def scheduler(self) -> Scheduler:
+        """
+        Background status scheduler shared by all invoices of this instance
+        """
+        return self.provider.scheduler
+
+    def watch(self, invoice: Invoice, lifetime: float = None) -> Invoice:
+        """
+        Tracks invoice status in the background scheduler, status changes are delivered
+        to scheduler.on_status callbacks and scheduler.updates() iterators
+
+        Args:
+            invoice: Invoice with identifier and provider set (e.g. restored from memory)
+            lifetime: Seconds after invoice creation when polling stops (scheduler default if not provided)
+
+        Returns:
+            Invoice: The same invoice, or the invoice already tracked with the same provider and identifier
+        """
+        return self.provider.scheduler.add(invoice, lifetime)
+
+    def add_hook(self, callback: Callable[[CallEvent], Any]) -> Callable[[CallEvent], Any]:
+        """
+        Registers callback called as callback(event) after every provider call (create, check, check_many, balance)
+
+        Event carries provider name, operation, duration, outcome and received payload size, see CallEvent.
+        Invoices created locally without a request (AAIO) fire create events too, with no payload size.
+        Callbacks are synchronous and should be fast. While no callbacks are registered calls are not instrumented.
+
+        Args:
+            callback: Callable taking CallEvent, e.g. MetricsCollector()
+
+        Returns:
+            Callable: The same callback
+
+        Example:
+            metrics = pay.add_hook(MetricsCollector())
+            print(metrics.snapshot())
+        """
+        hooks = self.provider.hooks
+        if isinstance(callback, MetricsCollector):
+            callback.hooks = hooks
+        hooks.callbacks.append(callback)
+        self.provider.pool.add_trace_config(hooks.trace_config())
+        return callback
+
+    def remove_hook(self, callback: Callable[[CallEvent], Any]) -> None:
+        """
+        Unregisters callback added with add_hook, does nothing if it was not registered. Once the last one
+        is removed, responses are no longer traced
+        """
+        hooks = self.provider.hooks
+        if callback in hooks.callbacks:
+            hooks.callbacks.remove(callback)
+            if not hooks.callbacks:
+                self.provider.pool.remove_trace_config(hooks.trace_config())
+
+    async def balance(self, provider: str | Provider) -> Any:
+        """
+        Gets account balance from provider
+
+        Args:
+            provider: Provider name (first added account) or added Provider instance
+
+        Returns:
+            Any: Balance as returned by the provider API
+
+        Raises:
+            ValueError: If provider was not added, doesn't support balance or returned an error
+        """
+        provider_name = provider.name if isinstance(provider, Provider) else provider
+        if isinstance(provider, Provider) and provider in self.provider.accounts.get(provider_name, ()):
+            creds = provider
+        else:
+            creds = getattr(self.provider, provider_name, None)
+        if not isinstance(creds, Provider) or len(creds.__dict__) <= 1:
+            raise ValueError(f'Provider {provider_name} was not added, please add it first')
+        module = registry.module(provider_name)
+        if not hasattr(module, 'get_balance'):
+            raise ValueError(f'Provider {provider_name} does not support balance')
+        return await self.provider.call(creds, 'balance', lambda: module.get_balance(creds, self.provider.pool))
+
+    async def reconcile(self, provider: str, status: str | None = 'paid', since: datetime = None,
+                        lookup: Callable[[str, List[str]], Any] = None,
+                        page_size: int = 1000) -> AsyncIterator[Invoice]:
+        """
+        Finds local invoices whose status changed on the provider side, e.g. ones paid while polling was down
+
+        Streams provider invoice listings page by page (newest first) for every account of the provider, looks
+        up the local invoices of each page and yields only those with a different status. Status updates go
+        through the scheduler like webhook ones, so on_status callbacks (and InvoiceStore) see them. Memory use
+        is bounded by one page, and catching up costs one request per page_size listed invoices instead of a
+        request per local invoice.
+
+        Args:
+            provider: Provider name, the provider has to support listing invoices (cryptobot)
+            status: Only list invoices with this provider status, None for all
+            since: Creation time of the oldest local invoice that may have changed, e.g.
+                InvoiceStore.oldest_pending(provider). Listing is ordered by creation, so paging stops after a page
+                where every invoice was created (a few minutes of clock difference allowed) before it. Not the time
+                polling stopped: an invoice created earlier but paid during the outage would be missed. Defaults
+                to the oldest invoice tracked by the scheduler without lookup, and to no limit with lookup
+                (naive datetimes are local time)
+            lookup: Callable (or coroutine) lookup(provider, identifiers) returning {identifier: Invoice}
+                of local invoices, e.g. InvoiceStore.get_many. Invoices tracked by the scheduler if not provided
+            page_size: Invoices per listing request
+
+        Yields:
+            Invoice: Local invoice with updated status
+
+        Raises:
+            ValueError: If provider was not added or doesn't support listing invoices
+
+        Example:
+            since = await store.oldest_pending('cryptobot')
+            async for invoice in pay.reconcile('cryptobot', since=since, lookup=store.get_many):
+                print(invoice.identifier, invoice.status)
+        """
+        module = registry.module(provider)
+        if not hasattr(module, 'list_invoices'):
+            raise ValueError(f'Provider {provider} does not support listing invoices')
+        accounts = [creds for creds in self.provider.list() if creds.name == provider and len(creds.__dict__) > 1]
+        if not accounts:
+            raise ValueError(f'Provider {provider} was not added, please add it first')
+        if lookup is None:
+            scheduler = self.provider.scheduler
+            if since is None:
+                since = scheduler.oldest(provider)
+                if since is None:
+                    return
+
+            def lookup(name: str, identifiers: List[str]) -> Dict[str, Invoice]:
+                return {identifier: invoice for identifier in identifiers
+                        if (invoice := scheduler.find(name, identifier)) is not None}
+        if since is not None:
+            # local and provider clocks differ, and local creation time is taken after the provider's
+            since = since.astimezone() - timedelta(minutes=5)
+        for creds in accounts:
+            offset = 0
+            while True:
+                page = await self.provider.call(creds, 'reconcile', lambda: module.list_invoices(
+                    creds, self.provider.pool, status=status, offset=offset, count=page_size), page_size)
+                if not page:
+                    break
+                offset += len(page)
+                local = lookup(provider, [identifier for identifier, _, _ in page])
+                if isawaitable(local):
+                    local = await local
+                for identifier, remote_status, _ in page:
+                    invoice = local.get(identifier)
+                    if invoice is not None and invoice.status != remote_status:
+                        self.provider.statuses.put(StatusCache.key(invoice), remote_status)
+                        await self.provider.scheduler.update(invoice, remote_status)
+                        yield invoice
+                if len(page) < page_size or since is not None and all(
+                        created_at is not None and created_at.astimezone() < since for _, _, created_at in page):
+                    break
+
+    async def warmup(self, timeout: float = 10, connections: int = 1) -> List[ProviderReadiness]:
+        """
+        Prepares every added provider account for the first invoice and validates its credentials
+
+        Imports the provider module, builds its pooled client, resolves the host (kept in the pool DNS cache)
+        and opens keep-alive connections with cheap authorized requests (getMe for cryptobot, balance for others),
+        so the first checkout doesn't pay for any of it and bad credentials show up on startup. Observed latency
+        also seeds provider routing. Accounts are warmed up concurrently, errors are reported, not raised.
+
+        Args:
+            timeout: Seconds to wait for one account
+            connections: Requests sent at once per account, i.e. keep-alive connections left open
+
+        Returns:
+            List[ProviderReadiness]: Readiness of every added account
+
+        Example:
+            for readiness in await pay.warmup():
+                if not readiness.ready:
+                    print(readiness)
+        """
+        async def warm(creds: Provider) -> ProviderReadiness:
+            account, start = getattr(creds, 'account', None), perf_counter()
+            try:
+                module = registry.module(creds.name)
+                validate = getattr(module, 'warmup', None) or getattr(module, 'get_balance', None)
+                if validate is not None:
+                    await wait_for(gather(*(self.provider.call(creds, 'warmup',
+                                                               lambda: validate(creds, self.provider.pool))
+                                            for _ in range(connections))), timeout)
+            except Exception as e:
+                return ProviderReadiness(creds.name, account, False, perf_counter() - start, e)
+            return ProviderReadiness(creds.name, account, True, perf_counter() - start)
+
+        return list(await gather(*(warm(creds) for creds in self.provider.list() if len(creds.__dict__) > 1)))
+
+    def webhook(self, resolver: Callable[[str, str], Any] = None) -> Any:
+        """
+        Creates webhook handler receiving provider payment notifications for this instance,
+        status changes are delivered to scheduler.on_status callbacks and scheduler.updates() iterators
+
+        Args:
+            resolver: Callable (or coroutine) resolver(provider, identifier) returning Invoice or None,
+                used for invoices that are not tracked in memory
+
+        Returns:
+            WebhookHandler: Handler, mount it with handler.app() or run it with await handler.start(port=...)
+        """
+        from .webhook import WebhookHandler
+
+        return WebhookHandler(self, resolver)
+
+    async def close(self) -> None:
+        """
+        Stops background polling, closes pooled clients and connections,
+        instance can still be used afterwards (pool is reopened lazily)
+        """
+        await self.provider.scheduler.stop()
+        if self.rates is not None:
+            await self.rates.stop()
+        await self.provider.pool.close()
+
+    async def __aenter__(self) -> Self:
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
 
     async def create_invoice(self, amount: int | float, currency: str = 'USD', provider: str | Provider = None,
-                             identifier=None, **kwargs) -> Invoice:
-        """_summary_
+                             identifier=None, run_check: bool = False, **kwargs) -> Invoice:
+        """Creates an invoice with a provider
 
         Args:
-            amount (int | float): _description_
-            currency (str, optional): _description_. Defaults to 'USD'.
-            provider (str | Provider, optional): _description_. Defaults to None.
-            identifier (_type_, optional): _description_. Defaults to None.
+            amount (int | float): Invoice amount
+            currency (str, optional): Invoice currency. Defaults to 'USD'.
+            provider (str | Provider, optional): Provider to create invoice with. If not provided, it is picked
+                among added providers accepting the currency by the routing policy, and the next one is tried
+                if creation fails. Defaults to None.
+            identifier (str, optional): Identifier of an existing invoice, returns it without creating a new one. Defaults to None.
+            run_check (bool, optional): Track invoice status in the background scheduler. Defaults to False.
+            convert_to (str, optional): Currency to convert amount to with exchange rates (rates kwarg of EasyPay).
+                Without it, amount is converted automatically when the provider doesn't accept the currency and
+                rates are configured. Original amount and currency are kept in invoice metadata.
+            idempotency_key (str, optional): Key of the order the invoice is for. Calls with a key that was already
+                used return the invoice created by the first call without a provider request, concurrent calls
+                wait for one creation. Keys are kept by EasyPay idempotency cache.
 
         Returns:
             Invoice: (Invoice) invoice object
+
+        Raises:
+            ValueError: If no added provider accepts the currency, exchange rate is not known, idempotency key
+                was used for an invoice with another amount or currency, or the error of the last tried provider
         """
-        invoice = Invoice(self.provider, amount=amount, currency=currency)
+        idempotency_key = kwargs.pop('idempotency_key', None)
+        if idempotency_key is not None and not identifier:
+            invoice = await self.idempotency.get_or_create(str(idempotency_key), lambda: self.create_invoice(
+                amount, currency, provider, identifier, run_check, **kwargs))
+            metadata = invoice.metadata or {}
+            original_amount = metadata.get('original_amount', invoice.amount)
+            original_currency = metadata.get('original_currency', invoice.currency)
+            if (original_amount, original_currency) != (amount, currency):
+                raise ValueError(f'Idempotency key {idempotency_key} was already used for an invoice of '
+                                 f'{invoice.amount} {invoice.currency}')
+            if run_check:
+                self.watch(invoice)
+            return invoice
+        convert_to = kwargs.pop('convert_to', None)
+        invoice = Invoice(self.provider, amount=amount, currency=currency, **kwargs)
         if identifier:
             return await self.invoice(identifier=identifier, amount=amount, currency=currency, provider=provider,
                                       **kwargs)
-        return await invoice.create(provider)
+        if convert_to is not None:
+            await self._convert(invoice, amount, currency, convert_to)
+        if provider is not None and provider != '':
+            if self.rates is None or convert_to is not None:
+                return await invoice.create(provider, run_check)
+            if not isinstance(provider, Provider):
+                provider = self.provider.select(provider)
+            await self._convert_for(invoice, provider, amount, currency)
+            return await invoice.create(provider, run_check)
+        candidates = self.provider.router.rank(invoice.currency)
+        if not candidates and self.rates is not None and convert_to is None:
+            candidates = self.provider.router.rank(None)
+        if not candidates:
+            raise ValueError(f'None of the added providers accepts {invoice.currency} currency')
+        for index, creds in enumerate(candidates):
+            try:
+                if convert_to is None:
+                    await self._convert_for(invoice, creds, amount, currency)
+                return await invoice.create(creds, run_check)
+            except Exception as e:
+                if index == len(candidates) - 1:
+                    raise
+                print(f"{creds.name} wasn't able to create invoice ({type(e).__name__}: {str(e)[:100]}), "
+                      f"failing over to {candidates[index + 1].name}")
+
+    async def _convert(self, invoice: Invoice, amount: int | float, currency: str, target: str) -> None:
+        if self.rates is None:
+            raise ValueError('Exchange rates are not configured, pass rates to EasyPay to convert currencies')
+        invoice.amount = await self.rates.convert(amount, currency, target)
+        invoice.currency = target
+        if target != currency:
+            invoice.metadata = {**(invoice.metadata or {}), 'original_amount': amount, 'original_currency': currency}
+
+    async def _convert_for(self, invoice: Invoice, creds: Provider, amount: int | float, currency: str) -> None:
+        """
+        Sets invoice amount and currency to ones the provider accepts, converting with exchange rates if needed
+        """
+        if Router.supports(creds, currency):
+            invoice.amount, invoice.currency = amount, currency
+            return
+        for target in Router.currencies(creds) or ():
+            try:
+                return await self._convert(invoice, amount, currency, target)
+            except ValueError:
+                continue
+        raise ValueError(f'{creds.name} provider does not accept {currency} currency and no exchange rate '
+                         f'to the currencies it accepts is known')
+
+    async def create_invoices(self, items: Iterable | AsyncIterable, concurrency: int = 32,
+                              run_check: bool = False) -> AsyncIterator[Invoice | Exception]:
+        """
+        Creates many invoices, yielding each invoice (or the exception that prevented its creation) in input order
+
+        At most concurrency creations are in flight and items are pulled from the iterable lazily. Providers that
+        create invoices locally (aaio signs the payment URL without a request) skip the network and task overhead.
+        Items without a provider are routed like in create_invoice.
+
+        Args:
+            items: Iterable or async iterable of (amount, currency, provider, metadata) tuples (trailing elements
+                can be omitted) or dicts with create_invoice keyword arguments
+            concurrency: Maximum number of simultaneous provider requests
+            run_check: Track created invoices in the background scheduler
+
+        Yields:
+            Invoice | Exception: Created invoice or the exception raised for this item, in input order
+
+        Example:
+            async for result in pay.create_invoices((100, 'RUB', 'aaio', {'order': i}) for i in range(1000)):
+                if isinstance(result, Exception):
+                    ...
+        """
+        async def jobs():
+            async for item in aiter_any(items):
+                kwargs = dict(item) if isinstance(item, dict) else dict(zip(('amount', 'currency', 'provider',
+                                                                             'metadata'), item))
+                kwargs.setdefault('currency', 'USD')
+                check = kwargs.pop('run_check', run_check)
+                provider = kwargs.pop('provider', None)
+                if provider is None or provider == '':
+                    yield self.create_invoice(provider=None, run_check=check, **kwargs)
+                    continue
+                try:
+                    if 'convert_to' in kwargs or 'idempotency_key' in kwargs or self.rates is not None and not Router.supports(
+                            provider if isinstance(provider, Provider) else self.provider.account(provider),
+                            kwargs['currency']):
+                        yield self.create_invoice(provider=provider, run_check=check, **kwargs)
+                        continue
+                    invoice = Invoice(self.provider, **kwargs)
+                    if invoice.account is None and not isinstance(provider, Provider):
+                        provider = self.provider.select(provider)
+                    binding = invoice.bind_provider(provider)
+                    if not hasattr(binding, 'sign'):
+                        yield invoice.create(provider, check)
+                        continue
+                    start = perf_counter()
+                    binding.sign()
+                    self.provider.record(binding.creds, 'create', perf_counter() - start)
+                    if check:
+                        self.provider.scheduler.add(invoice)
+                    yield ready(invoice)
+                except Exception as e:
+                    yield ready(error=e)
+
+        async for result in ordered_bounded(jobs(), concurrency):
+            yield result
+
+    async def check_many(self, invoices: Iterable[Invoice] | AsyncIterable[Invoice], concurrency: int = 32,
+                         batch_size: int = 100,
+                         on_error: Callable[[Invoice, Exception], Any] = None) -> AsyncIterator[Invoice]:
+        """
+        Checks status of many invoices, yielding each invoice as soon as its status is updated
+
+        Invoices are grouped by provider credentials, providers with a bulk endpoint (e.g. cryptobot)
+        check up to batch_size invoices per request, others are checked one by one. At most concurrency
+        requests are in flight and invoices are pulled from the iterable lazily, so it can be a generator
+        streaming from storage.
+
+        An invoice that can't be checked (provider or account was removed, check failed after retries) is not
+        yielded and doesn't stop the others. When a bulk request is rejected for a reason other than a transient
+        error, its invoices are checked one by one (at most concurrency at a time), so a single bad invoice doesn't
+        fail the whole batch.
+
+        Args:
+            invoices: Iterable or async iterable of invoices
+            concurrency: Maximum number of simultaneous provider requests
+            batch_size: Maximum number of invoices in one bulk request
+            on_error: Called as on_error(invoice, error) for every invoice that wasn't checked, can be
+                a coroutine. Errors are printed if not provided
+
+        Yields:
+            Invoice: Invoice with updated status (in completion order, not input order)
+
+        Example:
+            async for invoice in pay.check_many(pending):
+                print(invoice.identifier, invoice.status)
+        """
+        providers = self.provider
+        statuses = providers.statuses
+
+        async def failed(invoice: Invoice, error: Exception) -> List[Invoice]:
+            if on_error is None:
+                print(f"Wasn't able to check invoice {invoice.identifier} of {invoice.provider} provider "
+                      f"({type(error).__name__}: {str(error)[:100]})")
+                return []
+            result = on_error(invoice, error)
+            if isawaitable(result):
+                await result
+            return []
+
+        async def check_one(binding: Any, invoice: Invoice) -> List[Invoice]:
+            try:
+                invoice.status = await statuses.check(StatusCache.key(invoice), lambda: providers.call(
+                    binding.creds, 'check', binding.check))
+            except Exception as e:
+                return await failed(invoice, e)
+            return [invoice]
+
+        async def check_batch(binding: Any, batch: List[Invoice], bindings: List[Any]) -> List[Invoice]:
+            try:
+                await providers.call(binding.creds, 'check_many', lambda: binding.check_many(batch), len(batch))
+            except Exception as e:
+                if len(batch) == 1 or is_transient(e) or isinstance(e, (CircuitOpenError, RateLimitError)):
+                    for invoice in batch:
+                        await failed(invoice, e)
+                    return []
+                return [invoice async for invoices in as_completed_bounded(
+                    map(check_one, bindings, batch), concurrency) for invoice in invoices]
+            for invoice in batch:
+                statuses.put(StatusCache.key(invoice), invoice.status)
+            return batch
+
+        async def jobs():
+            batches = {}
+            async for invoice in aiter_any(invoices):
+                try:
+                    binding = await invoice.bind()
+                except Exception as e:
+                    yield failed(invoice, e)
+                    continue
+                status = statuses.get(StatusCache.key(invoice))
+                if status is not None:
+                    statuses.hits += 1
+                    invoice.status = status
+                    yield ready([invoice])
+                    continue
+                if not hasattr(binding, 'check_many'):
+                    yield check_one(binding, invoice)
+                    continue
+                key = (type(binding), id(binding.creds))
+                batch, bindings = batches.setdefault(key, ([], []))
+                batch.append(invoice)
+                bindings.append(binding)
+                if len(batch) >= batch_size:
+                    del batches[key]
+                    yield check_batch(bindings[0], batch, bindings)
+            for batch, bindings in batches.values():
+                yield check_batch(bindings[0], batch, bindings)
+
+        async for checked in as_completed_bounded(jobs(), concurrency):
+            for invoice in checked:
+                yield invoice
 
     async def invoice(self, **kwargs) -> Invoice | None:
         """
@@ -2,14 +2,94 @@ from hashlib import sha256
 from uuid import uuid4
 import aiohttp
 import hashlib
-from urllib.parse import urlencode
-from asyncio import wait_for
-from requests.exceptions import ConnectTimeout, ReadTimeout
+from hmac import compare_digest
+from urllib.parse import urlencode, parse_qsl
+
+from ..http import timeouts
+from ..retry import TransientError
+
+
+CURRENCIES = ('RUB', 'UAH', 'EUR', 'USD')
+
+STATUSES = {'success': 'paid', 'hold': 'paid', 'expired': 'expired', 'in_process': 'pending'}
+
+
+def is_not_found(payment_info):
+    """Whether info-pay response is the order not found error"""
+    message = str(payment_info.get('message', '')).lower()
+    return payment_info.get('code') == 404 or 'order' in message and 'not found' in message or \
+        'заказ' in message and 'не найден' in message
+
+
+def parse_status(payment_info):
+    """
+    Maps info-pay response to invoice status (paid, expired or pending)
+    Orders that were not opened by the payer yet don't exist on AAIO side and are reported as pending,
+    other errors (invalid API key, unknown merchant, ...) raise ValueError
+    """
+    if not payment_info:
+        raise ValueError("Wasn't able to get payment info from AAIO: empty response")
+    if payment_info.get('type') != 'success':
+        if is_not_found(payment_info):
+            return 'pending'
+        raise ValueError(f"Wasn't able to get payment info from AAIO: {payment_info.get('message', payment_info)}")
+    return STATUSES.get(payment_info.get('status'), 'pending')
+
+
+def parse_webhook(creds, headers, body):
+    """
+    Verifies AAIO payment notification and returns (identifier, status)
+    See https://wiki.aaio.so/priem-platezhei/opoveshchenie-o-platezhe, needs 2nd secret key (secret2 provider kwarg)
+    """
+    if 'secret2' not in creds.__dict__.keys():
+        raise ValueError(f'secret2 is required to receive webhooks for {creds.name} provider')
+    data = dict(parse_qsl(body.decode('utf-8')))
+    sign = ':'.join([data.get('merchant_id', ''), data.get('amount', ''), data.get('currency', ''),
+                     str(creds.secret2), data.get('order_id', '')])
+    if not compare_digest(hashlib.sha256(sign.encode('utf-8')).hexdigest(), data.get('sign', '')):
+        raise ValueError(f'Invalid webhook signature for {creds.name} provider')
+    return data['order_id'], 'paid'
+
+
+def payment_url(merchant_id, secret, order_id, amount, currency='RUB', lang='ru', description=None,
+                base_url='https://aaio.so'):
+    """
+    Builds signed payment URL, no request is made
+    See https://wiki.aaio.so/priem-platezhei/sozdanie-zakaza
+    """
+    sign = ':'.join([str(merchant_id), str(amount), str(currency), str(secret), str(order_id)])
+    params = {
+        'merchant_id': merchant_id,
+        'amount': amount,
+        'currency': currency,
+        'order_id': order_id,
+        'sign': hashlib.sha256(sign.encode('utf-8')).hexdigest(),
+        'desc': description,
+        'lang': lang
+    }
+    return f"{base_url.rstrip('/')}/merchant/pay?" + urlencode(params)
+
+
+def get_client(creds, pool):
+    """Returns pooled AsyncAaioAPI client for the credentials"""
+    base_url = creds.base_url if 'base_url' in creds.__dict__.keys() else 'https://aaio.so'
+    return pool.client(('aaio', creds.merchant_id, creds.api_key, creds.secret, base_url),
+                       lambda: AsyncAaioAPI(creds.api_key, creds.secret, creds.merchant_id,
+                                            session=pool.session(**timeouts(creds, total=10)),
+                                            base_url=base_url))
+
+
+async def get_balance(creds, pool):
+    """Returns balance response JSON, raises ValueError if AAIO returned an error"""
+    balance = await get_client(creds, pool).get_balance()
+    if isinstance(balance, str):
+        raise ValueError(f"Wasn't able to get balance for {creds.name} provider: {balance}")
+    return balance
 
 
 class AsyncAaioAPI:
     """Originally written by https://github.com/wkillus/"""
-    def __init__(self, API_KEY, SECRET_KEY, MERCHANT_ID):
+    def __init__(self, API_KEY, SECRET_KEY, MERCHANT_ID, session=None, base_url='https://aaio.so'):
         """
         Creates instance of one AAIO merchant API client
 
@@ -17,10 +97,35 @@ class AsyncAaioAPI:
             merchant_id: Merchant ID from https://aaio.so/cabinet
             secret: 1st secret key from https://aaio.so/cabinet
             api_key: API key from https://aaio.so/cabinet/api
+            session: Pooled aiohttp.ClientSession to reuse (Optional, new session per request otherwise)
+            base_url: AAIO base URL (Optional, e.g. for a local stand-in server)
         """
         self.API_KEY = API_KEY
         self.SECRET_KEY = SECRET_KEY
         self.MERCHANT_ID = MERCHANT_ID
+        self.session = session
+        self.base_url = base_url.rstrip('/')
+
+    async def _post(self, URL, data=None):
+        """Sends POST request through the pooled session, returns response status and parsed JSON (None if not JSON)"""
+
+        headers = {
+            'Accept': 'application/json',
+            'X-Api-Key': self.API_KEY
+        }
+
+        if self.session is None:
+            async with aiohttp.ClientSession() as session:
+                return await self._send(session, URL, headers, data)
+        return await self._send(self.session, URL, headers, data)
+
+    @staticmethod
+    async def _send(session, URL, headers, data):
+        async with session.post(URL, data=data, headers=headers) as response:
+            try:
+                return response.status, await response.json()
+            except (aiohttp.ContentTypeError, ValueError):
+                return response.status, None
 
     async def get_balance(self):
         """
@@ -30,35 +135,26 @@ class AsyncAaioAPI:
         Returns: Model from response JSON
         """
 
-        URL = 'https://aaio.so/api/balance'
-
-        headers = {
-            'Accept': 'application/json',
-            'X-Api-Key': self.API_KEY
-        }
+        URL = f'{self.base_url}/api/balance'
 
         try:
-            async with aiohttp.ClientSession(headers=headers) as session:
-
-                async with session.post(URL) as response:
+            status, response_json = await self._post(URL)
 
-                    if (response.status in [200, 400, 401]):
-                        try:
-                            response_json = await response.json()  # Парсинг результата
-                        except:
-                            return 'Не удалось пропарсить ответ'
+            if (status in [200, 400, 401]):
+                if response_json is None:
+                    return 'Не удалось пропарсить ответ'
 
-                        if (response_json['type'] == 'success'):
-                            return response_json
-                        else:
-                            return 'Ошибка: ' + response_json['message']  # Вывод ошибки
-                    else:
-                        return 'Response code: ' + str(response.status)  # Вывод неизвестного кода ответа
+                if (response_json['type'] == 'success'):
+                    return response_json
+                else:
+                    return 'Ошибка: ' + response_json['message']  # Вывод ошибки
+            else:
+                return 'Response code: ' + str(status)  # Вывод неизвестного кода ответа
 
-        except ConnectTimeout:
+        except aiohttp.ServerTimeoutError:
             return 'ConnectTimeout'  # Не хватило времени на подключение к сайту
 
-        except ReadTimeout:
+        except TimeoutError:
             return 'ReadTimeout'  # Не хватило времени на выполнение запроса
 
     async def create_payment(self, order_id,
@@ -79,30 +175,8 @@ class AsyncAaioAPI:
 
         """
 
-        merchant_id = self.MERCHANT_ID  # merchant id
-        secret = self.SECRET_KEY  # secret key №1 from shop settings
-
-        sign = f':'.join([
-            str(merchant_id),
-            str(amount),
-            str(currency),
-            str(secret),
-            str(order_id)
-        ])
-
-        params = {
-            'merchant_id': merchant_id,
-            'amount': amount,
-            'currency': currency,
-            'order_id': order_id,
-            'sign': hashlib.sha256(sign.encode('utf-8')).hexdigest(),
-            'desc': description,
-            'lang': lang
-        }
-
-        url_aaio = "https://aaio.so/merchant/pay?" + urlencode(params)
-
-        return url_aaio
+        return payment_url(self.MERCHANT_ID, self.SECRET_KEY, order_id, amount, currency, lang, description,
+                           self.base_url)
 
     async def get_payment_info(self, order_id):
         """
@@ -116,39 +190,37 @@ class AsyncAaioAPI:
 
         """
 
-        URL = 'https://aaio.so/api/info-pay'
+        URL = f'{self.base_url}/api/info-pay'
 
         params = {
             'merchant_id': self.MERCHANT_ID,
             'order_id': order_id
         }
 
-        headers = {
-            'Accept': 'application/json',
-            'X-Api-Key': self.API_KEY
+        status, response_json = await self._post(URL, data=params)
 
-        }
+        return response_json
 
-        async with aiohttp.ClientSession(headers=headers) as session:
-            async with session.post(URL, data=params) as response:
-                response_json = await response.json()
+    async def get_status(self, order_id):
+        """
+        Gets payment status in a single info-pay request
+
+        Returns: (status, response JSON), status is one of paid, expired, pending
+        """
 
-                return response_json
+        response_json = await self.get_payment_info(order_id)
+
+        return parse_status(response_json), response_json
 
     async def is_expired(self, order_id):
         """Check status payment (expired)"""
 
-        response_json = await self.get_payment_info(order_id)
-
-        return response_json['type'] == 'success' and response_json['status'] == 'expired'
+        return (await self.get_status(order_id))[0] == 'expired'
 
     async def is_success(self, order_id):
         """Check status payment (success)"""
 
-        response_json = await self.get_payment_info(order_id)
-
-        return (response_json['type'] == 'success' and response_json['status'] == 'success') or \
-            (response_json['type'] == 'success' and response_json['status'] == 'hold')
+        return (await self.get_status(order_id))[0] == 'paid'
 
 
 class Invoice:
@@ -157,39 +229,42 @@ class Invoice:
         self.invoice = invoice
         self.amount = amount
 
+        if 'merchant_id' not in self.creds.__dict__.keys():
+            raise ValueError(f'merchant_id is required for {self.creds.name} provider')
+
         if 'api_key' not in self.creds.__dict__.keys():
-            raise ValueError(f'api_key is required for {self.creds.provider} provider')
+            raise ValueError(f'api_key is required for {self.creds.name} provider')
 
         if 'secret' not in self.creds.__dict__.keys():
-            raise ValueError(f'secret is required for {self.creds.provider} provider')
+            raise ValueError(f'secret is required for {self.creds.name} provider')
+
+    def client(self):
+        return get_client(self.creds, self.invoice.providers.pool)
 
     def create_signature(self):
-        signature_string = f"{self.creds.api_key}:{self.amount}:{self.invoice.currency}:{self.creds.secret}:{self.invoice.identifier}"
+        signature_string = f"{self.creds.merchant_id}:{self.amount}:{self.invoice.currency}:{self.creds.secret}:{self.invoice.identifier}"
         signature = sha256(signature_string.encode('utf-8')).hexdigest()
         return signature
 
-    async def create(self):
-        client = AsyncAaioAPI(self.creds.api_key, self.creds.secret, self.creds.api_key)
-
+    def sign(self):
+        """Creates invoice locally (payment URL is signed, nothing is sent to AAIO), used by create and bulk creation"""
         self.invoice.identifier = str(uuid4())
         lang = self.creds.language if 'language' in self.creds.__dict__.keys() else 'en'
-
-        signature = self.create_signature()
-        self.invoice.pay_info = await client.create_payment(self.invoice.identifier, self.amount, lang, self.invoice.currency, 'AAIO Payment')
+        base_url = self.creds.base_url if 'base_url' in self.creds.__dict__.keys() else 'https://aaio.so'
+        self.invoice.pay_info = payment_url(self.creds.merchant_id, self.creds.secret, self.invoice.identifier,
+                                            self.amount, self.invoice.currency, lang, 'AAIO Payment', base_url)
         return self.invoice.pay_info
 
+    async def create(self):
+        return self.sign()
+
+    async def info(self):
+        """Fetches parsed payment info (info-pay response JSON) and stores it in self.payment_info"""
+        self.payment_info = await self.client().get_payment_info(self.invoice.identifier)
+        if self.payment_info is None:
+            raise TransientError(f"Wasn't able to get payment info for {self.creds.name} provider: response is not JSON")
+        return self.payment_info
+
     async def check(self):
-        client = AsyncAaioAPI(self.creds.api_key, self.creds.secret, self.creds.api_key)
-
-        expired = await wait_for(client.is_expired(self.invoice.identifier), timeout=10)
-        success = await wait_for(client.is_success(self.invoice.identifier), timeout=10)
-
-        if expired:
-            self.invoice.status = 'expired'
-            return 'expired'
-        elif success:
-            self.invoice.status = 'paid'
-            return 'paid'
-        else:
-            self.invoice.status = 'pending'
-            return 'pending'
+        self.invoice.status = parse_status(await self.info())
+        return self.invoice.status
@@ -1,6 +1,69 @@
+from hashlib import sha256
+from hmac import HMAC, compare_digest
+from json import loads
 from aiocryptopay import AioCryptoPay, Networks
+from aiocryptopay.const import Assets
 from aiocryptopay.exceptions import factory
 
+from ..http import timeouts
+
+
+CURRENCIES = tuple(Assets.values())
+
+
+def parse_webhook(creds, headers, body):
+    """
+    Verifies Crypto Bot webhook update and returns (identifier, status)
+    See https://help.crypt.bot/crypto-pay-api#verifying-webhook-updates
+    """
+    secret = sha256(creds.api_key.encode('utf-8')).digest()
+    signature = HMAC(secret, body, sha256).hexdigest()
+    if not compare_digest(signature, headers.get('Crypto-Pay-Api-Signature', '')):
+        raise ValueError(f'Invalid webhook signature for {creds.name} provider')
+    update = loads(body)
+    if not isinstance(update, dict) or not isinstance(update.get('payload'), dict):
+        raise ValueError(f'Invalid webhook body for {creds.name} provider: JSON object with payload expected')
+    if update.get('update_type') != 'invoice_paid':
+        raise ValueError(f"Unsupported webhook update for {creds.name} provider: {update.get('update_type')}")
+    return update['payload']['invoice_id'], update['payload'].get('status', 'paid')
+
+
+def get_client(creds, pool):
+    """Returns pooled AioCryptoPay client for the credentials"""
+    network = getattr(creds, 'network', 'main')
+    network = (Networks.MAIN_NET if network == 'main' else Networks.TEST_NET) if network else Networks.MAIN_NET
+    if 'base_url' in creds.__dict__.keys():
+        network = creds.base_url.rstrip('/')
+
+    def new_client():
+        crypto = AioCryptoPay(token=creds.api_key, network=network)
+        crypto._session = pool.session(**timeouts(creds))  # reuse shared keep-alive connector instead of a private one
+        return crypto
+
+    return pool.client(('cryptobot', creds.api_key, network), new_client)
+
+
+async def get_balance(creds, pool):
+    """Returns list of app balances (aiocryptopay Balance models)"""
+    return await get_client(creds, pool).get_balance()
+
+
+async def warmup(creds, pool):
+    """Validates credentials with getMe, the cheapest authorized method, returns app info"""
+    return await get_client(creds, pool).get_me()
+
+
+async def list_invoices(creds, pool, status=None, offset=0, count=1000):
+    """Returns one getInvoices page, newest first, as (identifier, status, created_at) tuples"""
+    invoices = await get_client(creds, pool).get_invoices(status=status, offset=offset, count=count)
+    return [(str(invoice.invoice_id), invoice.status, invoice.created_at) for invoice in invoices or []]
+
+
+async def get_exchange_rates(creds, pool):
+    """Returns {(source, target): rate} of valid Crypto Bot exchange rates"""
+    rates = await get_client(creds, pool).get_exchange_rates()
+    return {(rate.source, rate.target): rate.rate for rate in rates if rate.is_valid}
+
 
 class Invoice:
     def __init__(self, provider, invoice, amount):
@@ -14,10 +77,11 @@ class Invoice:
         if 'network' not in self.creds.__dict__.keys():
             self.creds.network = 'main'
 
+    def client(self):
+        return get_client(self.creds, self.invoice.providers.pool)
+
     async def create(self):
-        self.crypto = AioCryptoPay(token=self.creds.api_key,
-                            network=(Networks.MAIN_NET if self.creds.network == 'main' else Networks.TEST_NET)
-                            if self.creds.network else Networks.MAIN_NET)        
+        self.crypto = self.client()
         try:
             invoice = await self.crypto.create_invoice(asset=self.invoice.currency, amount=self.amount)
         except factory.CodeErrorFactory as e:
@@ -25,15 +89,20 @@ class Invoice:
         self.invoice.pay_info = invoice.bot_invoice_url
         self.invoice.identifier = invoice.invoice_id
         self.invoice.status = invoice.status
-        await self.crypto.close()
         return invoice.bot_invoice_url
 
     async def check(self):
-        self.crypto = AioCryptoPay(token=self.creds.api_key,
-                            network=(Networks.MAIN_NET if self.creds.network == 'main' else Networks.TEST_NET)
-                            if self.creds.network else Networks.MAIN_NET)        
-        invoice = await self.crypto.get_invoices(invoice_ids=self.invoice.identifier)
+        self.crypto = self.client()
+        invoice = await self.crypto.get_invoices(invoice_ids=int(self.invoice.identifier))
         if invoice.status != self.invoice.status:
             self.invoice.status = invoice.status
-        await self.crypto.close()
         return self.invoice.status
+
+    async def check_many(self, invoices):
+        """Checks invoices created with the same credentials in one getInvoices request"""
+        self.crypto = self.client()
+        by_id = {str(invoice.identifier): invoice for invoice in invoices}
+        found = await self.crypto.get_invoices(invoice_ids=list(by_id), count=len(by_id))
+        for invoice in found or []:
+            by_id[str(invoice.invoice_id)].status = invoice.status
+        return invoices
@@ -1,4 +1,50 @@
-from requests import post
+from hashlib import sha1
+from hmac import compare_digest
+from json import loads
+
+from ..http import timeouts
+from ..retry import TransientError
+
+
+BASE_URL = "https://api.crystalpay.io/v2"
+
+CURRENCIES = ('RUB',)
+
+STATES = {'payed': 'paid', 'notpayed': 'pending', 'processing': 'pending', 'cancelled': 'cancelled'}
+
+
+def parse_webhook(creds, headers, body):
+    """
+    Verifies CrystalPay callback and returns (identifier, status)
+    Signature is sha1("{id}:{salt}"), salt is taken from the cash register settings (salt provider kwarg)
+    """
+    if 'salt' not in creds.__dict__.keys():
+        raise ValueError(f'salt is required to receive webhooks for {creds.name} provider')
+    data = loads(body)
+    if not isinstance(data, dict):
+        raise ValueError(f'Invalid webhook body for {creds.name} provider: JSON object expected')
+    signature = sha1(f"{data.get('id')}:{creds.salt}".encode('utf-8')).hexdigest()
+    if not compare_digest(signature, str(data.get('signature', ''))):
+        raise ValueError(f'Invalid webhook signature for {creds.name} provider')
+    return data['id'], STATES.get(data.get('state'), 'pending')
+
+
+async def request(creds, pool, method, payload):
+    """Sends authorized API request through the pooled session, returns response JSON"""
+    base_url = creds.base_url.rstrip('/') if 'base_url' in creds.__dict__.keys() else BASE_URL
+    payload = {"auth_login": creds.login, "auth_secret": creds.secret, **payload}
+    async with pool.session(**timeouts(creds)).post(f"{base_url}/{method}/", json=payload) as response:
+        if response.status >= 500:
+            raise TransientError(f"{creds.name} provider answered HTTP {response.status}")
+        return await response.json(content_type=None)
+
+
+async def get_balance(creds, pool):
+    """Returns cash register balances, raises ValueError if CrystalPay returned an error"""
+    data = await request(creds, pool, "balance/info", {})
+    if data.get("error"):
+        raise ValueError(f"Wasn't able to get balance for {creds.name} provider: {data.get('errors')}")
+    return data.get("balances", data)
 
 
 class Invoice:
@@ -13,43 +59,32 @@ class Invoice:
         if 'secret' not in self.creds.__dict__.keys():
             raise ValueError(f'secret is required for {self.creds.name} provider')
 
-        if self.invoice.currency != 'RUB':
+        if self.invoice.currency not in CURRENCIES:
             raise ValueError(f'Only RUB currency is supported for {self.creds.name} provider')
 
+    async def request(self, method, payload):
+        return await request(self.creds, self.invoice.providers.pool, method, payload)
+
     async def create(self):
-        url = "https://api.crystalpay.io/v2/invoice/create/"
-        payload = {
-            "auth_login": self.creds.login,
-            "auth_secret": self.creds.secret,
+        data = await self.request("invoice/create", {
             "amount": self.amount,
             "type": 'purchase',
             "description": 'CrystalPay payment',
             "redirect_url": self.creds.redirect_url if 'redirect_url' in self.creds.__dict__.keys() else "https://nichind.dev",
             "callback_url": self.creds.callback_url if 'callback_url' in self.creds.__dict__.keys() else "https://nichind.dev",
             "lifetime": 1440
-        }
-        headers = {'Content-Type': 'application/json'}
-
-        response = post(url, json=payload, headers=headers)
-        data = response.json()
+        })
 
         if data.get("error"):
-            raise ValueError(f"Wasn't able to create invoice for {self.creds.name} provider:  {data.get("errors")}")
+            raise ValueError(f"Wasn't able to create invoice for {self.creds.name} provider: {data.get('errors')}")
         self.invoice.identifier = data.get("id")
         self.invoice.pay_info = data.get("url")
         return self.invoice.pay_info
 
     async def check(self):
-        url = "https://api.crystalpay.io/v2/invoice/info/"
-        payload = {
-            "auth_login": self.creds.login,
-            "auth_secret": self.creds.secret,
-            "id": self.invoice.identifier
-        }
-        headers = {'Content-Type': 'application/json'}
-
-        response = post(url, json=payload, headers=headers)
-        data = response.json()
-
-        self.invoice.status = 'paid' if data.get("state") == 'payed' else 'pending'
+        data = await self.request("invoice/info", {"id": self.invoice.identifier})
+
+        if data.get("error"):
+            raise ValueError(f"Wasn't able to check invoice for {self.creds.name} provider: {data.get('errors')}")
+        self.invoice.status = STATES.get(data.get("state"), 'pending')
         return self.invoice.status
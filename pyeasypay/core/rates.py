@@ -0,0 +1,148 @@
+from asyncio import CancelledError, create_task, get_running_loop, sleep
+from collections.abc import Awaitable, Callable
+from typing import Dict, Tuple
+
+from .concurrency import SharedCalls
+
+
+FIAT = ('RUB', 'USD', 'EUR', 'UAH', 'KZT', 'BYN', 'UZS', 'GEL', 'TRY', 'AMD', 'THB', 'INR', 'BRL', 'IDR', 'AZN',
+        'AED', 'PLN', 'ILS', 'KGS', 'TJS', 'GBP', 'CNY')
+
+RateTable = Dict[Tuple[str, str], float]
+
+
+class ExchangeRates:
+    """
+    TTL-cached exchange rate table
+
+    Rates come from source, an async callable returning {(source_currency, target_currency): rate}, e.g. Crypto Bot
+    getExchangeRates (EasyPay(rates='cryptobot')). All concurrent callers share one fetch, and while the table is
+    in use it is refreshed in the background before it expires, so conversions normally don't wait for the network.
+    """
+    def __init__(self, source: Callable[[], Awaitable[RateTable]], ttl: float = 60, max_stale: float = 600,
+                 background: bool = True) -> None:
+        """
+        Args:
+            source: Async callable returning rate table
+            ttl: Seconds a fetched table is used before it is fetched again
+            max_stale: Seconds an expired table is still used if fetching a new one fails
+            background: Refresh table in the background every ttl * 0.8 seconds while it is used, refreshing
+                stops once it wasn't used for ttl seconds and starts again on next use
+        """
+        self.source = source
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.background = background
+        self.table: RateTable = {}
+        self.fetches = 0
+        self._fetched_at = None
+        self._used_at = None
+        self._calls = SharedCalls()
+        self._task = None
+
+    def age(self) -> float | None:
+        """
+        Seconds since the table was fetched, None if it never was
+        """
+        return None if self._fetched_at is None else get_running_loop().time() - self._fetched_at
+
+    async def refresh(self) -> RateTable:
+        """
+        Fetches rate table, joining the fetch already in progress if there is one
+        """
+        return await self._calls.run(None, self._fetch)
+
+    async def _fetch(self) -> RateTable:
+        self.fetches += 1
+        table = await self.source()
+        self.table = {(source.upper(), target.upper()): float(rate) for (source, target), rate in table.items()}
+        self._fetched_at = get_running_loop().time()
+        return self.table
+
+    async def rates(self) -> RateTable:
+        """
+        Returns current rate table, fetching it if it expired
+        """
+        self._used_at = get_running_loop().time()
+        if self.background and (self._task is None or self._task.done()):
+            self._task = create_task(self._run())
+        age = self.age()
+        if age is not None and age < self.ttl:
+            return self.table
+        try:
+            return await self.refresh()
+        except Exception as e:
+            if age is None or age > self.max_stale:
+                raise
+            print(f"Wasn't able to refresh exchange rates, using {age:.0f}s old ones: {e!r}")
+            return self.table
+
+    async def _run(self) -> None:
+        loop = get_running_loop()
+        while True:
+            age = self.age()
+            await sleep(max(self.ttl * 0.8 - (age or 0), 0))
+            if loop.time() - self._used_at >= self.ttl:
+                return  # idle, restarted by the next rates() call
+            try:
+                await self.refresh()
+            except CancelledError:
+                raise
+            except Exception as e:
+                print(f"Wasn't able to refresh exchange rates in the background: {e!r}")
+                await sleep(min(self.ttl * 0.2, 5))
+
+    async def stop(self) -> None:
+        """
+        Stops background refresh, it starts again on next use
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+
+    @staticmethod
+    def find(table: RateTable, source: str, target: str) -> float | None:
+        """
+        Returns rate from source to target currency: direct, inverse, or crossed through a currency both are quoted
+        against, None if it can't be derived from the table
+        """
+        if source == target:
+            return 1.0
+        if (source, target) in table:
+            return table[source, target]
+        if (target, source) in table and table[target, source]:
+            return 1 / table[target, source]
+        for (base, quote), rate in table.items():
+            if quote == source and rate and (base, target) in table:
+                return table[base, target] / rate
+            if base == source and (quote, target) in table:
+                return rate * table[quote, target]
+        return None
+
+    async def rate(self, source: str, target: str) -> float:
+        """
+        Returns rate from source to target currency
+
+        Raises:
+            ValueError: If rate is not known
+        """
+        rate = self.find(await self.rates(), source.upper(), target.upper())
+        if rate is None:
+            raise ValueError(f'Exchange rate from {source} to {target} is not known')
+        return rate
+
+    async def convert(self, amount: float, source: str, target: str) -> float:
+        """
+        Converts amount from source to target currency, rounded to 2 decimals for fiat and 8 for crypto currencies
+
+        Raises:
+            ValueError: If rate is not known
+        """
+        return round(amount * await self.rate(source, target), 2 if target.upper() in FIAT else 8)
+
+    def __repr__(self) -> str:
+        return f'ExchangeRates(rates={len(self.table)}, ttl={self.ttl}, fetches={self.fetches})'
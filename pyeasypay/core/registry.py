@@ -0,0 +1,100 @@
+from importlib import import_module
+from importlib.metadata import EntryPoint, entry_points
+from inspect import isclass
+from pkgutil import iter_modules
+from os.path import dirname, join
+from types import ModuleType
+from typing import Dict, List
+import sys
+
+
+ENTRY_POINT_GROUP = 'pyeasypay.providers'
+
+
+class ProviderRegistry:
+    """
+    Maps provider names to provider modules, resolved once and cached
+
+    Built-in providers are the modules of pyeasypay/core/providers, third-party ones are registered
+    with register() or through the "pyeasypay.providers" entry point group, e.g. in pyproject.toml:
+
+        [project.entry-points."pyeasypay.providers"]
+        myprovider = "my_package.myprovider"
+
+    A provider module must define Invoice class (see built-in providers) and may define parse_webhook().
+    Provider modules are only imported on first use.
+    """
+    def __init__(self) -> None:
+        self._sources: Dict[str, str | ModuleType | EntryPoint | type] | None = None
+        self._modules: Dict[str, ModuleType] = {}
+
+    def _discover(self) -> Dict[str, str | ModuleType | EntryPoint | type]:
+        if self._sources is None:
+            sources = {name: f'pyeasypay.core.providers.{name}'
+                       for _, name, _ in iter_modules([join(dirname(__file__), 'providers')])}
+            for entry_point in entry_points(group=ENTRY_POINT_GROUP):
+                sources.setdefault(entry_point.name, entry_point)
+            self._sources = sources
+        return self._sources
+
+    def names(self) -> List[str]:
+        """
+        Returns names of all available providers
+        """
+        return list(self._discover())
+
+    def register(self, name: str, provider: str | ModuleType | type) -> None:
+        """
+        Registers provider under name, replaces existing one with the same name
+
+        Args:
+            name: Provider name used in Provider(name, ...)
+            provider: Provider module, its import path, or its Invoice class
+        """
+        self._discover()[name] = provider
+        self._modules.pop(name, None)
+
+    def module(self, name: str) -> ModuleType:
+        """
+        Returns provider module, importing it on first use
+
+        Raises:
+            ValueError: If provider is not supported
+        """
+        try:
+            return self._modules[name]
+        except KeyError:
+            pass
+        try:
+            source = self._discover()[name]
+        except KeyError:
+            raise ValueError(f'Provider {name} is not supported')
+        if isinstance(source, str):
+            source = import_module(source)
+        elif isinstance(source, EntryPoint):
+            source = source.load()
+        if isclass(source):
+            module = ModuleType(source.__module__)
+            module.__dict__.update(vars(sys.modules[source.__module__]))
+            module.Invoice = source
+            source = module
+        self._modules[name] = source
+        return source
+
+    def get(self, name: str) -> type:
+        """
+        Returns provider Invoice class
+
+        Raises:
+            ValueError: If provider is not supported
+        """
+        return self.module(name).Invoice
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._discover()
+
+    def __repr__(self) -> str:
+        return f'ProviderRegistry({self.names()})'
+
+
+registry = ProviderRegistry()
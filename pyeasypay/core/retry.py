@@ -0,0 +1,165 @@
+from asyncio import get_running_loop
+from collections import deque
+from json import JSONDecodeError
+from random import uniform
+from typing import Deque
+
+
+IDEMPOTENT = ('check', 'check_many', 'balance', 'rates', 'reconcile')
+
+
+class TransientError(ValueError):
+    """
+    Provider failed in a way that may go away on its own (HTTP 5xx, unparseable response), safe to retry
+    """
+
+
+class CircuitOpenError(ValueError):
+    """
+    Raised without calling the provider while its circuit breaker is open
+    """
+    def __init__(self, message: str, retry_after: float) -> None:
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+_transient = None
+
+
+def is_transient(error: BaseException) -> bool:
+    """
+    Whether error is a connection problem, timeout or server-side failure rather than a rejected request
+    """
+    global _transient
+    if _transient is None:
+        from aiohttp import ClientError
+
+        _transient = (ClientError, TimeoutError, JSONDecodeError, TransientError)
+    return isinstance(error, _transient)
+
+
+class RetryPolicy:
+    """
+    Bounded retries with exponential backoff and full jitter for idempotent provider calls
+
+    Retries are also limited by a budget shared by all calls with the same credentials: every successful
+    call earns budget_ratio of a retry (up to budget_cap), every retry spends one. During an outage
+    retries stop quickly instead of multiplying the load on the provider.
+    """
+    def __init__(self, retries: int = 2, backoff: float = 0.1, max_backoff: float = 2.0, budget_ratio: float = 0.2,
+                 budget_cap: float = 10.0) -> None:
+        """
+        Args:
+            retries: Maximum number of retries of one call
+            backoff: Base delay in seconds, delay before retry n is random between 0 and backoff * 2 ** n
+            max_backoff: Delay cap in seconds
+            budget_ratio: Retries earned per successful call
+            budget_cap: Maximum number of retries saved up
+        """
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.budget_ratio = budget_ratio
+        self.budget_cap = budget_cap
+        self.budget = budget_cap
+
+    def success(self) -> None:
+        self.budget = min(self.budget_cap, self.budget + self.budget_ratio)
+
+    def delay(self, attempt: int) -> float | None:
+        """
+        Returns seconds to wait before retry number attempt (starting from 0), None if the call shouldn't be retried
+        """
+        if attempt >= self.retries or self.budget < 1:
+            return None
+        self.budget -= 1
+        return uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def __repr__(self) -> str:
+        return f'RetryPolicy(retries={self.retries}, backoff={self.backoff}, budget={self.budget:.1f})'
+
+
+class CircuitBreaker:
+    """
+    Fails calls fast once provider error rate crosses a threshold
+
+    Outcomes of the last window seconds are counted. When there were at least min_calls calls and the share of
+    transient failures reached threshold, the breaker opens and calls fail with CircuitOpenError for cooldown
+    seconds. Then one probe call is let through: success closes the breaker, failure opens it again.
+    """
+    def __init__(self, threshold: float = 0.5, min_calls: int = 20, window: float = 30,
+                 cooldown: float = 15) -> None:
+        """
+        Args:
+            threshold: Share of failed calls (0..1) opening the breaker
+            min_calls: Minimum number of calls in the window before the error rate is trusted
+            window: Seconds of history the error rate is computed over
+            cooldown: Seconds the breaker stays open before a probe call
+        """
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.window = window
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.opened_at = 0.0
+        self._outcomes: Deque[tuple] = deque()
+        self._failures = 0
+        self._probing = False
+
+    def _trim(self, now: float) -> None:
+        while self._outcomes and self._outcomes[0][0] < now - self.window:
+            self._failures -= self._outcomes.popleft()[1]
+
+    @property
+    def error_rate(self) -> float:
+        self._trim(get_running_loop().time())
+        return self._failures / len(self._outcomes) if self._outcomes else 0.0
+
+    def before(self, name: str) -> None:
+        """
+        Called before provider call
+
+        Raises:
+            CircuitOpenError: If breaker is open or a probe call is already in progress
+        """
+        if self.state == 'closed':
+            return
+        now = get_running_loop().time()
+        if self.state == 'open' and now - self.opened_at >= self.cooldown:
+            self.state = 'half-open'
+        if self.state == 'half-open' and not self._probing:
+            self._probing = True
+            return
+        raise CircuitOpenError(f'Provider {name} is unavailable (circuit breaker is open)',
+                               max(self.opened_at + self.cooldown - now, 0.0))
+
+    def record(self, failed: bool) -> None:
+        """
+        Called with the outcome of a provider call, failed is True for transient errors only
+        """
+        now = get_running_loop().time()
+        if self.state == 'open':
+            return  # calls started before the breaker opened
+        if self.state == 'half-open':
+            self._probing = False
+            if failed:
+                self.state, self.opened_at = 'open', now
+            else:
+                self.state = 'closed'
+                self._outcomes.clear()
+                self._failures = 0
+            return
+        self._outcomes.append((now, failed))
+        self._failures += failed
+        self._trim(now)
+        if failed and len(self._outcomes) >= self.min_calls and self._failures >= self.threshold * len(self._outcomes):
+            self.state, self.opened_at = 'open', now
+
+    def abort(self) -> None:
+        """
+        Called when provider call was cancelled, lets the next call probe the provider
+        """
+        self._probing = False
+
+    def __repr__(self) -> str:
+        return f'CircuitBreaker(state={self.state}, error_rate={self.error_rate:.2f}, calls={len(self._outcomes)})'
@@ -0,0 +1,144 @@
+from collections.abc import Callable, Sequence
+from time import monotonic
+from typing import Any, Dict, List
+
+from .registry import registry
+
+
+class ProviderStats:
+    """
+    Exponentially weighted latency and error rate of calls made with one set of provider credentials
+    """
+    __slots__ = ('latency', 'error_rate', 'calls', 'in_flight', 'updated')
+
+    def __init__(self) -> None:
+        self.latency = None
+        self.error_rate = 0.0
+        self.calls = 0
+        self.in_flight = 0
+        self.updated = 0.0
+
+    def record(self, duration: float, failed: bool, alpha: float = 0.2) -> None:
+        if not failed:
+            self.latency = duration if self.latency is None else self.latency + alpha * (duration - self.latency)
+        self.error_rate += alpha * (failed - self.error_rate)
+        self.calls += 1
+        self.updated = monotonic()
+
+    def __repr__(self) -> str:
+        latency = f'{self.latency * 1000:.1f} ms' if self.latency is not None else None
+        return (f'ProviderStats(latency={latency}, error_rate={self.error_rate:.2f}, calls={self.calls}, '
+                f'in_flight={self.in_flight})')
+
+
+class Router:
+    """
+    Picks providers for new invoices when no provider was given
+
+    Policies:
+        fastest: providers ordered by observed latency times calls in flight, penalized by error rate.
+            Providers without recent observations (stale seconds) are assumed to be as fast as the fastest one,
+            so they get measured, and the in-flight factor spreads concurrent invoices instead of sending all
+            of them to the provider that looked best a moment ago
+        ordered: providers in the order they were added
+        callable: policy(candidates, currency) returning candidates in preferred order
+
+    Providers with an open circuit breaker always go last.
+    """
+    def __init__(self, providers: Any, policy: str | Callable = 'fastest', stale: float = 60) -> None:
+        """
+        Args:
+            providers: Providers instance of the owning EasyPay
+            policy: fastest, ordered or a callable, see class docstring
+            stale: Seconds after which observations of an unused provider are not trusted anymore
+        """
+        if not callable(policy) and policy not in ('fastest', 'ordered'):
+            raise ValueError(f'Unknown routing policy {policy}, use fastest, ordered or a callable')
+        self.providers = providers
+        self.policy = policy
+        self.stale = stale
+        self.stats: Dict[Any, ProviderStats] = {}
+
+    def get(self, creds: Any) -> ProviderStats:
+        stats = self.stats.get(creds)
+        if stats is None:
+            stats = self.stats[creds] = ProviderStats()
+        return stats
+
+    def start(self, creds: Any) -> ProviderStats:
+        """
+        Called when a provider call starts, returns stats to pass outcome to with finish()
+        """
+        stats = self.get(creds)
+        stats.in_flight += 1
+        return stats
+
+    @staticmethod
+    def finish(stats: ProviderStats, duration: float, failed: bool | None) -> None:
+        """
+        Records outcome of a provider call, failed is True for transient errors only, None if call was cancelled
+        """
+        stats.in_flight -= 1
+        if failed is not None:
+            stats.record(duration, failed)
+
+    @staticmethod
+    def currencies(creds: Any) -> Sequence[str] | None:
+        """
+        Currencies provider accepts: currencies provider kwarg if set, otherwise CURRENCIES of the provider
+        module, None (any currency) if the module doesn't define it
+        """
+        currencies = getattr(creds, 'currencies', None)
+        if currencies is None:
+            currencies = getattr(registry.module(creds.name), 'CURRENCIES', None)
+        return currencies
+
+    @classmethod
+    def supports(cls, creds: Any, currency: str) -> bool:
+        """
+        Whether provider accepts currency
+        """
+        currencies = cls.currencies(creds)
+        return currencies is None or currency in currencies
+
+    def candidates(self, currency: str | None) -> List[Any]:
+        """
+        Returns added providers accepting currency (all added ones if currency is None), in the order they were added
+        """
+        return [creds for creds in self.providers.list()
+                if len(creds.__dict__) > 1 and (currency is None or self.supports(creds, currency))]
+
+    def latency(self, creds: Any) -> float | None:
+        """
+        Observed latency of provider in seconds, None if there are no recent observations
+        """
+        stats = self.stats.get(creds)
+        if stats is None or stats.latency is None or monotonic() - stats.updated > self.stale:
+            return None
+        return stats.latency
+
+    def score(self, creds: Any, default: float) -> float:
+        stats = self.get(creds)
+        latency = self.latency(creds)
+        if latency is None:
+            latency, error_rate = default, 0.0
+        else:
+            error_rate = stats.error_rate
+        return latency * (stats.in_flight + 1) / max(1 - error_rate, 0.05)
+
+    def rank(self, currency: str | None) -> List[Any]:
+        """
+        Returns providers accepting currency (all added ones if currency is None) in the order they should be tried
+        """
+        candidates = self.candidates(currency)
+        if callable(self.policy):
+            candidates = list(self.policy(candidates, currency))
+        elif self.policy == 'fastest':
+            known = [latency for latency in map(self.latency, candidates) if latency is not None]
+            default = min(known, default=0.001)
+            candidates.sort(key=lambda creds: self.score(creds, default))
+        breakers = self.providers.breakers
+        return sorted(candidates, key=lambda creds: getattr(breakers.get(creds), 'state', 'closed') == 'open')
+
+    def __repr__(self) -> str:
+        return f'Router(policy={self.policy!r}, stats={ {creds.name: stats for creds, stats in self.stats.items()} })'
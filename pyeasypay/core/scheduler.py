@@ -0,0 +1,281 @@
+from asyncio import Event, Queue, CancelledError, TimeoutError, create_task, get_running_loop, wait_for
+from collections.abc import AsyncIterator, Awaitable, Callable
+from datetime import datetime
+from heapq import heappop, heappush
+from inspect import isawaitable
+from itertools import count
+from typing import Any, Dict, List, Set
+
+
+TERMINAL_STATUSES = ('paid', 'payed', 'expired', 'cancelled', 'canceled', 'failed')
+
+
+class Scheduler:
+    """
+    Shared background poller for pending invoices of one EasyPay instance
+    """
+    def __init__(self, check_many: Callable[..., AsyncIterator], min_interval: float = 5, max_interval: float = 300,
+                 age_factor: float = 0.1, lifetime: float = 86400, batch_size: int = 1000,
+                 concurrency: int = 32, max_failures: int = 10) -> None:
+        """
+        Scheduler initialization, polling task is started when the first invoice is added
+
+        Invoices are kept in a heap ordered by their next poll time, all invoices due at the same moment
+        are checked together through check_many. Poll interval grows with invoice age: an invoice is polled
+        roughly every age * age_factor seconds, clamped between min_interval and max_interval.
+
+        Args:
+            check_many: EasyPay.check_many of the owning instance
+            min_interval: Poll interval for fresh invoices in seconds
+            max_interval: Poll interval cap for old invoices in seconds
+            age_factor: Share of invoice age used as its poll interval
+            lifetime: Seconds after creation when an invoice is considered expired and polling stops
+            batch_size: Maximum number of due invoices checked in one pass
+            concurrency: Maximum number of simultaneous provider requests
+            max_failures: Consecutive failed checks after which an invoice stops being tracked, failed checks
+                are retried with exponential backoff (capped at max_interval) until then
+        """
+        self.check_many = check_many
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.age_factor = age_factor
+        self.lifetime = lifetime
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.max_failures = max_failures
+        self._heap: List[tuple] = []
+        self._invoices: Dict[int, Any] = {}
+        self._deadlines: Dict[int, float] = {}
+        self._scheduled: Dict[int, int] = {}
+        self._failures: Dict[int, int] = {}
+        self._index: Dict[tuple, int] = {}
+        self._counter = count()
+        self._callbacks: List[Callable] = []
+        self._queues: Set[Queue] = set()
+        self._wakeup = Event()
+        self._task = None
+
+    def __len__(self) -> int:
+        return len(self._invoices)
+
+    def __contains__(self, invoice: Any) -> bool:
+        return id(invoice) in self._invoices
+
+    def add(self, invoice: Any, lifetime: float = None) -> Any:
+        """
+        Starts tracking invoice status, must be called from a running event loop
+
+        An invoice is tracked once per provider and identifier: if another Invoice object with the same ones
+        is already tracked, that one keeps being tracked and is returned instead
+
+        Args:
+            invoice: Invoice with identifier and provider set
+            lifetime: Seconds after invoice creation when polling stops (scheduler default if not provided)
+
+        Returns:
+            Any: Tracked invoice, the same one or the one already tracked with the same provider and identifier
+        """
+        tracked = self.find(*self.key(invoice))
+        if tracked is not None:
+            return tracked
+        if invoice.status in TERMINAL_STATUSES:
+            return invoice
+        now = get_running_loop().time()
+        age = self.age(invoice)
+        self._invoices[id(invoice)] = invoice
+        self._index[self.key(invoice)] = id(invoice)
+        self._deadlines[id(invoice)] = now + (self.lifetime if lifetime is None else lifetime) - age
+        self._push(invoice, now + self.interval(age))
+        if self._task is None or self._task.done():
+            self._task = create_task(self._run())
+        return invoice
+
+    def discard(self, invoice: Any) -> None:
+        """
+        Stops tracking invoice status
+        """
+        if self._invoices.pop(id(invoice), None) is not None and self._index.get(self.key(invoice)) == id(invoice):
+            del self._index[self.key(invoice)]
+        self._deadlines.pop(id(invoice), None)
+        self._scheduled.pop(id(invoice), None)
+        self._failures.pop(id(invoice), None)
+
+    def find(self, provider: str, identifier: Any) -> Any | None:
+        """
+        Returns tracked invoice by provider name and identifier, None if it is not tracked
+        """
+        key = self._index.get((provider, str(identifier)))
+        return self._invoices.get(key) if key is not None else None
+
+    def oldest(self, provider: str) -> datetime | None:
+        """
+        Returns creation time of the oldest tracked invoice of provider, None if none is tracked
+        """
+        return min((invoice.created_at for invoice in self._invoices.values()
+                    if self.key(invoice)[0] == provider and getattr(invoice, 'created_at', None) is not None),
+                   default=None)
+
+    async def update(self, invoice: Any, status: str) -> None:
+        """
+        Sets invoice status from an outside source (e.g. webhook), notifies subscribers if it changed
+        and stops polling invoice once status is final
+
+        Args:
+            invoice: Invoice, tracked or not
+            status: New status
+        """
+        old_status, invoice.status = invoice.status, status
+        if status != old_status:
+            await self._notify(invoice, old_status)
+        if status in TERMINAL_STATUSES:
+            self.discard(invoice)
+
+    def on_status(self, callback: Callable[[Any, str], Awaitable | None]) -> Callable:
+        """
+        Registers callback called as callback(invoice, old_status) on every status change, can be a coroutine
+
+        Can be used as a decorator
+        """
+        self._callbacks.append(callback)
+        return callback
+
+    def off_status(self, callback: Callable) -> None:
+        """
+        Unregisters callback added with on_status, does nothing if it was not registered
+        """
+        if callback in self._callbacks:
+            self._callbacks.remove(callback)
+
+    async def updates(self) -> AsyncIterator[Any]:
+        """
+        Yields invoices whose status changed, for as long as the consumer keeps iterating
+
+        Example:
+            async for invoice in pay.scheduler.updates():
+                print(invoice.identifier, invoice.status)
+        """
+        queue = Queue()
+        self._queues.add(queue)
+        try:
+            while True:
+                yield await queue.get()
+        finally:
+            self._queues.discard(queue)
+
+    async def stop(self) -> None:
+        """
+        Stops polling task, tracked invoices are kept and polling resumes on next add()
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except CancelledError:
+                pass
+            self._task = None
+
+    @staticmethod
+    def key(invoice: Any) -> tuple:
+        provider = getattr(invoice, 'provider', None)
+        return getattr(provider, 'name', provider), str(invoice.identifier)
+
+    def age(self, invoice: Any) -> float:
+        created_at = getattr(invoice, 'created_at', None)
+        return max((datetime.now() - created_at).total_seconds(), 0) if created_at else 0
+
+    def interval(self, age: float) -> float:
+        return min(self.max_interval, max(self.min_interval, age * self.age_factor))
+
+    def _push(self, invoice: Any, due: float) -> None:
+        key = id(invoice)
+        if self._deadlines[key] > get_running_loop().time():
+            due = min(due, self._deadlines[key])
+        self._scheduled[key] = seq = next(self._counter)
+        heappush(self._heap, (due, seq, key))
+        self._wakeup.set()
+
+    def _due(self, now: float) -> List[Any]:
+        due = []
+        while self._heap and self._heap[0][0] <= now and len(due) < self.batch_size:
+            _, seq, key = heappop(self._heap)
+            if self._scheduled.get(key) == seq:
+                del self._scheduled[key]
+                due.append(self._invoices[key])
+        return due
+
+    async def _notify(self, invoice: Any, old_status: str) -> None:
+        for queue in self._queues:
+            queue.put_nowait(invoice)
+        for callback in self._callbacks:
+            try:
+                result = callback(invoice, old_status)
+                if isawaitable(result):
+                    await result
+            except Exception as e:
+                print(f"Scheduler callback {callback!r} failed for invoice {invoice.identifier}: {e!r}")
+
+    def _failed(self, invoice: Any, error: Exception) -> None:
+        key = id(invoice)
+        if key not in self._invoices:
+            return
+        failures = self._failures[key] = self._failures.get(key, 0) + 1
+        if failures >= self.max_failures:
+            print(f"Scheduler stopped tracking invoice {invoice.identifier} after {failures} failed checks: {error!r}")
+            self.discard(invoice)
+            return
+        interval = min(self.max_interval, self.interval(self.age(invoice)) * 2 ** failures)
+        self._push(invoice, get_running_loop().time() + interval)
+
+    async def _poll(self, invoices: List[Any]) -> None:
+        old_statuses = {id(invoice): invoice.status for invoice in invoices}
+        unchecked = {id(invoice): invoice for invoice in invoices}
+
+        def failed(invoice: Any, error: Exception) -> None:
+            unchecked.pop(id(invoice), None)
+            self._failed(invoice, error)
+
+        try:
+            async for invoice in self.check_many(invoices, concurrency=self.concurrency, on_error=failed):
+                unchecked.pop(id(invoice), None)
+                self._failures.pop(id(invoice), None)
+                await self._settle(invoice, old_statuses[id(invoice)])
+        except Exception as e:
+            print(f"Scheduler wasn't able to check {len(unchecked)} invoices, retrying later: {e!r}")
+        now = get_running_loop().time()
+        for invoice in unchecked.values():
+            if id(invoice) in self._invoices:
+                self._push(invoice, now + self.interval(self.age(invoice)))
+
+    async def _settle(self, invoice: Any, old_status: str) -> None:
+        key = id(invoice)
+        if key not in self._invoices:
+            return
+        now = get_running_loop().time()
+        if invoice.status not in TERMINAL_STATUSES and now >= self._deadlines[key]:
+            invoice.status = 'expired'
+        if invoice.status != old_status:
+            await self._notify(invoice, old_status)
+        if invoice.status in TERMINAL_STATUSES:
+            self.discard(invoice)
+        else:
+            self._push(invoice, now + self.interval(self.age(invoice)))
+
+    async def _run(self) -> None:
+        loop = get_running_loop()
+        while self._invoices:
+            self._wakeup.clear()
+            if not self._heap:
+                await self._wakeup.wait()
+                continue
+            if self._heap[0][0] > loop.time():
+                try:
+                    await wait_for(self._wakeup.wait(), self._heap[0][0] - loop.time())
+                except TimeoutError:
+                    pass
+                continue
+            due = self._due(loop.time())
+            if due:
+                await self._poll(due)
+
+    def __repr__(self) -> str:
+        return f'Scheduler(tracked={len(self._invoices)}, running={self._task is not None and not self._task.done()})'
@@ -0,0 +1,104 @@
+from asyncio import get_running_loop
+from collections import OrderedDict
+from collections.abc import Awaitable, Callable
+from typing import Any
+
+from .concurrency import SharedCalls
+from .scheduler import TERMINAL_STATUSES
+
+
+class StatusCache:
+    """
+    Invoice status cache with request coalescing, keyed by (provider, account, identifier)
+
+    Concurrent checks of the same invoice (even through different Invoice objects) share one provider call.
+    Checked statuses are reused for ttl seconds, final ones (paid, expired, ...) until they are evicted:
+    at most max_size statuses are kept, least recently used ones are dropped first.
+    """
+    def __init__(self, ttl: float = 1.0, max_size: int = 100000) -> None:
+        """
+        Args:
+            ttl: Seconds a status that is not final is reused for, 0 to only coalesce concurrent checks
+            max_size: Maximum number of cached statuses
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._statuses: OrderedDict[tuple, tuple] = OrderedDict()
+        self._calls = SharedCalls()
+
+    def __len__(self) -> int:
+        return len(self._statuses)
+
+    @staticmethod
+    def key(invoice: Any) -> tuple:
+        provider = getattr(invoice, 'provider', None)
+        return getattr(provider, 'name', provider), getattr(invoice, 'account', None), str(invoice.identifier)
+
+    def get(self, key: tuple) -> str | None:
+        """
+        Returns cached status, None if it is not cached or expired
+        """
+        entry = self._statuses.get(key)
+        if entry is None:
+            return None
+        expires_at, status = entry
+        if expires_at is not None and get_running_loop().time() >= expires_at:
+            del self._statuses[key]
+            return None
+        self._statuses.move_to_end(key)
+        return status
+
+    def put(self, key: tuple, status: str) -> None:
+        """
+        Caches status, final statuses don't expire
+        """
+        if status is None:
+            return
+        if status.lower() in TERMINAL_STATUSES:
+            expires_at = None
+        elif self.ttl > 0:
+            expires_at = get_running_loop().time() + self.ttl
+        else:
+            self._statuses.pop(key, None)
+            return
+        self._statuses[key] = (expires_at, status)
+        self._statuses.move_to_end(key)
+        while len(self._statuses) > self.max_size:
+            self._statuses.popitem(last=False)
+
+    def invalidate(self, key: tuple) -> None:
+        """
+        Drops cached status, the next check asks the provider
+        """
+        self._statuses.pop(key, None)
+
+    async def check(self, key: tuple, check: Callable[[], Awaitable[str]]) -> str:
+        """
+        Returns cached status or the result of check(), joining the check of the same key already in progress
+
+        Args:
+            key: Cache key, see key()
+            check: Callable returning awaitable with the current status from the provider
+
+        Returns:
+            str: Invoice status
+        """
+        status = self.get(key)
+        if status is not None:
+            self.hits += 1
+            return status
+        if key in self._calls:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return await self._calls.run(key, lambda: self._check(key, check))
+
+    async def _check(self, key: tuple, check: Callable[[], Awaitable[str]]) -> str:
+        status = await check()
+        self.put(key, status)
+        return status
+
+    def __repr__(self) -> str:
+        return f'StatusCache(statuses={len(self)}, ttl={self.ttl}, hits={self.hits}, misses={self.misses})'
@@ -0,0 +1,542 @@
+from asyncio import CancelledError, create_task, sleep
+from collections.abc import AsyncIterator, Awaitable, Callable, Iterable
+from datetime import datetime, timedelta
+from inspect import isawaitable
+from itertools import islice
+from math import ceil
+from os import getpid
+from socket import gethostname
+from typing import Any, Dict, List, Self, Set
+from uuid import uuid4
+from zlib import crc32
+
+from sqlalchemy import JSON, Column, DateTime, Float, Index, Integer, MetaData, String, Table, UniqueConstraint, \
+    bindparam, delete, func, insert, or_, select, update
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from .pay import Invoice
+from .scheduler import TERMINAL_STATUSES, Scheduler
+
+
+metadata = MetaData()
+
+invoices = Table(
+    'pyeasypay_invoices', metadata,
+    Column('id', Integer, primary_key=True, autoincrement=True),
+    Column('provider', String(64), nullable=False),
+    Column('account', String(64)),
+    Column('identifier', String(128), nullable=False),
+    Column('status', String(32), nullable=False),
+    Column('amount', Float),
+    Column('currency', String(16)),
+    Column('pay_info', String(2048)),
+    Column('created_at', DateTime, nullable=False),
+    Column('updated_at', DateTime, nullable=False),
+    Column('shard', Integer),
+    Column('idempotency_key', String(128), unique=True),
+    Column('metadata', JSON),
+    UniqueConstraint('provider', 'identifier'),
+    Index('ix_pyeasypay_invoices_provider_status_created_at', 'provider', 'status', 'created_at'),
+    Index('ix_pyeasypay_invoices_shard_status', 'shard', 'status'),
+)
+
+leases = Table(
+    'pyeasypay_leases', metadata,
+    Column('shard', Integer, primary_key=True, autoincrement=False),
+    Column('owner', String(128)),
+    Column('expires_at', DateTime),
+)
+
+workers = Table(
+    'pyeasypay_workers', metadata,
+    Column('owner', String(128), primary_key=True),
+    Column('expires_at', DateTime, nullable=False),
+)
+
+
+class InvoiceStore:
+    """
+    Persistent invoice storage on SQLAlchemy (async), SQLite by default
+    """
+    def __init__(self, pay: Any, url: str = 'sqlite+aiosqlite:///pyeasypay.db', batch_size: int = 1000,
+                 flush_interval: float = 0.5, shards: int = 64, **engine_kwargs) -> None:
+        """
+        InvoiceStore initialization, table is created on open()
+
+        Args:
+            pay: EasyPay instance invoices are restored into
+            url: SQLAlchemy async database URL
+            batch_size: Number of rows per insert/update batch and per fetch when streaming
+            flush_interval: Seconds status changes from the scheduler are collected before being written in one batch
+            shards: Number of shards invoices are spread over for polling by several workers (see ShardWorker),
+                must be the same for every process using the database
+            **engine_kwargs: Additional keyword arguments for sqlalchemy create_async_engine
+
+        Example:
+            async with InvoiceStore(pay) as store:
+                await store.add(invoice)
+                await store.restore()  # after restart: track all pending invoices again
+        """
+        self.pay = pay
+        self.url = url
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.shards = shards
+        self.engine = create_async_engine(url, **engine_kwargs)
+        self._dirty: Dict[tuple, str] = {}
+        self._flush_task = None
+
+    async def open(self) -> Self:
+        """
+        Creates tables and indexes if they don't exist and starts persisting scheduler status changes
+        """
+        async with self.engine.begin() as conn:
+            await conn.run_sync(metadata.create_all)
+            existing = set((await conn.execute(select(leases.c.shard))).scalars())
+            missing = [{'shard': shard} for shard in range(self.shards) if shard not in existing]
+            if missing:
+                await conn.execute(insert(leases), missing)
+        self.pay.scheduler.off_status(self._on_status)
+        self.pay.scheduler.on_status(self._on_status)
+        return self
+
+    async def close(self) -> None:
+        """
+        Writes pending status changes and closes database connections
+        """
+        self.pay.scheduler.off_status(self._on_status)
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except CancelledError:
+                pass
+            self._flush_task = None
+        try:
+            await self.flush()
+        finally:
+            await self.engine.dispose()
+
+    async def __aenter__(self) -> Self:
+        return await self.open()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    def shard(self, provider: str, identifier: Any) -> int:
+        """
+        Returns shard of invoice, stable across processes and hosts
+        """
+        return crc32(f'{provider}:{identifier}'.encode('utf-8')) % self.shards
+
+    def _row(self, invoice: Invoice, now: datetime) -> Dict[str, Any]:
+        provider, identifier = Scheduler.key(invoice)
+        data = invoice.to_dict()
+        return {
+            'provider': provider,
+            'account': invoice.account,
+            'identifier': identifier,
+            'status': invoice.status,
+            'amount': getattr(invoice, 'amount', None),
+            'currency': invoice.currency,
+            'pay_info': invoice.pay_info,
+            'created_at': invoice.created_at,
+            'updated_at': now,
+            'shard': self.shard(provider, identifier),
+            'metadata': data['metadata'],
+        }
+
+    def _batches(self, items: Iterable) -> Iterable[List]:
+        items = iter(items)
+        while batch := list(islice(items, self.batch_size)):
+            yield batch
+
+    async def add(self, *invoices: Invoice) -> None:
+        """
+        Saves invoices, batch_size rows per INSERT, all in one transaction
+        """
+        await self.add_many(invoices)
+
+    async def add_many(self, items: Iterable[Invoice]) -> None:
+        """
+        Saves invoices from an iterable, batch_size rows per INSERT, all in one transaction
+        """
+        now = datetime.now()
+        async with self.engine.begin() as conn:
+            for batch in self._batches(items):
+                await conn.execute(insert(invoices), [self._row(invoice, now) for invoice in batch])
+
+    async def update_status(self, *invoices: Invoice) -> None:
+        """
+        Writes current status of invoices, batch_size rows per UPDATE, all in one transaction
+        """
+        await self.update_statuses((Scheduler.key(invoice), invoice.status) for invoice in invoices)
+
+    async def update_statuses(self, statuses: Iterable[tuple] | Dict[tuple, str]) -> None:
+        """
+        Writes statuses given as ((provider, identifier), status) pairs or {(provider, identifier): status} dict
+        """
+        if isinstance(statuses, dict):
+            statuses = statuses.items()
+        now = datetime.now()
+        statement = update(invoices).where(
+            invoices.c.provider == bindparam('b_provider'),
+            invoices.c.identifier == bindparam('b_identifier')
+        ).values(status=bindparam('b_status'), updated_at=now)
+        async with self.engine.begin() as conn:
+            for batch in self._batches(statuses):
+                await conn.execute(statement, [
+                    {'b_provider': provider, 'b_identifier': str(identifier), 'b_status': status}
+                    for (provider, identifier), status in batch
+                ])
+
+    def _invoice(self, row: Any) -> Invoice:
+        return Invoice(self.pay.provider, provider=row.provider, account=row.account, identifier=row.identifier,
+                       status=row.status, amount=row.amount, currency=row.currency, pay_info=row.pay_info,
+                       created_at=row.created_at, metadata=row.metadata)
+
+    async def get(self, provider: str, identifier: Any) -> Invoice | None:
+        """
+        Loads invoice by provider name and identifier, None if it was not saved
+
+        Can be used as resolver for EasyPay.webhook()
+        """
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(select(invoices).where(
+                invoices.c.provider == provider, invoices.c.identifier == str(identifier)
+            ))).first()
+        return self._invoice(row) if row is not None else None
+
+    async def get_many(self, provider: str, identifiers: Iterable[Any]) -> Dict[str, Invoice]:
+        """
+        Loads saved invoices of provider by identifiers in one query
+
+        Can be used as lookup for EasyPay.reconcile()
+
+        Returns:
+            Dict[str, Invoice]: Invoices by identifier, identifiers that were not saved are missing
+        """
+        identifiers = [str(identifier) for identifier in identifiers]
+        if not identifiers:
+            return {}
+        async with self.engine.connect() as conn:
+            rows = (await conn.execute(select(invoices).where(
+                invoices.c.provider == provider, invoices.c.identifier.in_(identifiers)
+            ))).all()
+        return {row.identifier: self._invoice(row) for row in rows}
+
+    async def load_key(self, key: str) -> Invoice | None:
+        """
+        Loads invoice saved with idempotency key, None if there is none, see IdempotencyCache
+        """
+        async with self.engine.connect() as conn:
+            row = (await conn.execute(select(invoices).where(invoices.c.idempotency_key == key))).first()
+        return self._invoice(row) if row is not None else None
+
+    async def save_key(self, key: str, invoice: Invoice) -> None:
+        """
+        Saves invoice with idempotency key, or sets the key of already saved invoice, see IdempotencyCache
+
+        Example:
+            pay = EasyPay(providers=[...])
+            store = await InvoiceStore(pay).open()
+            pay.idempotency.backend = store
+        """
+        provider, identifier = Scheduler.key(invoice)
+        async with self.engine.begin() as conn:
+            result = await conn.execute(update(invoices).where(
+                invoices.c.provider == provider, invoices.c.identifier == identifier
+            ).values(idempotency_key=key))
+            if result.rowcount == 0:
+                await conn.execute(insert(invoices).values(**self._row(invoice, datetime.now()), idempotency_key=key))
+
+    async def pending(self, provider: str = None) -> AsyncIterator[Invoice]:
+        """
+        Streams invoices that are not paid or expired yet, oldest first, fetching batch_size rows at a time
+
+        Args:
+            provider: Only stream invoices of this provider
+        """
+        query = select(invoices).where(invoices.c.status.not_in(TERMINAL_STATUSES))
+        if provider is not None:
+            query = query.where(invoices.c.provider == provider)
+        query = query.order_by(invoices.c.created_at).execution_options(yield_per=self.batch_size)
+        async with self.engine.connect() as conn:
+            async for row in await conn.stream(query):
+                yield self._invoice(row)
+
+    async def oldest_pending(self, provider: str) -> datetime | None:
+        """
+        Returns creation time of the oldest invoice of provider that is not paid or expired yet, None if there is none
+
+        Can be used as since for EasyPay.reconcile()
+        """
+        async with self.engine.connect() as conn:
+            return (await conn.execute(select(func.min(invoices.c.created_at)).where(
+                invoices.c.provider == provider, invoices.c.status.not_in(TERMINAL_STATUSES)
+            ))).scalar()
+
+    async def restore(self, provider: str = None) -> int:
+        """
+        Tracks all pending invoices in the EasyPay scheduler again, e.g. after restart
+
+        Returns:
+            int: Number of restored invoices
+        """
+        restored = 0
+        async for invoice in self.pending(provider):
+            self.pay.watch(invoice)
+            restored += 1
+        return restored
+
+    def _on_status(self, invoice: Invoice, old_status: str) -> None:
+        self._dirty[Scheduler.key(invoice)] = invoice.status
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = create_task(self._flush_later())
+
+    async def _flush_later(self) -> None:
+        while self._dirty:
+            await sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Wasn't able to write {len(self._dirty)} invoice status changes, "
+                      f"retrying in {self.flush_interval}s: {e!r}")
+
+    async def flush(self) -> None:
+        """
+        Writes status changes collected from the scheduler in one batch, if writing fails they are kept
+        to be written by the next flush
+        """
+        dirty, self._dirty = self._dirty, {}
+        if not dirty:
+            return
+        try:
+            await self.update_statuses(dirty)
+        except BaseException:
+            self._dirty = {**dirty, **self._dirty}  # changes collected meanwhile are newer
+            raise
+
+    async def assign_shards(self) -> int:
+        """
+        Sets shard of invoices saved before sharding was added, they are not polled by ShardWorker otherwise
+
+        Returns:
+            int: Number of updated invoices
+        """
+        statement = update(invoices).where(invoices.c.id == bindparam('b_id')).values(shard=bindparam('b_shard'))
+        assigned = 0
+        while True:
+            async with self.engine.begin() as conn:
+                rows = (await conn.execute(
+                    select(invoices.c.id, invoices.c.provider, invoices.c.identifier)
+                    .where(invoices.c.shard.is_(None)).limit(self.batch_size)
+                )).all()
+                if not rows:
+                    return assigned
+                await conn.execute(statement, [
+                    {'b_id': row.id, 'b_shard': self.shard(row.provider, row.identifier)} for row in rows
+                ])
+            assigned += len(rows)
+
+    def __repr__(self) -> str:
+        return f'InvoiceStore({self.engine.url!r})'
+
+
+class ShardWorker:
+    """
+    Polls pending invoices of an InvoiceStore together with workers in other processes or hosts
+
+    Invoices are spread over store.shards shards. Every worker holds time-limited leases on its fair share of
+    them (shards / live workers) and polls only invoices of leased shards, so no invoice is checked by two workers.
+    Leases and the worker heartbeat are renewed on every pass; a worker that dies stops renewing and once its
+    leases expire the shards are taken over by the others. When a new worker joins, the others give up shards
+    above their share on their next pass.
+
+    Lease expiry is compared against the database clients' clocks, lease_time should be well above clock skew
+    between hosts and above the duration of one batch check.
+    """
+    def __init__(self, store: InvoiceStore, owner: str = None, lease_time: float = 30, interval: float = 5,
+                 lifetime: float = 86400, concurrency: int = 32, max_failures: int = 10,
+                 on_status: Callable[[Invoice, str], Awaitable | None] = None) -> None:
+        """
+        Args:
+            store: Opened InvoiceStore, its EasyPay is used for checks
+            owner: Unique worker name, hostname:pid:random if not provided
+            lease_time: Seconds a shard lease is valid without renewal
+            interval: Seconds between polling passes, must be below lease_time
+            lifetime: Seconds after creation when an invoice is marked expired instead of checked
+            concurrency: Maximum number of simultaneous provider requests
+            max_failures: Consecutive passes an invoice failed to be checked in before this worker parks it
+                (stops checking it until restart), failures of one invoice never stop the others
+            on_status: Called as on_status(invoice, old_status) for every status change, can be a coroutine
+
+        Raises:
+            ValueError: If interval is not below lease_time
+
+        Example:
+            async with InvoiceStore(pay, 'postgresql+asyncpg://...') as store:
+                await ShardWorker(store).run()
+        """
+        if interval >= lease_time:
+            raise ValueError('Shard worker interval must be below lease_time, leases expire between passes otherwise')
+        self.store = store
+        self.owner = owner or f'{gethostname()}:{getpid()}:{uuid4().hex[:8]}'
+        self.lease_time = lease_time
+        self.interval = interval
+        self.lifetime = lifetime
+        self.concurrency = concurrency
+        self.max_failures = max_failures
+        self.on_status = on_status
+        self.shards: Set[int] = set()
+        self.failures: Dict[tuple, int] = {}
+        self.parked: Set[tuple] = set()
+        self.checked = 0
+        self.changed = 0
+
+    async def claim(self) -> Set[int]:
+        """
+        Renews leases of this worker, takes free or expired shards up to its fair share and releases the rest
+
+        Returns:
+            Set[int]: Shards leased by this worker
+        """
+        now = datetime.now()
+        expires_at = now + timedelta(seconds=self.lease_time)
+        async with self.store.engine.begin() as conn:
+            heartbeat = await conn.execute(update(workers).where(workers.c.owner == self.owner)
+                                           .values(expires_at=expires_at))
+            if heartbeat.rowcount == 0:
+                await conn.execute(insert(workers).values(owner=self.owner, expires_at=expires_at))
+            await conn.execute(delete(workers).where(workers.c.expires_at < now))
+            await conn.execute(update(leases).where(leases.c.owner == self.owner, leases.c.expires_at >= now)
+                               .values(expires_at=expires_at))
+            live = (await conn.execute(select(func.count()).select_from(workers)
+                                       .where(workers.c.expires_at >= now))).scalar()
+            rows = (await conn.execute(select(leases.c.shard, leases.c.owner, leases.c.expires_at))).all()
+        owned = sorted(row.shard for row in rows if row.owner == self.owner and row.expires_at >= now)
+        share = ceil(self.store.shards / max(live, 1))
+        if len(owned) > share:
+            async with self.store.engine.begin() as conn:
+                await conn.execute(update(leases).where(leases.c.shard.in_(owned[share:]), leases.c.owner == self.owner)
+                                   .values(owner=None, expires_at=None))
+            owned = owned[:share]
+        free = [row.shard for row in rows if row.owner is None or row.expires_at < now]
+        for shard in free[:share - len(owned)]:
+            # conditional update: of the workers racing for a shard only one matches the row
+            async with self.store.engine.begin() as conn:
+                result = await conn.execute(update(leases).where(
+                    leases.c.shard == shard, or_(leases.c.owner.is_(None), leases.c.expires_at < now)
+                ).values(owner=self.owner, expires_at=expires_at))
+            if result.rowcount == 1:
+                owned.append(shard)
+        self.shards = set(owned)
+        return self.shards
+
+    async def renew(self) -> bool:
+        """
+        Extends leases of this worker
+
+        Returns:
+            bool: False if some lease was lost (expired and taken by another worker)
+        """
+        if not self.shards:
+            return True
+        now = datetime.now()
+        async with self.store.engine.begin() as conn:
+            result = await conn.execute(update(leases).where(
+                leases.c.shard.in_(sorted(self.shards)), leases.c.owner == self.owner, leases.c.expires_at >= now
+            ).values(expires_at=now + timedelta(seconds=self.lease_time)))
+        return result.rowcount == len(self.shards)
+
+    async def release(self) -> None:
+        """
+        Gives up all leases of this worker, so other workers take its shards over without waiting for expiry
+        """
+        async with self.store.engine.begin() as conn:
+            await conn.execute(update(leases).where(leases.c.owner == self.owner).values(owner=None, expires_at=None))
+            await conn.execute(delete(workers).where(workers.c.owner == self.owner))
+        self.shards = set()
+
+    async def _due(self, after: int) -> List[Any]:
+        query = select(invoices).where(
+            invoices.c.shard.in_(sorted(self.shards)), invoices.c.status.not_in(TERMINAL_STATUSES),
+            invoices.c.id > after
+        ).order_by(invoices.c.id).limit(self.store.batch_size)
+        async with self.store.engine.connect() as conn:
+            return (await conn.execute(query)).all()
+
+    async def poll(self) -> int:
+        """
+        Claims shards and checks all pending invoices in them once, batch_size invoices at a time
+
+        Returns:
+            int: Number of invoices whose status changed
+        """
+        await self.claim()
+        changed = 0
+        after = 0
+        deadline = datetime.now() - timedelta(seconds=self.lifetime)
+        while self.shards and (rows := await self._due(after)):
+            after = rows[-1].id
+            if not await self.renew():
+                break  # lease lost, shards are re-claimed on the next pass
+            statuses = {}
+            old = {}
+            due = []
+            for row in rows:
+                if (row.provider, row.identifier) in self.parked:
+                    continue
+                invoice = self.store._invoice(row)
+                old[id(invoice)] = invoice.status
+                if invoice.created_at is not None and invoice.created_at < deadline:
+                    invoice.status = 'expired'
+                    statuses[Scheduler.key(invoice)] = invoice.status
+                    await self._notify(invoice, old[id(invoice)])
+                else:
+                    due.append(invoice)
+            async for invoice in self.store.pay.check_many(due, concurrency=self.concurrency, on_error=self._failed):
+                self.checked += 1
+                self.failures.pop(Scheduler.key(invoice), None)
+                if invoice.status != old[id(invoice)]:
+                    statuses[Scheduler.key(invoice)] = invoice.status
+                    await self._notify(invoice, old[id(invoice)])
+            if statuses:
+                await self.store.update_statuses(statuses)
+            changed += len(statuses)
+        self.changed += changed
+        return changed
+
+    def _failed(self, invoice: Invoice, error: Exception) -> None:
+        key = Scheduler.key(invoice)
+        failures = self.failures[key] = self.failures.get(key, 0) + 1
+        if failures >= self.max_failures:
+            print(f'Shard worker {self.owner} parked invoice {invoice.identifier} of {invoice.provider} provider '
+                  f'after {failures} failed checks: {error!r}')
+            del self.failures[key]
+            self.parked.add(key)
+
+    async def _notify(self, invoice: Invoice, old_status: str) -> None:
+        if self.on_status is not None:
+            result = self.on_status(invoice, old_status)
+            if isawaitable(result):
+                await result
+
+    async def run(self) -> None:
+        """
+        Polls every interval seconds until cancelled, then releases leases
+        """
+        try:
+            while True:
+                try:
+                    await self.poll()
+                except CancelledError:
+                    raise
+                except Exception as e:
+                    print(f'Shard worker {self.owner} failed to poll invoices: {e!r}')
+                await sleep(self.interval)
+        finally:
+            await self.release()
+
+    def __repr__(self) -> str:
+        return f'ShardWorker(owner={self.owner!r}, shards={len(self.shards)}, checked={self.checked})'
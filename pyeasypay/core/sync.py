@@ -0,0 +1,149 @@
+from asyncio import new_event_loop, run_coroutine_threadsafe
+from collections.abc import Coroutine, Iterable
+from concurrent.futures import TimeoutError
+from threading import Event, Thread, get_ident
+from typing import Any, List, Self
+
+from .pay import EasyPay, Invoice, Provider
+
+
+class SyncEasyPay:
+    """
+    Blocking EasyPay for synchronous code (Django, Flask, scripts)
+
+    One event loop runs in a background thread for the lifetime of the instance and every call is submitted
+    to it, so connections stay pooled between calls and calls made from many threads at once run concurrently
+    on that loop. Unlike asyncio.run() per call, no loop or connection is created per invoice.
+    """
+    def __init__(self, **kwargs) -> None:
+        """
+        Starts the background event loop and creates EasyPay on it
+
+        Args:
+            **kwargs: EasyPay keyword arguments (providers, connection_limit, scheduler, ...)
+
+        Example:
+            pay = SyncEasyPay(providers=[Provider('cryptobot', api_key='...')])  # once, e.g. at module level
+            invoice = pay.create_invoice(15, 'TON', 'cryptobot')  # from any thread
+            paid = pay.check(invoice)
+        """
+        self.loop = new_event_loop()
+        started = Event()
+        self._thread = Thread(target=self._run, args=(started,), name='pyeasypay-loop', daemon=True)
+        self._thread.start()
+        started.wait()
+        try:
+            self.pay = self.run(self._create(kwargs))
+        except BaseException:
+            self._stop()
+            raise
+
+    def _run(self, started: Event) -> None:
+        self.loop.call_soon(started.set)
+        self.loop.run_forever()
+
+    @staticmethod
+    async def _create(kwargs: dict) -> EasyPay:
+        return EasyPay(**kwargs)
+
+    def run(self, coroutine: Coroutine, timeout: float = None) -> Any:
+        """
+        Runs coroutine on the background loop and waits for its result, safe to call from any thread
+
+        Args:
+            coroutine: Coroutine, e.g. pay.pay.balance('cryptobot')
+            timeout: Seconds to wait, the coroutine is cancelled if it takes longer, no limit if not provided
+
+        Returns:
+            Any: Result of the coroutine
+
+        Raises:
+            RuntimeError: If called from the background loop itself (it would wait for itself forever)
+                or after close()
+            TimeoutError: If timeout passed
+        """
+        if self._thread.ident == get_ident():
+            coroutine.close()
+            raise RuntimeError('SyncEasyPay methods can not be called from its own event loop, await EasyPay instead')
+        if self.loop.is_closed():
+            coroutine.close()
+            raise RuntimeError('SyncEasyPay is closed')
+        future = run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            return future.result(timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    def create_invoice(self, amount: int | float, currency: str = 'USD', provider: str | Provider = None,
+                       identifier=None, run_check: bool = False, timeout: float = None, **kwargs) -> Invoice:
+        """
+        Creates invoice, see EasyPay.create_invoice
+
+        Args:
+            timeout: Seconds to wait for the invoice, no limit if not provided
+        """
+        return self.run(self.pay.create_invoice(amount, currency, provider, identifier, run_check, **kwargs), timeout)
+
+    def create_invoices(self, items: Iterable, concurrency: int = 32, run_check: bool = False,
+                        timeout: float = None) -> List[Invoice | Exception]:
+        """
+        Creates many invoices concurrently, see EasyPay.create_invoices
+
+        Returns:
+            List[Invoice | Exception]: Invoice or the exception for every item, in input order
+        """
+        async def collect():
+            return [result async for result in self.pay.create_invoices(items, concurrency, run_check)]
+
+        return self.run(collect(), timeout)
+
+    def check(self, invoice: Invoice, return_bool: bool = False, timeout: float = None) -> str | bool:
+        """
+        Checks invoice status, see Invoice.check
+        """
+        return self.run(invoice.check(return_bool), timeout)
+
+    def check_many(self, invoices: Iterable[Invoice], concurrency: int = 32, batch_size: int = 100,
+                   timeout: float = None) -> List[Invoice]:
+        """
+        Checks status of many invoices concurrently, see EasyPay.check_many
+
+        Returns:
+            List[Invoice]: Invoices with updated status, in completion order
+        """
+        async def collect():
+            return [invoice async for invoice in self.pay.check_many(invoices, concurrency, batch_size)]
+
+        return self.run(collect(), timeout)
+
+    def balance(self, provider: str | Provider, timeout: float = None) -> Any:
+        """
+        Gets account balance from provider, see EasyPay.balance
+        """
+        return self.run(self.pay.balance(provider), timeout)
+
+    def close(self) -> None:
+        """
+        Closes EasyPay connections and stops the background loop, does nothing if already closed
+        """
+        if self.loop.is_closed():
+            return
+        try:
+            self.run(self.pay.close())
+        finally:
+            self._stop()
+
+    def _stop(self) -> None:
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def __repr__(self) -> str:
+        return f'SyncEasyPay({self.pay!r})'
@@ -0,0 +1,143 @@
+from collections.abc import Awaitable, Callable, Mapping
+from inspect import isawaitable
+from typing import Any
+from weakref import WeakValueDictionary
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from .registry import registry
+from .statuses import StatusCache
+
+
+class WebhookHandler:
+    """
+    Receives provider payment notifications and updates matching invoices, replacing status polling
+    """
+    def __init__(self, pay: Any, resolver: Callable[[str, str], Any | Awaitable[Any]] = None) -> None:
+        """
+        WebhookHandler initialization, usually created with EasyPay.webhook()
+
+        Invoices are matched by provider and identifier: first among invoices passed to track(),
+        then among invoices tracked by the EasyPay scheduler, then through resolver. If none of them
+        knows the invoice, a new one is created with pay.invoice().
+
+        Provider kwargs needed to verify signatures:
+            cryptobot: api_key
+            crystalpay: salt (from cash register settings)
+            aaio: secret2 (2nd secret key)
+
+        Args:
+            pay: EasyPay instance
+            resolver: Callable (or coroutine) resolver(provider, identifier) returning Invoice or None,
+                e.g. loading it from your storage
+        """
+        self.pay = pay
+        self.resolver = resolver
+        self.invoices = WeakValueDictionary()
+        self._runner = None
+
+    def track(self, invoice: Any) -> Any:
+        """
+        Remembers invoice so notifications for it update this very object
+
+        Returns:
+            Invoice: The same invoice
+        """
+        provider = getattr(invoice, 'provider', None)
+        self.invoices[(getattr(provider, 'name', provider), str(invoice.identifier))] = invoice
+        return invoice
+
+    async def find(self, provider: str, identifier: Any, account: str = None) -> Any:
+        invoice = self.invoices.get((provider, str(identifier)))
+        if invoice is None:
+            invoice = self.pay.scheduler.find(provider, identifier)
+        if invoice is None and self.resolver is not None:
+            invoice = self.resolver(provider, str(identifier))
+            if isawaitable(invoice):
+                invoice = await invoice
+        if invoice is None:
+            invoice = await self.pay.invoice(provider=provider, identifier=identifier, account=account)
+        return invoice
+
+    async def handle(self, provider: str, headers: Mapping[str, str], body: bytes) -> Any:
+        """
+        Verifies notification and updates invoice status, framework-agnostic part of the handler
+
+        Status change is delivered to EasyPay scheduler subscribers (scheduler.on_status and scheduler.updates())
+        and the invoice is no longer polled once paid
+
+        Args:
+            provider: Provider name
+            headers: Request headers
+            body: Raw request body
+
+        Returns:
+            Invoice: Updated invoice
+
+        Raises:
+            ValueError: If provider was not added, can't receive webhooks or signature is invalid
+        """
+        accounts = self.pay.provider.accounts.get(provider)
+        if not accounts:
+            raise ValueError(f'Provider {provider} was not added, please add it first')
+        module = registry.module(provider)
+        if not hasattr(module, 'parse_webhook'):
+            raise ValueError(f'Provider {provider} does not support webhooks')
+        headers = CIMultiDict(headers)
+        for index, creds in enumerate(accounts):
+            try:
+                identifier, status = module.parse_webhook(creds, headers, body)
+                break
+            except ValueError:
+                if index == len(accounts) - 1:
+                    raise
+        invoice = await self.find(provider, identifier, getattr(creds, 'account', None))
+        # only statuses reported by the provider are cached, not the scheduler's local lifetime expiry
+        self.pay.provider.statuses.put(StatusCache.key(invoice), status)
+        await self.pay.scheduler.update(invoice, status)
+        return invoice
+
+    async def __call__(self, request: web.Request) -> web.Response:
+        """
+        aiohttp request handler, provider name is taken from the {provider} part of the route
+        """
+        try:
+            await self.handle(request.match_info['provider'], request.headers, await request.read())
+        except (ValueError, KeyError) as e:
+            return web.Response(status=400, text=str(e))
+        return web.Response(text='OK')
+
+    def app(self, path: str = '/webhook/{provider}') -> web.Application:
+        """
+        Returns aiohttp application with the handler mounted at path, can be added to your app as a subapp
+
+        Set callback_url (or webhook url in provider settings) to e.g. https://example.com/webhook/crystalpay
+        """
+        app = web.Application()
+        app.router.add_post(path, self)
+        return app
+
+    async def start(self, host: str = '0.0.0.0', port: int = 8080, path: str = '/webhook/{provider}') -> int:
+        """
+        Starts embedded webhook server in the running event loop
+
+        Returns:
+            int: Port the server is listening on (useful with port=0)
+        """
+        self._runner = web.AppRunner(self.app(path))
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, host, port)
+        await site.start()
+        return site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        """
+        Stops embedded webhook server
+        """
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    def __repr__(self) -> str:
+        return f'WebhookHandler(tracked={len(self.invoices)}, running={self._runner is not None})'
@@ -20,8 +20,8 @@ setup(
         'aiohttp',
         'python-dotenv',
         'aiocryptopay',
-        'requests',
-        'sqlalchemy'
+        'sqlalchemy[asyncio]',
+        'aiosqlite'
     ],
     classifiers=[
         'Programming Language :: Python :: 3.11',